@@ -6,10 +6,12 @@
 #SBATCH --time=10
 #SBATCH --qos=normal
 #SBATCH --export=NONE
+# --mem and --time are defaults for one member; BC_timeslice_calling.py sets them on the sbatch
+# command line for the number of members and the memory budget of each job
 
-echo $1 $2 $3 $4 $5 $6 $7 $8 $9
+echo $1 $2 $3 $4 $5 $6 $7 $8 $9 ${10} ${11}
 module load scitools
-python BC_timeslice_run.py $1 $2 $3 $4 $5 $6 $7 $8 $9
+python BC_timeslice_run.py $1 $2 $3 $4 $5 $6 $7 $8 $9 ${10} ${11}
 # python BC_timeslice_run_monthly.py $1 $2 $3 $4 $5 $6 $7 $8 $9
 # python BC_Reading_timeslice_run.py $1 $2 $3 $4 $5 $6 $7 $8 $9
 
@@ -2,7 +2,18 @@ import sys
 import subprocess
 
 
-def run_all(project_name, region_name, obsvar, rcmvar, memberIDs, monstart=12, monend=11):
+def run_all(project_name, region_name, obsvar, rcmvar, memberIDs, monstart=12, monend=11, members_per_job=1,
+    engine='sdm', max_memory=None, job_memory=2000, minutes_per_member=10):
+    '''
+    Submits a bias-correction job for each scenario period and group of members_per_job
+    ensemble members. The members of a job share one copy of the observations.
+    engine selects the method in BC_timeslice_run.py: 'sdm', 'isimip3', 'window' or 'pycat'.
+    max_memory -- If given, the memory budget in MB for correcting the region in tiles of
+        grid columns (see tiled_bc.py). The jobs then ask for 500 MB more than this.
+    job_memory -- The memory in MB asked for by each job without max_memory. The members of a job
+        are corrected one after the other, so it does not depend on members_per_job.
+    minutes_per_member -- The time limit of each job is this times the number of members in it
+    '''
 
     year_start = [1980, 2020, 2060]  #  1980, 2020, 2060]
     year_end =   [2000, 2040, 2080]  #  2000, 2040, 2080]
@@ -10,15 +21,19 @@ def run_all(project_name, region_name, obsvar, rcmvar, memberIDs, monstart=12, m
 # Replace any spaces in the region name with underscores
     rname = '_'.join(region_name.split())
 
-    for m in memberIDs:
+    for i in range(0, len(memberIDs), members_per_job):
         for y in list(range(len(year_start))):
-            ID = '{:02d}'.format(m)
+            ID = ','.join(['{:02d}'.format(m) for m in memberIDs[i:i+members_per_job]])
             start_month = '{:02d}'.format(monstart)
             end_month = '{:02d}'.format(monend)
 
-            cmd = ' '.join(['sbatch', 'BC_timeslice_batch.sh', project_name, rname, \
+# The options given to sbatch override those in BC_timeslice_batch.sh
+            nmembers = len(memberIDs[i:i+members_per_job])
+            mem = job_memory if max_memory is None else max_memory + 500
+            cmd = ' '.join(['sbatch', f'--mem={mem}', f'--time={minutes_per_member * nmembers}', \
+                 'BC_timeslice_batch.sh', project_name, rname, \
                  obsvar, rcmvar, ID, str(year_start[y]), str(year_end[y]), \
-                 start_month, end_month])
+                 start_month, end_month, engine] + ([] if max_memory is None else [str(max_memory)]))
 
             print(cmd)
 
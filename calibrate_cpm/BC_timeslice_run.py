@@ -2,9 +2,17 @@ import os
 import sys
 import getpass
 import datetime
+import numpy as np
+import iris
 import load_data
-from pyCAT.pycat.io import Dataset
-from pyCAT.pycat.esd import ScaledDistributionMapping
+import parallel_sdm
+import baseline_cache
+import shared_obs
+import time_index
+import tiled_bc
+import bc_filenames
+import window_sdm
+import region_mask
 
 
 def make_output_filename(var_name, ID, year_start, year_end, monstart, monend, month_number):
@@ -25,8 +33,61 @@ def make_output_filename(var_name, ID, year_start, year_end, monstart, monend, m
     return '_'.join([fhead, fend])
 
 
+def correct_by_month(obs_filename, mod_filename, sce_filename, var_name, dout, nworkers=None,
+    cache_dir=None, ensemble_member=None, obs_memmap=None, engine='sdm'):
+    '''
+    Bias-corrects the scenario data one calendar month at a time with the Scaled Distribution
+    Mapping in sdm.py, or the trend-preserving quantile mapping in isimip3_qm.py, or in moving
+    windows of days with window_sdm.py, and writes one file per month to directory dout. The
+    files are named as those written by pyCAT, starting with the name of the method (see
+    bc_filenames.py), so they can be merged by merge_timeseries.py.
+
+    obs_filename -- The observations for the baseline period
+    mod_filename -- The model data for the baseline period
+    sce_filename -- The model data to be corrected
+    var_name -- The name of the variable, used in the names of the output files
+    nworkers -- The number of processes correcting months and tiles of the grid in parallel
+        (default: the number of CPUs allocated to the job)
+    cache_dir -- If given, the fits of the baseline are read from or saved to a cache in this
+        directory (see baseline_cache.py), so they are only made once for all scenario periods
+    ensemble_member -- The UKCP18 ensemble member, an integer between 1 and 15, which names the cache
+    obs_memmap -- The observations decoded by shared_obs.decode_obs, which are read instead of
+        obs_filename (which is then only used for its metadata)
+    engine -- 'sdm' or 'isimip3', as for parallel_sdm.correct_months, or 'window' for
+        window_sdm.correct_windows, with its default window and step. The baseline cache is only
+        used with 'sdm'.
+    '''
+
+# With decoded observations, the obs cube is not realised, so only its metadata are read
+    if cache_dir is None:
+        obs = iris.load_cube(obs_filename)
+        mod = iris.load_cube(mod_filename)
+        baseline = None
+    else:
+        obs = mod = None
+        baseline = baseline_cache.load_or_fit_baseline(obs_filename, mod_filename, cache_dir, var_name,
+            ensemble_member, obs_memmap=obs_memmap)
+    sce = iris.load_cube(sce_filename)
+
+    if engine == 'window':
+        print('calibrating in windows of days: '+datetime.datetime.now().strftime("%H:%M:%S"))
+        corrected = window_sdm.correct_windows(obs, mod, sce, nworkers=nworkers, obs_memmap=obs_memmap)
+    else:
+        print('calibrating all months: '+datetime.datetime.now().strftime("%H:%M:%S"))
+        corrected = parallel_sdm.correct_months(obs, mod, sce, nworkers=nworkers, baseline=baseline,
+            obs_memmap=obs_memmap, engine=engine)
+    index = time_index.TimeIndex(corrected)
+
+    for month_number in list(range(1, 13)):
+        sce_mth = corrected[index.month(month_number)]
+
+        print(f'writing data for month {month_number}: '+datetime.datetime.now().strftime("%H:%M:%S"))
+        iris.save(sce_mth, os.path.join(dout, bc_filenames.monthly_filename(var_name, sce_mth, month_number, engine)))
+
+
 def calibrate_ukcp_local(user_id, project_name, area_name, varobs, varrcm, ensemble_member,
-    year_start, year_end, monstart, monend, resolution='2.2km'):
+    year_start, year_end, monstart, monend, resolution='2.2km', engine='sdm', obs_memmap=None,
+    max_memory=None):
     '''
     Bias-corrects climate projections using Scaled Distribution Mapping
 
@@ -38,11 +99,22 @@ def calibrate_ukcp_local(user_id, project_name, area_name, varobs, varrcm, ensem
     year_end -- The last year of data to correct in the scenario data
     monstart -- The first month of data to correct in the scenario data
     monend -- The last month of data to correct in the scenario data
+    engine -- 'sdm' to use the implementation in sdm.py, 'isimip3' for the trend-preserving quantile
+        mapping in isimip3_qm.py, 'window' for SDM in moving windows of days (window_sdm.py), which
+        avoids jumps at the boundaries of the months, or 'pycat' to use pyCAT
+    obs_memmap -- The observations decoded by shared_obs.decode_obs, if they are shared with other members
+    max_memory -- If given, the grid is corrected in tiles of columns whose data fit in max_memory MB
+        (see tiled_bc.py), for regions too large to be held in memory at once. The baseline cache
+        is then not used, and obs_memmap must not be given: the decoded observations hold the whole
+        grid, and each tile reads only its own columns of the observations file instead.
 
     monstart and monend should be 12 and 11 respectively, as UKCP projections run from December to
     November in each year
     '''
 
+    if max_memory is not None and obs_memmap is not None:
+        raise ValueError('obs_memmap cannot be used when correcting in tiles with max_memory')
+
     print('start: '+datetime.datetime.now().strftime("%H:%M:%S"))
 
 # Baseline period of the UKCP Local projections, and obs data
@@ -59,6 +131,9 @@ def calibrate_ukcp_local(user_id, project_name, area_name, varobs, varrcm, ensem
     except FileExistsError:
         pass
 
+# The fits of the baseline are cached, to be reused by the other scenario periods
+    cache_dir = os.path.join('/net/spice/scratch/', user_id, 'CReDo/cpm_calibrated/baseline_cache')
+
 # Set up directories and filenames for obs, model baseline and model scenario data
     obs_dir, obs_filename = load_data.make_filename(user_id, project_name, area_name, 'obs', varobs,
         [bl_year_start,bl_year_end], monstart=bl_mon_start, monend=bl_mon_end, resolution=resolution)
@@ -69,20 +144,60 @@ def calibrate_ukcp_local(user_id, project_name, area_name, varobs, varrcm, ensem
         [year_start,year_end], ensemble_member=ensemble_member, monstart=monstart, monend=monend,
         resolution=resolution)
 
-    print('loading obs hist: '+datetime.datetime.now().strftime("%H:%M:%S"))
-    obs = Dataset(obs_dir, obs_filename)
-    print('loading rcm hist: '+datetime.datetime.now().strftime("%H:%M:%S"))
-    mod = Dataset(mod_dir, mod_filename)
-    print('loading rcm proj: '+datetime.datetime.now().strftime("%H:%M:%S"))
-    sce = Dataset(sce_dir, sce_filename)
+    if engine == 'pycat':
+        from pyCAT.pycat.io import Dataset
+        from pyCAT.pycat.esd import ScaledDistributionMapping
+
+# pyCAT needs the data on the (time, y, x) grid, as written by prep_cpm_data.py and regrid_obs.py
+# without 'compress'
+        for data_dir, filename in [(obs_dir, obs_filename), (mod_dir, mod_filename), (sce_dir, sce_filename)]:
+            if region_mask.is_compressed(iris.load_cube(os.path.join(data_dir, filename))):
+                raise ValueError(f'{filename} is in the compact (time, cell) layout, which pyCAT cannot read')
+
+        print('loading obs hist: '+datetime.datetime.now().strftime("%H:%M:%S"))
+        obs = Dataset(obs_dir, obs_filename)
+        print('loading rcm hist: '+datetime.datetime.now().strftime("%H:%M:%S"))
+        mod = Dataset(mod_dir, mod_filename)
+        print('loading rcm proj: '+datetime.datetime.now().strftime("%H:%M:%S"))
+        sce = Dataset(sce_dir, sce_filename)
 
 # Perform the bias correction
-    sdm = ScaledDistributionMapping(obs, mod, sce, work_dir=dout)
-    sdm.correct()
+        sdm_pycat = ScaledDistributionMapping(obs, mod, sce, work_dir=dout)
+        sdm_pycat.correct()
+    elif max_memory is not None:
+        tiled_bc.correct_in_tiles(os.path.join(obs_dir, obs_filename), os.path.join(mod_dir, mod_filename),
+            os.path.join(sce_dir, sce_filename), varrcm, dout, memory_mb=max_memory, engine=engine)
+    else:
+        correct_by_month(os.path.join(obs_dir, obs_filename), os.path.join(mod_dir, mod_filename),
+            os.path.join(sce_dir, sce_filename), varrcm, dout, cache_dir=cache_dir if engine == 'sdm' else None,
+            ensemble_member=ensemble_member, obs_memmap=obs_memmap, engine=engine)
 
     print('end: '+datetime.datetime.now().strftime("%H:%M:%S"))
 
 
+def calibrate_members(user_id, project_name, area_name, varobs, varrcm, ensemble_members,
+    year_start, year_end, monstart, monend, resolution='2.2km', engine='sdm'):
+    '''
+    Bias-corrects several ensemble members in one process. The observations for the baseline
+    period are decoded once into a memory-mapped file, which is shared by all the members and
+    worker processes, so they are read once rather than once per member.
+
+    ensemble_members -- A list of the UKCP18 ensemble members, integers between 1 and 15
+    The other arguments are as for calibrate_ukcp_local.
+    '''
+
+    obs_dir, obs_filename = load_data.make_filename(user_id, project_name, area_name, 'obs', varobs,
+        [1980, 2000], monstart=12, monend=11, resolution=resolution)
+    memmap_dir = os.path.join('/net/spice/scratch/', user_id, 'CReDo/cpm_calibrated/obs_memmap')
+
+    print('decoding obs hist: '+datetime.datetime.now().strftime("%H:%M:%S"))
+    obs_memmap = shared_obs.decode_obs(os.path.join(obs_dir, obs_filename), memmap_dir)
+
+    for ensemble_member in ensemble_members:
+        calibrate_ukcp_local(user_id, project_name, area_name, varobs, varrcm, ensemble_member,
+            year_start, year_end, monstart, monend, resolution=resolution, engine=engine, obs_memmap=obs_memmap)
+
+
 if __name__ == '__main__':
 
     user_id = getpass.getuser()
@@ -90,11 +205,20 @@ if __name__ == '__main__':
     region_name = sys.argv[2]
     varobs = sys.argv[3]
     varrcm = sys.argv[4]
-    ensemble_member_ID = int(sys.argv[5])
+# One member, or several separated by commas (e.g. 01,04,05) to be corrected in this process
+    ensemble_member_IDs = [int(ID) for ID in sys.argv[5].split(',')]
     year_start = int(sys.argv[6])
     year_end = int(sys.argv[7])
     monstart = int(sys.argv[8])
     monend = int(sys.argv[9])
-
-    calibrate_ukcp_local(user_id, project_name, region_name, varobs, varrcm, ensemble_member_ID, \
-        year_start, year_end, monstart, monend)
+    engine = sys.argv[10] if len(sys.argv) > 10 else 'sdm'
+# The memory budget in MB for correcting large regions in tiles, e.g. 1500
+    max_memory = int(sys.argv[11]) if len(sys.argv) > 11 else None
+
+    if len(ensemble_member_IDs) > 1 and engine in ['sdm', 'isimip3', 'window'] and max_memory is None:
+        calibrate_members(user_id, project_name, region_name, varobs, varrcm, ensemble_member_IDs, \
+            year_start, year_end, monstart, monend, engine=engine)
+    else:
+        for ensemble_member_ID in ensemble_member_IDs:
+            calibrate_ukcp_local(user_id, project_name, region_name, varobs, varrcm, ensemble_member_ID, \
+                year_start, year_end, monstart, monend, engine=engine, max_memory=max_memory)
@@ -4,7 +4,9 @@ import getpass
 import datetime
 import iris
 import load_data
-from pycat.esd.methods import scaled_distribution_mapping
+import parallel_sdm
+import time_index
+import window_sdm
 
 
 def make_output_filename(var_name, ID, year_start, year_end, monstart, monend, month_number):
@@ -25,7 +27,8 @@ def make_output_filename(var_name, ID, year_start, year_end, monstart, monend, m
     return '_'.join([fhead, fend])
 
 
-def calibrate_ukcp_local(user_id, varobs, varrcm, ensemble_member, year_start, year_end, monstart, monend):
+def calibrate_ukcp_local(user_id, varobs, varrcm, ensemble_member, year_start, year_end, monstart, monend,
+    window=None, step=window_sdm.STEP):
     '''
     Bias-corrects climate projections using Scaled Distribution Mapping
 
@@ -37,6 +40,9 @@ def calibrate_ukcp_local(user_id, varobs, varrcm, ensemble_member, year_start, y
     year_end -- The last year of data to correct
     monstart -- The first month of data to correct
     monend -- The last month of data to correct
+    window -- If given, each day is calibrated using the days within this many days of it
+        (see window_sdm.py), rather than by calendar month
+    step -- With window, the number of days between the centres of the windows (see window_sdm.py)
 
     monstart and monend should be 12 and 11 respectively, as UKCP projections run from December to
     November in each year
@@ -72,30 +78,22 @@ def calibrate_ukcp_local(user_id, varobs, varrcm, ensemble_member, year_start, y
     rcm_proj = load_data.load_processed_UKCP18_cpm_data(user_id, varrcm, [year_start, year_end],
         ensemble_member, monstart=monstart, monend=monend)
 
-    clist = iris.cube.CubeList()
 # SDM is designed to calibrate one month at a time (i.e. all January's, then all February's, etc).
-    for month_number in list(range(1, 13)):
-        mcon = iris.Constraint(time=lambda cell: cell.point.month == month_number)
-
-        obs_mth = obs.extract(mcon)
-        rcm_mth = rcm_hist.extract(mcon)
-        sce_mth = rcm_proj.extract(mcon)
-
-# The SDM implementation needs the scenario data in a cubelist
-        clist.append(sce_mth)
-
-        print(f'calibrating and writing data for month {month_number}: '+datetime.datetime.now().strftime("%H:%M:%S"))
-        print(obs_mth)
-        print(rcm_mth)
-        print(sce_mth)
-        print(clist)
-        scaled_distribution_mapping(obs_mth, rcm_mth, clist)
+# The months, and tiles of the grid, are calibrated in parallel by as many processes as there are CPUs.
+# Alternatively each day is calibrated with a moving window of days around it, which avoids jumps
+# at the boundaries of the months. The output is written by month in either case.
+    if window is None:
+        print('calibrating all months: '+datetime.datetime.now().strftime("%H:%M:%S"))
+        rcm_corrected = parallel_sdm.correct_months(obs, rcm_hist, rcm_proj)
+    else:
+        print(f'calibrating with a window of +/- {window} days: '+datetime.datetime.now().strftime("%H:%M:%S"))
+        rcm_corrected = window_sdm.correct_windows(obs, rcm_hist, rcm_proj, half_width=window, step=step)
+    index = time_index.TimeIndex(rcm_corrected)
 
+    for month_number in list(range(1, 13)):
+        print(f'writing data for month {month_number}: '+datetime.datetime.now().strftime("%H:%M:%S"))
         fout = make_output_filename(varrcm, ID, year_start, year_end, monstart, monend, month_number)
-        iris.save(clist[0], os.path.join(dout, fout))
-
-# Clear clist for the next set of scenario data
-        clist.pop()
+        iris.save(rcm_corrected[index.month(month_number)], os.path.join(dout, fout))
 
     print('end: '+datetime.datetime.now().strftime("%H:%M:%S"))
 
@@ -110,5 +108,8 @@ if __name__ == '__main__':
     year_end = int(sys.argv[5])
     monstart = int(sys.argv[6])
     monend = int(sys.argv[7])
+    window = int(sys.argv[8]) if len(sys.argv) > 8 else None
+    step = int(sys.argv[9]) if len(sys.argv) > 9 else window_sdm.STEP
 
-    calibrate_ukcp_local(user_id, varobs, varrcm, ensemble_member_ID, year_start, year_end, monstart, monend)
+    calibrate_ukcp_local(user_id, varobs, varrcm, ensemble_member_ID, year_start, year_end, monstart, monend,
+        window=window, step=step)
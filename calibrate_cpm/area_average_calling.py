@@ -31,6 +31,31 @@ def run_all(var_name, memberID, year_ranges, monstart, monend):
     return
 
 
+def run_polygon_means(var_names, memberID, year_ranges, monstart, monend):
+    """
+    Launches one batch job to calculate the area means over the polygon of the region
+    for all the variables, members and periods
+    """
+
+    mstart = '{:02d}'.format(monstart)
+    mend = '{:02d}'.format(monend)
+    years = ','.join(['{:4d}-{:4d}'.format(y[0], y[1]) for y in year_ranges])
+
+    cmd = ' '.join(['sbatch', 'area_average_batch.sh', 'polygon', ','.join(var_names), ','.join(memberID),
+        years, mstart, mend])
+    print(cmd)
+    try:
+        retcode = subprocess.call(cmd, shell=True)
+        if retcode < 0:
+            print("Child was terminated by signal", -retcode, file=sys.stderr)
+        else:
+            print("Child returned", retcode, file=sys.stderr)
+    except OSError as e:
+        print("Execution failed:", e, file=sys.stderr)
+
+    return
+
+
 if __name__ == '__main__':
 
 # UKCP Local member IDs
@@ -42,4 +67,5 @@ if __name__ == '__main__':
     monend = 11
 
     run_all(var_name, memberID, year_ranges, monstart, monend)
+#   run_polygon_means(['tasmax', 'tasmin', 'pr'], memberID, year_ranges, monstart, monend)
 
@@ -2,10 +2,15 @@ import os
 import sys
 import getpass
 import datetime
+import multiprocessing
 import numpy as np
+import dask.array as da
 import iris
-from scipy import signal
 import load_data
+import grid_descriptor
+import region_weights
+import region_mask
+import parallel_sdm
 
 
 def make_output_filename(var_name, ID, year_start, year_end, monstart, monend):
@@ -25,7 +30,83 @@ def make_output_filename(var_name, ID, year_start, year_end, monstart, monend):
     return '_'.join([fhead, fend])
 
 
-def smooth_data(cube, filter_size=3):
+def _summed_area(values):
+    '''
+    Returns the summed-area table of each 2-D field of values, an array of shape (time, y, x),
+    with a leading row and column of zeros, so that the sum of the block [y0:y1, x0:x1] is
+    S[:, y1, x1] - S[:, y0, x1] - S[:, y1, x0] + S[:, y0, x0].
+    '''
+
+    table = np.zeros((values.shape[0], values.shape[1]+1, values.shape[2]+1))
+    np.cumsum(values, axis=1, out=table[:, 1:, 1:])
+    np.cumsum(table[:, 1:, 1:], axis=2, out=table[:, 1:, 1:])
+
+    return table
+
+
+def box_means(data, filter_sizes, block_length=360):
+    '''
+    Returns a dictionary of the means of data over blocks of filter_size x filter_size grid
+    boxes, for each filter size, as signal.convolve2d with a uniform filter, boundary='symm'
+    and mode='same', but for every time of the (time, y, x) array data at once. data may be
+    lazy (e.g. cube.core_data()), in which case only one block of times is read at a time.
+
+    The sums of the values and of the number of valid boxes in each block are found from
+    summed-area tables, so each filter size costs the same, and the tables are shared by all
+    the filter sizes. Masked boxes are left out of the means, so boxes near the coast are the
+    means of the valid boxes around them, and masked boxes stay masked.
+
+    block_length -- The number of times smoothed at once, which limits the memory used
+    '''
+
+    if data.ndim != 3:
+        raise ValueError(f'The data to smooth must have shape (time, y, x), not {data.shape}; '
+            'data in the compact (time, cell) layout must be expanded with region_mask.expand first')
+
+    ny, nx = data.shape[1:]
+
+# Pad by reflection, as boundary='symm', enough for the largest filter
+    pad = max(filter_sizes) // 2
+    padding = ((0, 0), (pad, pad), (pad, pad))
+    means = {size: np.ma.masked_all(data.shape, dtype=data.dtype) for size in filter_sizes}
+
+# The mask is usually the land-sea mask, the same at every time, so the table of the mask of
+# the first time is made once, and used for every block with the same mask
+    fixed_valid = None
+    for t0 in range(0, data.shape[0], block_length):
+        block = data[t0:t0+block_length]
+        if isinstance(block, da.Array):
+            block = block.compute()
+        valid = ~np.ma.getmaskarray(block)
+        values = np.where(valid, np.ma.getdata(block), 0.)
+
+        if fixed_valid is None:
+            fixed_valid = valid[:1]
+            fixed_counts = _summed_area(np.pad(fixed_valid, padding, mode='symmetric').astype(np.float64))
+        if (valid == fixed_valid).all():
+            counts = fixed_counts
+        else:
+            counts = _summed_area(np.pad(valid, padding, mode='symmetric').astype(np.float64))
+
+        sums = _summed_area(np.pad(values, padding, mode='symmetric'))
+
+        for size in filter_sizes:
+# Each block starts size//2 boxes before the box whose mean it gives
+            lo = pad - size // 2
+            hi = lo + size
+            total = sums[:, hi:hi+ny, hi:hi+nx] - sums[:, lo:lo+ny, hi:hi+nx] \
+                - sums[:, hi:hi+ny, lo:lo+nx] + sums[:, lo:lo+ny, lo:lo+nx]
+            count = counts[:, hi:hi+ny, hi:hi+nx] - counts[:, lo:lo+ny, hi:hi+nx] \
+                - counts[:, hi:hi+ny, lo:lo+nx] + counts[:, lo:lo+ny, lo:lo+nx]
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean = total / np.round(count)
+            means[size][t0:t0+block_length] = np.ma.masked_where(~valid, mean)
+
+    return means
+
+
+def smooth_data(cube, filter_size=3, grid_cube=None):
     '''
     Smooths the data in the cube by calculating spatial average of grid boxes in a
     block filter_size x filter_size
@@ -36,19 +117,35 @@ def smooth_data(cube, filter_size=3):
         7 8 9
 
     Box 5 will contain the average of boxes 1-9 after the smoothing
+
+    grid_cube -- The grid of the region (from grid_descriptor.load_region_grid), needed if the
+        cube is in the compact (time, cell) layout of region_mask.py
     '''
 
-    cube_out = cube.copy()
-    conv_array = np.full((filter_size, filter_size), 1/(filter_size*filter_size), dtype=np.float)
+    return smooth_data_sizes(cube, [filter_size], grid_cube)[0]
+
 
-    for i, c in enumerate(cube.slices_over('time')):
-        c_smooth = signal.convolve2d(c.data.data, conv_array, boundary='symm', mode='same')
-        cube_out[i].data[:,:] = c_smooth
+def smooth_data_sizes(cube, filter_sizes, grid_cube=None):
+    '''
+    Returns a list of copies of the cube, smoothed as smooth_data with each of the filter sizes,
+    which are all calculated in one pass through the data (see box_means). A cube in the compact
+    (time, cell) layout is first expanded to the grid of the region, grid_cube, so the smoothed
+    cubes are on that grid, with the cells outside the region masked.
+    '''
 
-    return cube_out
+    if region_mask.is_compressed(cube):
+        if grid_cube is None:
+            raise ValueError('The cube is in the compact (time, cell) layout; the grid of the region '
+                '(from grid_descriptor.load_region_grid) is needed to smooth it')
+        cube = region_mask.expand(cube, grid_cube)
 
+    means = box_means(cube.core_data(), filter_sizes)
 
-def calculate_area_average(user_id, var_name, ensemble_member, year_start, year_end, monstart, monend):
+    return [cube.copy(data=means[size]) for size in filter_sizes]
+
+
+def calculate_area_average(user_id, var_name, ensemble_member, year_start, year_end, monstart, monend,
+    project_name='CReDo', region_name='East_Anglia'):
     '''
     Bias-corrects climate projections using Scaled Distribution Mapping
 
@@ -60,6 +157,9 @@ def calculate_area_average(user_id, var_name, ensemble_member, year_start, year_
     monstart -- The first month of data to correct
     monend -- The last month of data to correct
 
+    project_name, region_name -- The project and region, whose grid is used if the data are in
+        the compact (time, cell) layout of region_mask.py
+
     monstart and monend should be 12 and 11 respectively, as UKCP projections run from December to
     November in each year
     '''
@@ -80,7 +180,11 @@ def calculate_area_average(user_id, var_name, ensemble_member, year_start, year_
     rcm_corr = load_data.load_corrected_UKCP18_cpm_data(user_id, var_name, [year_start, year_end],
         ensemble_member, monstart=monstart, monend=monend)
 
-    rcm_corr_smoothed = smooth_data(rcm_corr)
+# Data in the compact layout are smoothed on the grid of the region
+    grid = None
+    if region_mask.is_compressed(rcm_corr):
+        grid = grid_descriptor.load_region_grid(project_name, region_name)
+    rcm_corr_smoothed = smooth_data(rcm_corr, grid_cube=grid)
 
     fout = make_output_filename(var_name, ID, year_start, year_end, monstart, monend)
     iris.save(rcm_corr_smoothed, os.path.join(dout, fout))
@@ -88,14 +192,87 @@ def calculate_area_average(user_id, var_name, ensemble_member, year_start, year_
     print('end: '+datetime.datetime.now().strftime("%H:%M:%S"))
 
 
+def _polygon_mean(args):
+    '''
+    Writes the area mean over the polygon of one variable, member and period of the bias-corrected
+    data, in a worker process. Returns the name of the file written.
+    '''
+
+    user_id, var_name, ensemble_member, year_range, monstart, monend, weights, dout = args
+
+    cube = load_data.load_corrected_UKCP18_cpm_data(user_id, var_name, year_range, ensemble_member,
+        monstart=monstart, monend=monend)
+    mean = region_weights.area_mean(cube, weights)
+
+    fhead = f'{var_name}_rcp85_area_mean_2.2km_{ensemble_member:02d}_day'
+    fend = '{:4d}{:02d}01-{:4d}{:02d}30.nc'.format(year_range[0], monstart, year_range[1], monend)
+    fout = os.path.join(dout, '_'.join([fhead, fend]))
+    iris.save(mean, fout)
+
+    return fout
+
+
+def calculate_polygon_means(user_id, project_name, region_name, var_names, ensemble_members, year_ranges,
+    monstart, monend, nworkers=None):
+    '''
+    Calculates the area means over the polygon of the region (see region_weights.py) of the
+    bias-corrected data, for every variable, ensemble member and period, in one job. The weights
+    are made or read once, and the files are shared among nworkers processes (default: the
+    number of CPUs allocated to the job). One file of the time series is written for each.
+
+    var_names -- The names of the variables, e.g. ['tasmax', 'tasmin', 'pr']
+    ensemble_members -- The UKCP18 ensemble members, integers between 1 and 15
+    year_ranges -- The first and last years of each period, e.g. [[1980, 2000], [2020, 2040]]
+    '''
+
+    print('start: '+datetime.datetime.now().strftime("%H:%M:%S"))
+
+    dout = os.path.join('/net/spice/scratch/', user_id, 'CLIMAR/cpm_area_mean/', region_name)
+    try:
+        os.makedirs(dout)
+    except FileExistsError:
+        pass
+
+# The calibrated data are on the grid of the region, as described by its grid descriptor
+    grid = grid_descriptor.load_region_grid(project_name, region_name)
+    weights = region_weights.load_or_compute_weights(project_name, region_name, grid)
+
+    tasks = [(user_id, var_name, ensemble_member, year_range, monstart, monend, weights, dout)
+        for var_name in var_names for ensemble_member in ensemble_members for year_range in year_ranges]
+
+    if nworkers is None:
+        nworkers = parallel_sdm.available_cpus()
+    if nworkers > 1:
+        with multiprocessing.Pool(min(nworkers, len(tasks))) as pool:
+            filenames = pool.map(_polygon_mean, tasks)
+    else:
+        filenames = [_polygon_mean(task) for task in tasks]
+
+    print('end: '+datetime.datetime.now().strftime("%H:%M:%S"))
+
+    return filenames
+
+
 if __name__ == '__main__':
 
     user_id = getpass.getuser()
-    varrcm = sys.argv[1]
-    ensemble_member = int(sys.argv[2])
-    year_start = int(sys.argv[3])
-    year_end = int(sys.argv[4])
-    monstart = int(sys.argv[5])
-    monend = int(sys.argv[6])
-
-    calculate_area_average(user_id, varrcm, ensemble_member, year_start, year_end, monstart, monend)
+
+# Area means over the polygon for several variables, members and periods in one job, e.g.
+# polygon tasmax,tasmin,pr 01,04,05 1980-2000,2020-2040 12 11
+    if sys.argv[1] == 'polygon':
+        var_names = sys.argv[2].split(',')
+        ensemble_members = [int(ID) for ID in sys.argv[3].split(',')]
+        year_ranges = [[int(y) for y in years.split('-')] for years in sys.argv[4].split(',')]
+        monstart = int(sys.argv[5])
+        monend = int(sys.argv[6])
+        calculate_polygon_means(user_id, 'CReDo', 'East_Anglia', var_names, ensemble_members, year_ranges,
+            monstart, monend)
+    else:
+        varrcm = sys.argv[1]
+        ensemble_member = int(sys.argv[2])
+        year_start = int(sys.argv[3])
+        year_end = int(sys.argv[4])
+        monstart = int(sys.argv[5])
+        monend = int(sys.argv[6])
+
+        calculate_area_average(user_id, varrcm, ensemble_member, year_start, year_end, monstart, monend)
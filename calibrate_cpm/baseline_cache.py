@@ -0,0 +1,226 @@
+'''
+A cache of the distributions fitted to the baseline data by Scaled Distribution Mapping.
+
+The obs and model baselines (1980-2000) are the same for every scenario period of an
+ensemble member, so their fits (the sorted CDF values and the parameters of the normal
+or gamma distribution, for each calendar month and grid cell) are saved to a file the
+first time they are made. Later periods, and reruns, load the file and only fit the
+scenario data.
+
+The cache file of a member and variable is named by a checksum of the obs and model files
+and of the SDM settings, the block size and sdm.VERSION, so a cache made from different input
+data or by an older version of the fits is never used. Each file is identified by its path,
+size and modification time, and a checksum of its first and last CHECKSUM_BYTES, which hold
+the header and the start and end of the data. Reading these takes milliseconds, whereas a
+checksum of the whole files would read gigabytes; the modification time alone would not catch
+files copied with their times preserved (e.g. cp -p or rsync -a) over older ones. When a
+new cache file is written, the cache files of the same member and variable made from other
+input files are deleted; those made from the same files (e.g. by another period's job
+running at the same time, or with other settings) are kept.
+'''
+
+import os
+import glob
+import hashlib
+import tempfile
+import numpy as np
+import iris
+import sdm
+import parallel_sdm
+
+# The number of bytes read from each end of an input file for its checksum
+CHECKSUM_BYTES = 1 << 20
+
+
+def input_key(filename):
+    '''
+    Returns a string identifying the version of an input file, from its path, size and
+    modification time, and a checksum of its first and last CHECKSUM_BYTES, which changes when
+    the file is rewritten.
+    '''
+
+    stat = os.stat(filename)
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        sha1.update(f.read(CHECKSUM_BYTES))
+        if stat.st_size > CHECKSUM_BYTES:
+            f.seek(max(stat.st_size - CHECKSUM_BYTES, CHECKSUM_BYTES))
+            sha1.update(f.read())
+
+    return f'{os.path.abspath(filename)}:{stat.st_size}:{stat.st_mtime_ns}:{sha1.hexdigest()[:16]}'
+
+
+def cache_filename(cache_dir, var_name, ensemble_member, obs_filename, mod_filename, block_size=5000, **kwargs):
+    '''
+    Returns the name of the cache file for the given inputs and SDM settings, and the version of
+    the fits in sdm.py.
+
+    cache_dir -- The directory holding the cache files
+    var_name -- The name of the variable
+    ensemble_member -- The UKCP18 ensemble member, an integer between 1 and 15
+    obs_filename -- The observations for the baseline period
+    mod_filename -- The model data for the baseline period
+    block_size -- The number of grid cells fitted at once
+    kwargs -- The settings passed to the SDM, e.g. cdf_threshold, lower_limit
+    '''
+
+    sha1 = hashlib.sha1()
+    for filename in [obs_filename, mod_filename]:
+        sha1.update(input_key(filename).encode())
+    sha1.update(repr(sorted(kwargs.items())).encode())
+    sha1.update(f'block_size={block_size}:version={sdm.VERSION}'.encode())
+
+    return os.path.join(cache_dir, f'sdm_baseline_{var_name}_{ensemble_member:02d}_{sha1.hexdigest()[:16]}.npz')
+
+
+def fit_baseline(obs_cube, mod_cube, block_size=5000, obs_memmap=None, **kwargs):
+    '''
+    Fits the distributions of each calendar month of the obs and model baselines, for each
+    cell where the observations are not masked. Returns a dictionary with the cells, the
+    standard name of the variable and, for each month, the fits of the obs and model data
+    for all the cells, as returned by sdm.fit_normal or sdm.fit_wet_gamma.
+
+    obs_cube -- Observations for the baseline period, with time as the first dimension
+    mod_cube -- Model data for the baseline period, on the same grid
+    block_size -- The number of grid cells fitted at once, which limits the memory used
+    obs_memmap -- A file of observations written by shared_obs.decode_obs, read instead of the data of obs_cube
+    kwargs -- Passed to the fitting function, e.g. cdf_threshold, lower_limit
+    '''
+
+    fit, _ = sdm.select_fitted_method(obs_cube.standard_name)
+
+    obs_data, cells = parallel_sdm.baseline_obs(obs_cube, obs_memmap)
+    mod_data = mod_cube.data.reshape(mod_cube.shape[0], -1)
+    data = {'obs': obs_data, 'mod': np.ma.getdata(mod_data)}
+    months = {'obs': parallel_sdm.month_numbers(obs_cube), 'mod': parallel_sdm.month_numbers(mod_cube)}
+
+    baseline = {'cells': cells, 'standard_name': obs_cube.standard_name, 'months': {}}
+    for month_number in np.unique(months['obs']):
+        fits = {}
+        for source in ['obs', 'mod']:
+            rows = np.nonzero(months[source] == month_number)[0]
+            blocks = [fit(data[source][np.ix_(rows, cells[b0:b0+block_size])].astype(np.float64), **kwargs)
+                for b0 in range(0, len(cells), block_size)]
+
+# Join the fits of the blocks along the cell dimension, which is the last of each array
+            fits[source] = {field: blocks[0][field] if blocks[0][field].ndim == 0 else
+                np.concatenate([b[field] for b in blocks], axis=-1) for field in blocks[0]}
+        baseline['months'][int(month_number)] = fits
+
+    return baseline
+
+
+def save_baseline(baseline, filename, inputs=()):
+    '''
+    Writes the fits returned by fit_baseline to a .npz file. The file is written under a
+    temporary name and then renamed, so a job reading the cache never sees a partial file.
+
+    inputs -- The input_key of each input file, stored so out of date files can be found
+    '''
+
+    arrays = {'cells': baseline['cells'], 'standard_name': np.array(baseline['standard_name']),
+        'inputs': np.array(inputs, dtype=str)}
+    for month_number, fits in baseline['months'].items():
+        for source, fitted in fits.items():
+            for field, values in fitted.items():
+                arrays[f'{source}_{month_number:02d}_{field}'] = values
+
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.npz')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_name, filename)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+
+
+def load_baseline(filename):
+    '''
+    Reads the fits written by save_baseline.
+    '''
+
+    baseline = {'months': {}}
+    with np.load(filename) as npz:
+        for name in npz.files:
+            if name == 'cells':
+                baseline['cells'] = npz[name]
+            elif name == 'standard_name':
+                baseline['standard_name'] = str(npz[name])
+            elif name == 'inputs':
+                continue
+            else:
+                source, month_number, field = name.split('_', 2)
+                fits = baseline['months'].setdefault(int(month_number), {})
+                fits.setdefault(source, {})[field] = npz[name]
+
+    return baseline
+
+
+def stored_inputs(filename):
+    '''
+    Returns the input keys stored in a cache file by save_baseline, or None if it has none.
+    '''
+
+    with np.load(filename) as npz:
+        if 'inputs' not in npz.files:
+            return None
+        return list(npz['inputs'])
+
+
+def remove_out_of_date(cache_dir, var_name, ensemble_member, filename, inputs):
+    '''
+    Deletes the cache files of the member and variable, other than filename, which were made
+    from input files other than inputs. Files made from the same inputs, e.g. by another job
+    at the same time or with other settings, are kept.
+    '''
+
+    for old_filename in glob.glob(os.path.join(cache_dir, f'sdm_baseline_{var_name}_{ensemble_member:02d}_*.npz')):
+        if old_filename == filename:
+            continue
+        try:
+            if stored_inputs(old_filename) != list(inputs):
+                os.remove(old_filename)
+        except FileNotFoundError:
+# deleted by another job
+            pass
+
+
+def load_or_fit_baseline(obs_filename, mod_filename, cache_dir, var_name, ensemble_member,
+    block_size=5000, obs_memmap=None, **kwargs):
+    '''
+    Returns the fits of the obs and model baselines from the cache if they have been made from
+    the same files and settings before. Otherwise the files are loaded and fitted, and the fits
+    are saved to the cache, and the cache files of the same member and variable made from other
+    input files are deleted.
+
+    obs_filename -- The observations for the baseline period
+    mod_filename -- The model data for the baseline period
+    cache_dir -- The directory holding the cache files
+    var_name -- The name of the variable
+    ensemble_member -- The UKCP18 ensemble member, an integer between 1 and 15
+    block_size -- The number of grid cells fitted at once
+    obs_memmap -- A file of observations written by shared_obs.decode_obs, used instead of reading obs_filename
+    kwargs -- The settings passed to the SDM, e.g. cdf_threshold, lower_limit
+    '''
+
+    try:
+        os.makedirs(cache_dir)
+    except FileExistsError:
+        pass
+
+    filename = cache_filename(cache_dir, var_name, ensemble_member, obs_filename, mod_filename,
+        block_size=block_size, **kwargs)
+    if os.path.isfile(filename):
+        print(f'Using the baseline fits in {filename}')
+        return load_baseline(filename)
+
+    print(f'Fitting the baseline, to be cached in {filename}')
+    baseline = fit_baseline(iris.load_cube(obs_filename), iris.load_cube(mod_filename), block_size=block_size,
+        obs_memmap=obs_memmap, **kwargs)
+
+    inputs = [input_key(f) for f in [obs_filename, mod_filename]]
+    save_baseline(baseline, filename, inputs)
+    remove_out_of_date(cache_dir, var_name, ensemble_member, filename, inputs)
+
+    return baseline
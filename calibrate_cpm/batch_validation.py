@@ -0,0 +1,238 @@
+'''
+Validation of the bias correction for many variables, ensemble members and periods in one job,
+without a display.
+
+Each input file (the observations of the baseline for each variable, and the raw and calibrated
+CPM data for each variable, member and period) is read once, by one of a pool of worker processes,
+which accumulates its statistics by cell and month (see stream_stats.py) and returns, for the year
+and each season, the mean, standard deviation, minimum, maximum and 5th, 50th and 95th percentiles
+of each cell. From these the main process calculates, for each variable, member and period:
+
+    bias -- raw CPM baseline - observations
+    raw_change -- raw CPM scenario - raw CPM baseline
+    cal_change -- calibrated CPM scenario - observations
+
+which should match raw_change if the calibration preserves the change of the model (and is
+the remaining bias of the calibrated data for the baseline period).
+
+All results go to a single file, validation_summary.npz, holding the maps of the metrics of
+the mean, and the mean and root mean square over the cells of the metrics of every statistic.
+The maps of check_bias_correction are drawn for each variable, member and period with the Agg
+backend and saved as PNG files.
+'''
+
+import os
+import sys
+import getpass
+import datetime
+import tempfile
+import multiprocessing
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import load_data
+import time_index
+import stream_stats
+import validation
+import parallel_sdm
+import region_mask
+import grid_descriptor
+
+# The groups of months summarised, and the statistics of each cell kept for each group
+GROUPS = ['ann'] + list(time_index.SEASONS)
+STATS = ['mean', 'std', 'min', 'max', 'q05', 'q50', 'q95']
+METRICS = ['bias', 'raw_change', 'cal_change']
+
+
+def summarise(stats):
+    '''
+    Returns an array of shape (group, statistic, cell) of the statistics of a StreamingStats for
+    each of GROUPS and STATS, with NaN where there are no data.
+    '''
+
+    summary = np.full((len(GROUPS), len(STATS), int(np.prod(stats.cell_shape))), np.nan, dtype=np.float32)
+    for i, group in enumerate(GROUPS):
+        months = None if group == 'ann' else time_index.SEASONS[group]
+        values = [stats.mean(months), np.sqrt(stats.variance(months)), stats.minimum(months),
+            stats.maximum(months), stats.quantile(.05, months), stats.quantile(.5, months),
+            stats.quantile(.95, months)]
+        for j, v in enumerate(values):
+            summary[i, j] = np.ma.filled(v.astype(np.float64), np.nan).ravel()
+
+    return summary
+
+
+def _file_summary(args):
+    '''
+    Reads one input file in a worker process, and returns its key, the summary of its statistics
+    from summarise, and a cube of one time of its data, holding the grid.
+    '''
+
+    key, user_id, monstart, monend = args
+    kind, var_name, ensemble_member, year_range = key
+
+    if kind == 'obs':
+        cube = load_data.load_UKCP18_obs_2p2km(user_id, var_name, year_range, monstart=monstart, monend=monend)
+    elif kind == 'raw':
+        cube = load_data.load_processed_UKCP18_cpm_data(user_id, var_name, year_range, ensemble_member,
+            monstart=monstart, monend=monend)
+    else:
+        cube = load_data.load_corrected_UKCP18_cpm_data(user_id, var_name, year_range, ensemble_member,
+            monstart=monstart, monend=monend)
+
+    summary = summarise(stream_stats.accumulate(cube))
+    template = validation.field_cube(cube, np.zeros(cube.shape[1:], dtype=cube.dtype))
+
+    return key, summary, template
+
+
+def map_cube(template, values, grid=None):
+    '''
+    Returns a cube of the values of the cells on the grid of template, from _file_summary. If the
+    template is in the compact (time, cell) layout of region_mask.py, the values are placed on the
+    grid of the region, grid, with the cells outside its mask masked.
+    '''
+
+    values = np.ma.masked_invalid(values)
+    if not region_mask.is_compressed(template):
+        return template.copy(data=values.reshape(template.shape))
+
+    return region_mask.expand_field(template.copy(data=values), grid)
+
+
+def _render(args):
+    '''
+    Draws and saves the maps of one variable, member, period and group in a worker process.
+    '''
+
+    filename, maps = args
+
+    fig = validation.plot_bias_correction(*maps)
+    fig.suptitle(os.path.splitext(os.path.basename(filename))[0])
+    fig.savefig(filename, dpi=100)
+    plt.close(fig)
+
+    return filename
+
+
+def write_summary(filename, **arrays):
+    '''
+    Writes the arrays to a compressed .npz file, through a temporary file, so that a partly
+    written summary is never seen.
+    '''
+
+    fd, tmp_file = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(filename))
+    with os.fdopen(fd, 'wb') as ofp:
+        np.savez_compressed(ofp, **arrays)
+    os.replace(tmp_file, filename)
+
+
+def validate_all(user_id, project_name, region_name, var_names, ensemble_members, year_ranges,
+    baseline_year_range=[1980, 2000], monstart=12, monend=11, figure_groups=['ann'], nworkers=None):
+    '''
+    Calculates the bias, raw change and calibrated change for every variable, ensemble member and
+    period, reading each input file once, with the files shared among nworkers processes (default:
+    the number of CPUs allocated to the job). Writes validation_summary.npz and the figures to
+    /net/spice/scratch/<user_id>/CLIMAR/validation/<region_name>, and returns the name of the summary.
+
+    var_names -- The names of the variables, e.g. ['tasmax', 'tasmin', 'pr']
+    ensemble_members -- The UKCP18 ensemble members, integers between 1 and 15
+    year_ranges -- The first and last years of each period, e.g. [[1980, 2000], [2020, 2040]]
+    baseline_year_range -- The period of the observations, and of the raw CPM baseline
+    figure_groups -- The groups of months (of GROUPS) for which maps are drawn
+    '''
+
+    print('start: '+datetime.datetime.now().strftime("%H:%M:%S"))
+
+    dout = os.path.join('/net/spice/scratch/', user_id, 'CLIMAR/validation/', region_name)
+    try:
+        os.makedirs(os.path.join(dout, 'figures'))
+    except FileExistsError:
+        pass
+
+# Each file is read once: the observations for each variable, the raw data for each period and
+# the baseline (if not one of the periods), and the calibrated data for each period
+    base = tuple(baseline_year_range)
+    periods = [tuple(y) for y in year_ranges]
+    keys = []
+    for var_name in var_names:
+        keys.append(('obs', var_name, None, base))
+        for ensemble_member in ensemble_members:
+            keys += [('raw', var_name, ensemble_member, p) for p in dict.fromkeys(periods + [base])]
+            keys += [('cal', var_name, ensemble_member, p) for p in periods]
+    tasks = [(key, user_id, monstart, monend) for key in keys]
+
+    if nworkers is None:
+        nworkers = parallel_sdm.available_cpus()
+    if nworkers > 1:
+        with multiprocessing.Pool(min(nworkers, len(tasks))) as pool:
+            results = pool.map(_file_summary, tasks)
+    else:
+        results = [_file_summary(task) for task in tasks]
+
+    summaries = {key: summary for key, summary, template in results}
+    templates = {key: template for key, summary, template in results}
+    ncells = summaries[keys[0]].shape[-1]
+    grid = None
+    if region_mask.is_compressed(templates[keys[0]]):
+        grid = grid_descriptor.load_region_grid(project_name, region_name)
+
+# The metrics of every statistic, summarised over the cells, and the maps of the metrics of the mean
+    shape = (len(var_names), len(ensemble_members), len(periods), len(METRICS), len(GROUPS))
+    fields = np.full(shape + (ncells,), np.nan, dtype=np.float32)
+    area_mean = np.full(shape + (len(STATS),), np.nan, dtype=np.float32)
+    area_rms = np.full(shape + (len(STATS),), np.nan, dtype=np.float32)
+    renders = []
+    imean = STATS.index('mean')
+
+    for i, var_name in enumerate(var_names):
+        obs = summaries[('obs', var_name, None, base)]
+        for j, ensemble_member in enumerate(ensemble_members):
+            raw_base = summaries[('raw', var_name, ensemble_member, base)]
+            for k, period in enumerate(periods):
+                raw = summaries[('raw', var_name, ensemble_member, period)]
+                cal = summaries[('cal', var_name, ensemble_member, period)]
+                for m, metric in enumerate([raw_base - obs, raw - raw_base, cal - obs]):
+                    fields[i, j, k, m] = metric[:, imean]
+                    with np.errstate(invalid='ignore'):
+                        area_mean[i, j, k, m] = np.nanmean(metric, axis=-1)
+                        area_rms[i, j, k, m] = np.sqrt(np.nanmean(metric**2, axis=-1))
+
+# The maps are all put on the grid of the raw scenario, so that they can be subtracted
+                template = templates[('raw', var_name, ensemble_member, period)]
+                for group in figure_groups:
+                    g = GROUPS.index(group)
+                    maps = [map_cube(template, s[g, imean], grid) for s in [obs, raw_base, raw, cal]]
+                    fout = f'{var_name}_{ensemble_member:02d}_{period[0]:4d}-{period[1]:4d}_{group}.png'
+                    renders.append((os.path.join(dout, 'figures', fout), maps))
+
+    summary_file = os.path.join(dout, 'validation_summary.npz')
+    write_summary(summary_file, variables=np.array(var_names), members=np.array(ensemble_members),
+        periods=np.array(periods), baseline=np.array(base), metrics=np.array(METRICS),
+        groups=np.array(GROUPS), stats=np.array(STATS), fields=fields, area_mean=area_mean,
+        area_rms=area_rms)
+    print(f'Summary written to {summary_file}')
+
+    if nworkers > 1 and len(renders) > 1:
+        with multiprocessing.Pool(min(nworkers, len(renders))) as pool:
+            pool.map(_render, renders)
+    else:
+        for r in renders:
+            _render(r)
+
+    print('end: '+datetime.datetime.now().strftime("%H:%M:%S"))
+
+    return summary_file
+
+
+if __name__ == '__main__':
+
+# All variables, members and periods in one job, e.g.
+# tasmax,tasmin,pr 01,04,05 1980-2000,2020-2040,2060-2080
+    user_id = getpass.getuser()
+    var_names = sys.argv[1].split(',')
+    ensemble_members = [int(ID) for ID in sys.argv[2].split(',')]
+    year_ranges = [[int(y) for y in years.split('-')] for years in sys.argv[3].split(',')]
+
+    validate_all(user_id, 'CReDo', 'East_Anglia', var_names, ensemble_members, year_ranges)
@@ -0,0 +1,12 @@
+#!/bin/bash -l
+#SBATCH --mem=8000
+#SBATCH --ntasks=8
+#SBATCH --output=batch_validation_output.txt
+#SBATCH --error=batch_validation_error.err
+#SBATCH --time=120
+#SBATCH --qos=normal
+#SBATCH --export=NONE
+
+# e.g. sbatch batch_validation_batch.sh tasmax,tasmin,pr 01,04,05,06,07,08,09,10,11,12,13,15 1980-2000,2020-2040,2060-2080
+module load scitools
+python batch_validation.py $1 $2 $3
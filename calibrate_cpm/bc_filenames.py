@@ -0,0 +1,33 @@
+'''
+The names of the monthly files of bias-corrected data, written by BC_timeslice_run.py and
+tiled_bc.py, and read by merge_timeseries.py.
+
+The files are named as pyCAT names them, starting with the name of the method, so the results
+of different methods are kept apart, e.g.
+    scaled_distribution_mapping_tasmax_scenario-0_1981-2000_month-01.nc
+'''
+
+# The name of the method of each engine of BC_timeslice_run.py. pyCAT names its files itself.
+METHOD_NAMES = {'sdm': 'scaled_distribution_mapping', 'pycat': 'scaled_distribution_mapping',
+    'isimip3': 'isimip3_quantile_mapping', 'window': 'window_scaled_distribution_mapping'}
+
+
+def month_filename(var_name, first_year, last_year, month_number, engine='sdm'):
+    '''
+    Returns the name of the file holding the bias-corrected data of one calendar month from
+    first_year to last_year, made by the given engine (see METHOD_NAMES).
+    '''
+
+    return f'{METHOD_NAMES[engine]}_{var_name}_scenario-0_{first_year:04d}-{last_year:04d}_month-{month_number:02d}.nc'
+
+
+def monthly_filename(var_name, cube, month_number, engine='sdm'):
+    '''
+    As month_filename, for the scenario data of that month in cube, whose first and last times
+    give the years in the name.
+    '''
+
+    time = cube.coord('time')
+    dates = time.units.num2date(time.points[[0, -1]])
+
+    return month_filename(var_name, dates[0].year, dates[1].year, month_number, engine)
@@ -0,0 +1,96 @@
+'''
+Benchmark for the conservative (area-weighted) regridding in regrid_weights.py.
+
+iris.analysis.AreaWeighted needs the source and target grids to be in the same
+coordinate system, so it is compared with regrid_weights on a 2.2 km grid on the OSGB
+covering East Anglia. The results should be identical. The time to regrid one month
+of synthetic 1 km data to the rotated 2.2 km East Anglia grid, which iris cannot do,
+and the conservation of the area mean, are then printed.
+
+Usage:
+    python bench_conservative.py [ntarget]
+where ntarget is the number of 2.2 km cells along each side of the OSGB target grid.
+'''
+
+import sys
+import time
+import numpy as np
+import iris
+import iris.cube
+from iris.coords import DimCoord
+import make_synthetic_data
+import regrid_weights
+import bench_regrid_obs
+
+
+def make_osgb_target(obs, n):
+    '''
+    Returns an n x n cube on a 2.2 km grid on the OSGB, starting near King's Lynn.
+    '''
+
+    cs = obs.coord('projection_x_coordinate').coord_system
+    x = DimCoord(540000 + 2200*np.arange(n) + 0.3, standard_name='projection_x_coordinate', units='m',
+        coord_system=cs)
+    y = DimCoord(290000 + 2200*np.arange(n) + 0.7, standard_name='projection_y_coordinate', units='m',
+        coord_system=cs)
+    x.guess_bounds()
+    y.guess_bounds()
+
+    return iris.cube.Cube(np.zeros((n, n)), dim_coords_and_dims=[(y, 0), (x, 1)])
+
+
+def main():
+
+    ntarget = int(sys.argv[1]) if len(sys.argv) > 1 else 27
+
+    obs = make_synthetic_data.make_obs_cube('rainfall', 1990, 1)
+    obs.data[:, 500:530, 740:770] = np.ma.masked
+
+# Same coordinate system: compare with iris.analysis.AreaWeighted
+    tgt = make_osgb_target(obs, ntarget)
+    ys, xs = regrid_weights.source_window(obs, tgt, halo=3)
+    sub = obs[:, ys, xs]
+
+    t0 = time.time()
+    regridder = iris.analysis.AreaWeighted().regridder(sub[0], tgt)
+    t1 = time.time()
+    ref = regridder(sub)
+    ref.data
+    t2 = time.time()
+    weights = regrid_weights.compute_area_weights(sub, tgt)
+    t3 = time.time()
+    out = regrid_weights.apply_weights(weights, sub, tgt, method='conservative')
+    t4 = time.time()
+
+    same_mask = np.array_equal(np.ma.getmaskarray(out.data), np.ma.getmaskarray(ref.data))
+    print(f'OSGB {ntarget}x{ntarget} target, {sub.shape[0]} days:')
+    print(f'    AreaWeighted:   setup {t1-t0:.3f} s, regrid {t2-t1:.4f} s')
+    print(f'    regrid_weights: setup {t3-t2:.3f} s, regrid {t4-t3:.4f} s')
+    print(f'    max difference {np.ma.max(np.ma.abs(out.data-ref.data)):.2e}, same mask: {same_mask}')
+
+# Rotated polar target grid, as used for the CPM data
+    cpm = bench_regrid_obs.make_target_grid()
+    ys, xs = regrid_weights.source_window(obs, cpm, halo=3)
+    sub = obs[:, ys, xs]
+    sub.data
+
+    t0 = time.time()
+    weights = regrid_weights.compute_area_weights(sub, cpm)
+    t1 = time.time()
+    out = regrid_weights.apply_weights(weights, sub, cpm, method='conservative')
+    t2 = time.time()
+
+# Without masked cells, the area-weighted mean over the target cells should equal the
+# mean of the source cells they cover, weighted by the area covered
+    clean = sub.copy(np.ma.getdata(sub.data))
+    clean_out = regrid_weights.apply_weights(weights, clean, cpm, method='conservative')
+    area = np.asarray(weights.sum(axis=1)).ravel()
+    covered = np.asarray(weights.sum(axis=0)).ravel()
+    src_mean = (clean.data[0].ravel() * covered).sum() / covered.sum()
+    tgt_mean = (clean_out.data[0].ravel() * area).sum() / area.sum()
+    print(f'Rotated {cpm.shape[1]}x{cpm.shape[2]} target: setup {t1-t0:.3f} s, regrid {t2-t1:.4f} s, '
+        f'area mean source {src_mean:.4f} target {tgt_mean:.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+'''
+Benchmark for the trend-preserving quantile mapping in isimip3_qm.py, against the SDM path.
+
+Twenty years of synthetic daily obs, model baseline and model scenario data on a grid are
+bias-corrected by parallel_sdm.correct_months with engine='sdm' and engine='isimip3', with
+1, 2, ... N worker processes. The quantile mapping is also run cell by cell, as ISIMIP3BASD's
+bias_adjustment.py does, on a sample of cells, and its time scaled up to the whole grid.
+
+The run times are printed, with the mean change in the corrected data from the observations,
+which the quantile mapping should keep equal to the change in the model from the baseline to
+the scenario.
+
+Usage:
+    python bench_isimip3.py [var_name] [max_workers] [ny] [nx] [nsample]
+'''
+
+import sys
+import time
+import numpy as np
+import parallel_sdm
+import isimip3_qm
+import bench_sdm
+import bench_parallel_sdm
+
+
+def mean_change(obs, mod, sce, corrected):
+    '''
+    Returns a description of the mean changes from the baseline to the scenario, in the model and
+    the corrected data, as ratios for precipitation and differences for temperature.
+    '''
+
+    if obs.standard_name == 'air_temperature':
+        return f'model change {sce.data.mean() - mod.data.mean():6.3f}, corrected change {corrected.data.mean() - obs.data.mean():6.3f}'
+    else:
+        return f'model change x{sce.data.mean() / mod.data.mean():6.3f}, corrected change x{corrected.data.mean() / obs.data.mean():6.3f}'
+
+
+def main():
+
+    var_name = sys.argv[1] if len(sys.argv) > 1 else 'tasmax'
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else parallel_sdm.available_cpus()
+    ny = int(sys.argv[3]) if len(sys.argv) > 3 else 25
+    nx = int(sys.argv[4]) if len(sys.argv) > 4 else 27
+    nsample = int(sys.argv[5]) if len(sys.argv) > 5 else 50
+
+    standard_name = 'air_temperature' if var_name == 'tasmax' else 'precipitation_amount'
+    obs, mod, sce = bench_sdm.make_data(var_name, ny*nx, ntimes=20*360)
+    obs = bench_parallel_sdm.make_cube(obs, 1980, ny, nx, standard_name)
+    mod = bench_parallel_sdm.make_cube(mod, 1980, ny, nx, standard_name)
+    sce = bench_parallel_sdm.make_cube(sce, 2020, ny, nx, standard_name)
+    print(f'{var_name} on a {ny}x{nx} grid, {parallel_sdm.available_cpus()} CPUs available')
+
+    for engine in ['sdm', 'isimip3']:
+        for nworkers in range(1, max_workers+1):
+            t0 = time.time()
+            corrected = parallel_sdm.correct_months(obs, mod, sce, nworkers=nworkers, block_size=(ny*nx+1)//2,
+                engine=engine)
+            t = time.time() - t0
+            if engine == 'sdm' and nworkers == 1:
+                t_sdm = t
+            print(f'    {engine:7s} {nworkers} worker(s): {t:6.2f} s ({t/t_sdm:4.2f} x SDM), {mean_change(obs, mod, sce, corrected)}')
+
+# Cell by cell, for a sample of cells, as ISIMIP3BASD runs
+    method = isimip3_qm.select_method(standard_name)
+    months = [parallel_sdm.month_numbers(cube) for cube in [obs, mod, sce]]
+    data = [cube.data.reshape(cube.shape[0], -1).astype(np.float64) for cube in [obs, mod, sce]]
+    t0 = time.time()
+    for cell in range(min(nsample, ny*nx)):
+        for month_number in range(1, 13):
+            method(*[d[m == month_number][:, cell:cell+1] for d, m in zip(data, months)])
+    t_cells = (time.time() - t0) * ny * nx / min(nsample, ny*nx)
+    print(f'    isimip3 cell by cell (from {nsample} cells): {t_cells:6.2f} s ({t_cells/t_sdm:4.2f} x SDM)')
+
+
+if __name__ == '__main__':
+    main()
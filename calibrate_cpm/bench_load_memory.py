@@ -0,0 +1,84 @@
+'''
+Memory benchmark for load_data.ukcp18_callback.
+
+Writes a few years of synthetic full-domain UKCP Local files, then extracts the
+East Anglia box from them (as prep_cpm_data.prep_cpm does) twice, each time in a
+fresh process: once with the data realised inside the callback (the old behaviour),
+and once with the lazy callback. The peak resident set size of each process is printed.
+
+Usage:
+    python bench_load_memory.py [work_dir] [nyears]
+'''
+
+import os
+import sys
+import glob
+import time
+import resource
+import subprocess
+import tempfile
+import numpy as np
+import iris
+import load_data
+import make_synthetic_data
+
+
+def eager_callback(cube, field, filename):
+    '''
+    Reproduces the old callback, which read the data for the whole domain from every file.
+    '''
+
+    load_data.ukcp18_callback(cube, field, filename)
+    cube.data = np.ma.asarray(cube.data, dtype=np.float32)
+
+
+def extract_region(data_root, mode):
+    '''
+    Loads the region of interest from the synthetic archive and prints the peak RSS in MB.
+    '''
+
+# Limits of the East Anglia box on the rotated grid, from East_Anglia_rotgrid_limits.dat
+    lon_edges = [361.57, 362.05]
+    lat_edges = [-0.07, 0.46]
+    lon_con = iris.Constraint(grid_longitude = lambda l: lon_edges[0] <= l.point <= lon_edges[1])
+    lat_con = iris.Constraint(grid_latitude = lambda l: lat_edges[0] <= l.point <= lat_edges[1])
+
+    if mode == 'eager':
+        callback = eager_callback
+    else:
+        callback = load_data.ukcp18_callback
+
+    filenames = sorted(glob.glob(os.path.join(data_root, '01', 'tasmax', 'day', 'v20210615', '*.nc')))
+    t0 = time.time()
+    cube = iris.load(filenames, lon_con & lat_con, callback=callback).concatenate_cube()
+    cube.data
+    elapsed = time.time() - t0
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print(f'{mode:6s}: {len(filenames)} files, region shape {cube.shape}, '
+        f'{elapsed:.2f} s, peak RSS {peak_mb:.0f} MB')
+
+
+def main():
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--write':
+        make_synthetic_data.write_cpm_archive(sys.argv[2], 'tasmax', [1980, 1980+int(sys.argv[3])-1], 1)
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        extract_region(sys.argv[3], sys.argv[2])
+        return
+
+    work_dir = sys.argv[1] if len(sys.argv) > 1 else tempfile.mkdtemp()
+    nyears = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    data_root = os.path.join(work_dir, 'land-cpm')
+    print(f'Writing {nyears} years of synthetic CPM data to {data_root}')
+# Each step runs in its own process, so that the peak RSS of one does not affect the others
+    subprocess.run([sys.executable, __file__, '--write', data_root, str(nyears)], check=True)
+
+    for mode in ['eager', 'lazy']:
+        subprocess.run([sys.executable, __file__, '--run', mode, data_root], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Benchmark for the parallel bias correction in parallel_sdm.py.
+
+Twenty years of synthetic daily obs, model baseline and model scenario data on a grid
+are bias-corrected with 1, 2, ... N worker processes. The run time and speed-up for each
+number of workers are printed, and the results are checked to be identical to those with
+one worker, and to correcting each month in turn with sdm.scaled_distribution_mapping.
+
+Usage:
+    python bench_parallel_sdm.py [var_name] [max_workers] [ny] [nx]
+'''
+
+import sys
+import time
+import numpy as np
+import iris
+import iris.cube
+from iris.coords import DimCoord
+from cf_units import Unit
+import sdm
+import parallel_sdm
+import bench_sdm
+
+
+def make_cube(data, year, ny, nx, standard_name):
+    '''
+    Returns a (time, y, x) cube holding data, with daily times on the 360-day calendar from December of year.
+    '''
+
+    nt = data.shape[0]
+    time_coord = DimCoord(np.arange(nt) + 0.5, standard_name='time',
+        units=Unit(f'days since {year}-12-01', calendar='360_day'))
+    y = DimCoord(np.arange(ny) * 0.0198, standard_name='grid_latitude', units='degrees')
+    x = DimCoord(np.arange(nx) * 0.0198, standard_name='grid_longitude', units='degrees')
+
+    return iris.cube.Cube(data.reshape(nt, ny, nx).astype(np.float32), standard_name=standard_name,
+        dim_coords_and_dims=[(time_coord, 0), (y, 1), (x, 2)])
+
+
+def main():
+
+    var_name = sys.argv[1] if len(sys.argv) > 1 else 'tasmax'
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else parallel_sdm.available_cpus()
+    ny = int(sys.argv[3]) if len(sys.argv) > 3 else 25
+    nx = int(sys.argv[4]) if len(sys.argv) > 4 else 27
+
+    standard_name = 'air_temperature' if var_name == 'tasmax' else 'precipitation_amount'
+    obs, mod, sce = bench_sdm.make_data(var_name, ny*nx, ntimes=20*360)
+    obs = make_cube(obs, 1980, ny, nx, standard_name)
+    mod = make_cube(mod, 1980, ny, nx, standard_name)
+    sce = make_cube(sce, 2020, ny, nx, standard_name)
+    print(f'{var_name} on a {ny}x{nx} grid, {parallel_sdm.available_cpus()} CPUs available')
+
+# Each month in turn, as BC_timeslice_run_monthly.py did before
+    t0 = time.time()
+    months = parallel_sdm.month_numbers(sce)
+    serial = sce.copy()
+    for month_number in range(1, 13):
+        sce_mth = sce[months == month_number]
+        sdm.scaled_distribution_mapping(obs[parallel_sdm.month_numbers(obs) == month_number],
+            mod[parallel_sdm.month_numbers(mod) == month_number], [sce_mth])
+        serial.data[months == month_number] = sce_mth.data
+    print(f'    month by month: {time.time()-t0:6.2f} s')
+
+    for nworkers in range(1, max_workers+1):
+        t0 = time.time()
+        corrected = parallel_sdm.correct_months(obs, mod, sce, nworkers=nworkers, block_size=(ny*nx+1)//2)
+        t = time.time() - t0
+        if nworkers == 1:
+            t1 = t
+            reference = corrected
+        same = np.array_equal(corrected.data, reference.data) and \
+            np.array_equal(np.ma.getmaskarray(corrected.data), np.ma.getmaskarray(reference.data))
+        print(f'    {nworkers} worker(s): {t:6.2f} s, speed-up {t1/t:4.2f}, identical to 1 worker: {same}')
+
+    print(f'    1 worker identical to month by month: {np.array_equal(reference.data, serial.data)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+'''
+Benchmark for regridding the monthly HadUK-Grid files to the East Anglia CPM grid.
+
+Writes a few months of synthetic full-UK 1 km files, then regrids each of them:
+before -- the whole field is read and regridded with iris.analysis.Linear()
+after  -- only the window around the target grid is read, and regridded with cached weights
+The bytes read (from /proc/self/io, so Linux only) and the run time are printed for each file.
+
+Usage:
+    python bench_regrid_obs.py [work_dir] [nmonths]
+'''
+
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import iris
+import make_synthetic_data
+import regrid_weights
+
+
+def bytes_read():
+    '''
+    Returns the number of bytes read by this process so far.
+    '''
+
+    with open('/proc/self/io') as ifp:
+        for line in ifp:
+            if line.startswith('rchar'):
+                return int(line.split()[1])
+
+
+def make_target_grid():
+    '''
+    Returns a cube on the East Anglia part of the CPM grid.
+    '''
+
+    cpm = make_synthetic_data.make_cpm_cube('tasmax', 1980, 1, ndays=1)[0]
+    lons = cpm.coord('grid_longitude').points
+    lats = cpm.coord('grid_latitude').points
+    ix = np.where((lons >= 361.57) & (lons <= 362.05))[0]
+    iy = np.where((lats >= -0.07) & (lats <= 0.46))[0]
+
+    return cpm[:, iy[0]:iy[-1]+1, ix[0]:ix[-1]+1]
+
+
+def main():
+
+    work_dir = sys.argv[1] if len(sys.argv) > 1 else tempfile.mkdtemp()
+    nmonths = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    obs_filenames = make_synthetic_data.write_obs_archive(os.path.join(work_dir, 'obs'), 'tasmax', [1990, 1990],
+        months=list(range(1, nmonths+1)))
+    cpm = make_target_grid()
+    weights_dir = os.path.join(work_dir, 'regrid_weights')
+
+    for obs_filename in obs_filenames:
+        r0 = bytes_read()
+        t0 = time.time()
+        obs_1km = iris.load_cube(obs_filename)
+        before = iris.analysis.Linear().regridder(obs_1km[0], cpm[0])(obs_1km)
+        before.data
+        r1 = bytes_read()
+        t1 = time.time()
+
+        obs_1km = iris.load_cube(obs_filename)
+        ys, xs = regrid_weights.source_window(obs_1km, cpm)
+        obs_1km = obs_1km[:, ys, xs]
+        weights = regrid_weights.load_or_compute_weights(obs_1km, cpm, weights_dir)
+        after = regrid_weights.apply_weights(weights, obs_1km, cpm)
+        r2 = bytes_read()
+        t2 = time.time()
+
+        diff = np.ma.max(np.ma.abs(after.data - before.data))
+        print(f'{os.path.basename(obs_filename)}: before {(r1-r0)/1e6:7.1f} MB {t1-t0:5.2f} s, '
+            f'after {(r2-r1)/1e6:7.1f} MB {t2-t1:5.2f} s, max difference {diff:.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+'''
+Benchmark for the vectorised Scaled Distribution Mapping in sdm.py.
+
+One month (20 years of 30 days) of synthetic obs, model baseline and model scenario
+data is corrected for every cell of a grid, by sdm.py and by the cell-by-cell method
+of pyCAT. If pyCAT is not installed, the functions below, which follow
+pycat.esd.methods.absolute_sdm and relative_sdm, are used instead. The run times and
+the largest differences between the results are printed, for temperature and precipitation.
+
+The whole-UK grid is too large to be corrected cell by cell in reasonable time, so pyCAT
+is run on a sample of cells and its time scaled up to the whole grid.
+
+Usage:
+    python bench_sdm.py [nsample]
+'''
+
+import sys
+import time
+import numpy as np
+from scipy.stats import norm, gamma
+from scipy.signal import detrend
+import sdm
+
+try:
+    from pycat.esd.methods import absolute_sdm, relative_sdm
+except ImportError:
+
+    def absolute_sdm(obs_cube, mod_cube, sce_cube, *args, **kwargs):
+        cdf_threshold = kwargs.get('cdf_threshold', .99999999)
+
+        obs_len = len(obs_cube)
+        mod_len = len(mod_cube)
+        sce_len = len(sce_cube)
+
+        obs_mean = obs_cube.mean()
+        mod_mean = mod_cube.mean()
+        sce_mean = sce_cube.mean()
+
+        obs_detrended = detrend(obs_cube)
+        mod_detrended = detrend(mod_cube)
+        sce_detrended = detrend(sce_cube)
+        sce_diff = sce_cube - sce_detrended
+        sce_argsort = np.argsort(sce_detrended)
+
+        obs_norm = norm.fit(obs_detrended)
+        mod_norm = norm.fit(mod_detrended)
+        sce_norm = norm.fit(sce_detrended)
+
+        sce_cdf = norm.cdf(np.sort(sce_detrended), *sce_norm)
+        obs_cdf = norm.cdf(np.sort(obs_detrended), *obs_norm)
+        mod_cdf = norm.cdf(np.sort(mod_detrended), *mod_norm)
+        sce_cdf = np.maximum(np.minimum(sce_cdf, cdf_threshold), 1 - cdf_threshold)
+        obs_cdf = np.maximum(np.minimum(obs_cdf, cdf_threshold), 1 - cdf_threshold)
+        mod_cdf = np.maximum(np.minimum(mod_cdf, cdf_threshold), 1 - cdf_threshold)
+
+        obs_cdf_intpol = np.interp(np.linspace(1, obs_len, sce_len), np.linspace(1, obs_len, obs_len), obs_cdf)
+        mod_cdf_intpol = np.interp(np.linspace(1, mod_len, sce_len), np.linspace(1, mod_len, mod_len), mod_cdf)
+
+        obs_cdf_shift = obs_cdf_intpol - .5
+        mod_cdf_shift = mod_cdf_intpol - .5
+        sce_cdf_shift = sce_cdf - .5
+        obs_inverse = 1. / (.5 - np.abs(obs_cdf_shift))
+        mod_inverse = 1. / (.5 - np.abs(mod_cdf_shift))
+        sce_inverse = 1. / (.5 - np.abs(sce_cdf_shift))
+        adapted_cdf = np.sign(obs_cdf_shift) * (1. - 1. / (obs_inverse * sce_inverse / mod_inverse))
+        adapted_cdf[adapted_cdf < 0] += 1.
+        adapted_cdf = np.maximum(np.minimum(adapted_cdf, cdf_threshold), 1 - cdf_threshold)
+
+        xvals = norm.ppf(np.sort(adapted_cdf), *obs_norm) \
+            + obs_norm[-1] / mod_norm[-1] * (norm.ppf(sce_cdf, *sce_norm) - norm.ppf(sce_cdf, *mod_norm))
+        xvals -= xvals.mean()
+        xvals += obs_mean + (sce_mean - mod_mean)
+
+        correction = np.zeros(sce_len)
+        correction[sce_argsort] = xvals
+        correction += sce_diff - sce_mean
+
+        return correction
+
+    def relative_sdm(obs_cube, mod_cube, sce_cube, *args, **kwargs):
+        lower_limit = kwargs.get('lower_limit', 0.1)
+        cdf_threshold = kwargs.get('cdf_threshold', .99999999)
+
+        obs_len = len(obs_cube)
+        mod_len = len(mod_cube)
+        sce_len = len(sce_cube)
+
+        obs_raindays = obs_cube[obs_cube >= lower_limit]
+        mod_raindays = mod_cube[mod_cube >= lower_limit]
+        sce_raindays = sce_cube[sce_cube >= lower_limit]
+
+        obs_frequency = 1. * obs_raindays.shape[0] / obs_len
+        mod_frequency = 1. * mod_raindays.shape[0] / mod_len
+        sce_frequency = 1. * sce_raindays.shape[0] / sce_len
+
+        sce_argsort = np.argsort(sce_cube)
+        sce_gamma = gamma.fit(sce_raindays, floc=0)
+
+        expected_sce_raindays = int(min(np.round(len(sce_cube) * obs_frequency * sce_frequency / mod_frequency),
+            len(sce_cube)))
+
+        obs_gamma = gamma.fit(obs_raindays, floc=0)
+        mod_gamma = gamma.fit(mod_raindays, floc=0)
+
+        obs_cdf = gamma.cdf(np.sort(obs_raindays), *obs_gamma)
+        mod_cdf = gamma.cdf(np.sort(mod_raindays), *mod_gamma)
+        sce_cdf = gamma.cdf(np.sort(sce_raindays), *sce_gamma)
+
+        obs_cdf[obs_cdf > cdf_threshold] = cdf_threshold
+        mod_cdf[mod_cdf > cdf_threshold] = cdf_threshold
+        sce_cdf[sce_cdf > cdf_threshold] = cdf_threshold
+
+        obs_cdf_intpol = np.interp(np.linspace(1, len(obs_raindays), len(sce_raindays)),
+            np.linspace(1, len(obs_raindays), len(obs_raindays)), obs_cdf)
+        mod_cdf_intpol = np.interp(np.linspace(1, len(mod_raindays), len(sce_raindays)),
+            np.linspace(1, len(mod_raindays), len(mod_raindays)), mod_cdf)
+
+        obs_inverse = 1. / (1 - obs_cdf_intpol)
+        mod_inverse = 1. / (1 - mod_cdf_intpol)
+        sce_inverse = 1. / (1 - sce_cdf)
+
+        adapted_cdf = 1 - 1. / (obs_inverse * sce_inverse / mod_inverse)
+        adapted_cdf[adapted_cdf < 0.] = 0.
+
+        xvals = gamma.ppf(np.sort(adapted_cdf), *obs_gamma) \
+            * gamma.ppf(sce_cdf, *sce_gamma) / gamma.ppf(sce_cdf, *mod_gamma)
+
+        if len(sce_raindays) > expected_sce_raindays:
+            xvals = np.interp(np.linspace(1, len(sce_raindays), expected_sce_raindays),
+                np.linspace(1, len(sce_raindays), len(sce_raindays)), xvals)
+        else:
+            xvals = np.hstack((np.zeros(expected_sce_raindays - len(sce_raindays)), xvals))
+
+        correction = np.zeros(sce_len)
+        correction[sce_argsort[-expected_sce_raindays:].astype(int)] = xvals
+
+        return correction
+
+
+def make_data(var_name, ncells, ntimes=600, seed=0):
+    '''
+    Returns synthetic (obs, mod, sce) arrays of shape (time, cell) for one calendar month.
+    '''
+
+    rng = np.random.default_rng(seed)
+    trend = np.linspace(0, 1, ntimes)[:, None]
+
+    if var_name == 'tasmax':
+        base = rng.normal(8, 2, ncells)
+        obs = base + rng.normal(0, 3, (ntimes, ncells))
+        mod = base + 1.5 + rng.normal(0, 3.5, (ntimes, ncells))
+        sce = base + 3.0 + 2*trend + rng.normal(0, 3.8, (ntimes, ncells))
+    else:
+# For 'pr' the model has more wet days than the obs, so fewer wet days are expected in the
+# corrected scenario; for 'pr_obs_wetter' the obs have more, so more are expected than the
+# scenario has, and the corrected values are padded with zeros (see sdm.relative_sdm_sorted)
+        obs_frequency, mod_frequency = (0.45, 0.55) if var_name == 'pr' else (0.6, 0.4)
+        scale = rng.uniform(2, 6, ncells)
+        obs = np.where(rng.random((ntimes, ncells)) < obs_frequency, rng.gamma(0.8, scale, (ntimes, ncells)), 0.)
+        mod = np.where(rng.random((ntimes, ncells)) < mod_frequency, rng.gamma(0.7, scale, (ntimes, ncells)), 0.)
+        sce = np.where(rng.random((ntimes, ncells)) < 0.50, rng.gamma(0.7, 1.2*scale, (ntimes, ncells)), 0.)
+
+    return obs, mod, sce
+
+
+def run_grid(grid_name, ny, nx, nsample, block_size=10000):
+
+    ncells = ny * nx
+    for var_name, cell_method, grid_method in [('tasmax', absolute_sdm, sdm.absolute_sdm),
+        ('pr', relative_sdm, sdm.relative_sdm), ('pr_obs_wetter', relative_sdm, sdm.relative_sdm)]:
+
+# Correct the grid in blocks of cells, as sdm.scaled_distribution_mapping does.
+# The data are made one block at a time, to limit the memory used.
+        t_grid = 0.
+        for b0 in range(0, ncells, block_size):
+            obs, mod, sce = make_data(var_name, min(block_size, ncells-b0), seed=b0)
+            t0 = time.time()
+            result = grid_method(obs, mod, sce)
+            t_grid += time.time() - t0
+
+# Correct a sample of cells from the first block cell by cell
+            if b0 == 0:
+                cells = np.arange(sce.shape[1])
+                if nsample < len(cells):
+                    cells = np.random.default_rng(1).choice(cells, nsample, replace=False)
+                t0 = time.time()
+                ref = np.array([cell_method(obs[:, i], mod[:, i], sce[:, i]) for i in cells]).T
+                t_cell = (time.time() - t0) * ncells / len(cells)
+                diff = np.abs(result[:, cells] - ref).max()
+
+        print(f'{grid_name} {ny}x{nx} {var_name}: cell by cell {t_cell:7.1f} s' +
+            ('' if len(cells) == ncells else ' (estimated)') +
+            f', vectorised {t_grid:6.1f} s, speed-up {t_cell/t_grid:4.1f}, max difference {diff:.1e}')
+
+
+def main():
+
+    nsample = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    run_grid('East Anglia', 25, 27, nsample)
+    run_grid('Whole UK', 606, 484, nsample)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+'''
+Benchmark for the smoothing in area_average_cpm.py.
+
+A synthetic 20-year daily series on a grid is smoothed with a 3x3 filter by the loop that
+area_average_cpm.smooth_data used before (signal.convolve2d on each day, written back
+through cube_out[i].data), and by the summed-area tables of area_average_cpm.box_means.
+The loop wrote each day into a temporary copy made by cube_out[i], so its results are
+collected here to be compared. The 3x3, 5x5 and 7x7 means are also calculated in one pass,
+and by the loop once per filter size.
+
+Usage:
+    python bench_smoothing.py [nyears] [ny] [nx]
+'''
+
+import sys
+import time
+import numpy as np
+import iris.cube
+from iris.coords import DimCoord
+from cf_units import Unit
+from scipy import signal, ndimage
+import area_average_cpm
+
+
+def make_cube(nyears, ny, nx):
+    '''
+    Returns a cube of daily synthetic temperatures on the 360-day calendar, with the sea masked
+    in one corner of the grid.
+    '''
+
+    nt = nyears * 360
+    rng = np.random.default_rng(0)
+    data = (283 + 5 * rng.standard_normal((nt, ny, nx))).astype(np.float32)
+    sea = np.add.outer(np.arange(ny), np.arange(nx)) < min(ny, nx) // 3
+    data = np.ma.masked_array(data, np.broadcast_to(sea, data.shape))
+
+    time_coord = DimCoord(np.arange(nt) + 0.5, standard_name='time', units=Unit('days since 1980-12-01', calendar='360_day'))
+    y = DimCoord(np.arange(ny) * 2200., standard_name='projection_y_coordinate', units='m')
+    x = DimCoord(np.arange(nx) * 2200., standard_name='projection_x_coordinate', units='m')
+
+    return iris.cube.Cube(data, standard_name='air_temperature', units='K',
+        dim_coords_and_dims=[(time_coord, 0), (y, 1), (x, 2)])
+
+
+def smooth_loop(cube, filter_size=3):
+    '''
+    The loop of the previous area_average_cpm.smooth_data, returning the smoothed fields.
+    '''
+
+    cube_out = cube.copy()
+    conv_array = np.full((filter_size, filter_size), 1/(filter_size*filter_size), dtype=np.float64)
+
+    smoothed = []
+    for i, c in enumerate(cube.slices_over('time')):
+        c_smooth = signal.convolve2d(c.data.data, conv_array, boundary='symm', mode='same')
+        cube_out[i].data[:,:] = c_smooth
+        smoothed.append(c_smooth)
+
+    return np.array(smoothed)
+
+
+def main():
+
+    nyears = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    ny = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    nx = int(sys.argv[3]) if len(sys.argv) > 3 else 80
+
+    cube = make_cube(nyears, ny, nx)
+    land = ~np.ma.getmaskarray(cube.data)
+    print(f'{cube.shape[0]} days on a {ny}x{nx} grid')
+
+    t0 = time.time()
+    looped = smooth_loop(cube)
+    t_loop = time.time() - t0
+    print(f'    3x3, loop over days:      {t_loop:7.2f} s')
+
+    t0 = time.time()
+    smoothed = area_average_cpm.smooth_data(cube)
+    t_box = time.time() - t0
+
+# Away from the coast the fill values of the sea do not reach the loop's means
+    inland = ndimage.minimum_filter(land[0], size=3, mode='reflect')
+    diff = np.abs(smoothed.data - looped)[:, inland].max()
+    print(f'    3x3, summed-area tables:  {t_box:7.2f} s, speed-up {t_loop/t_box:6.1f}, '
+        f'largest difference inland {diff:.2e}')
+
+    sizes = [3, 5, 7]
+    t0 = time.time()
+    for size in sizes:
+        smooth_loop(cube, size)
+    t_loop = time.time() - t0
+    t0 = time.time()
+    area_average_cpm.smooth_data_sizes(cube, sizes)
+    t_box = time.time() - t0
+    print(f'    {sizes}, loop over days:      {t_loop:7.2f} s')
+    print(f'    {sizes}, summed-area tables:  {t_box:7.2f} s, speed-up {t_loop/t_box:6.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''
+Memory benchmark for the statistics of validation.check_bias_correction.
+
+Writes a file of synthetic daily data, and then in a fresh process for each period length
+and method calculates the long-term means of the cells: by collapsing the cube over
+time (as check_bias_correction did before), and with stream_stats.accumulate, which also keeps
+the variance, minimum, maximum and histograms of each cell and month. The peak resident set
+size of each process is printed; that of stream_stats should not grow with the period.
+
+Usage:
+    python bench_stream_stats.py [work_dir] [nyears,nyears,...] [ny] [nx]
+'''
+
+import os
+import sys
+import time
+import resource
+import subprocess
+import tempfile
+import numpy as np
+import dask.array as da
+import iris
+import iris.cube
+from iris.coords import DimCoord
+from cf_units import Unit
+import stream_stats
+
+
+def write_file(filename, nyears, ny, nx):
+    '''
+    Writes nyears of synthetic daily temperatures on the 360-day calendar, a year at a time.
+    '''
+
+    nt = nyears * 360
+    data = da.random.RandomState(0).normal(283, 5, (nt, ny, nx), chunks=(360, ny, nx)).astype(np.float32)
+    time_coord = DimCoord(np.arange(nt) + 0.5, standard_name='time', units=Unit('days since 1980-12-01', calendar='360_day'))
+    y = DimCoord(np.arange(ny) * 0.02, standard_name='grid_latitude', units='degrees')
+    x = DimCoord(np.arange(nx) * 0.02, standard_name='grid_longitude', units='degrees')
+    cube = iris.cube.Cube(data, standard_name='air_temperature', units='K',
+        dim_coords_and_dims=[(time_coord, 0), (y, 1), (x, 2)])
+    iris.save(cube, filename, chunksizes=(360, ny, nx))
+
+
+def run(filename, nyears, mode):
+    '''
+    Calculates the long-term means of the first nyears of the file and prints the peak RSS in MB.
+    '''
+
+    t0 = time.time()
+    cube = iris.load_cube(filename)[:nyears*360]
+    if mode == 'collapsed':
+        lta = cube.collapsed('time', iris.analysis.MEAN).data
+    else:
+        lta = stream_stats.accumulate(cube).mean()
+    elapsed = time.time() - t0
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print(f'{nyears:4d} years, {mode:9s}: {elapsed:6.2f} s, peak RSS {peak_mb:5.0f} MB, mean {lta.mean():.3f}')
+
+
+def main():
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        run(sys.argv[2], int(sys.argv[3]), sys.argv[4])
+        return
+
+    work_dir = sys.argv[1] if len(sys.argv) > 1 else tempfile.mkdtemp()
+    periods = [int(n) for n in sys.argv[2].split(',')] if len(sys.argv) > 2 else [20, 60]
+    ny = int(sys.argv[3]) if len(sys.argv) > 3 else 40
+    nx = int(sys.argv[4]) if len(sys.argv) > 4 else 40
+
+    filename = os.path.join(work_dir, 'tas_synthetic.nc')
+    print(f'Writing {max(periods)} years of synthetic data on a {ny}x{nx} grid to {filename}')
+    write_file(filename, max(periods), ny, nx)
+
+# Each calculation runs in its own process, so that the peak RSS of one does not affect the others
+    for nyears in periods:
+        for mode in ['collapsed', 'stream']:
+            subprocess.run([sys.executable, __file__, '--run', filename, str(nyears), mode], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Benchmark for the time index in time_index.py.
+
+The calendar months of synthetic 360-day cubes, like the obs, model baseline and model
+scenario cubes of a bias correction, are selected as BC_timeslice_run_monthly.py used
+to, with 12 extracts of iris.Constraint(time=lambda cell: cell.point.month == month_number)
+on each cube, and with a TimeIndex of each cube and fancy indexing. The run times are
+printed, and the selected data are checked to be the same.
+
+Usage:
+    python bench_time_index.py [nyears] [ny] [nx]
+'''
+
+import sys
+import time
+import numpy as np
+import cf_units
+import iris
+import iris.cube
+import iris.coords
+import time_index
+
+
+def make_cube(year_start, nyears, ny, nx):
+    '''
+    Returns a cube of daily data on the 360-day calendar, from 1 December of year_start.
+    '''
+
+    ntimes = nyears * 360
+    units = cf_units.Unit('hours since 1970-01-01 00:00:00', calendar='360_day')
+    t0 = units.date2num(units.num2date(0).replace(year=year_start, month=12, day=1, hour=12))
+
+    cube = iris.cube.Cube(np.random.default_rng(0).random((ntimes, ny, nx), dtype=np.float32),
+        standard_name='air_temperature', units='K')
+    cube.add_dim_coord(iris.coords.DimCoord(t0 + 24. * np.arange(ntimes), standard_name='time', units=units), 0)
+    cube.add_dim_coord(iris.coords.DimCoord(np.arange(ny, dtype=np.float64), long_name='y'), 1)
+    cube.add_dim_coord(iris.coords.DimCoord(np.arange(nx, dtype=np.float64), long_name='x'), 2)
+
+    return cube
+
+
+def main():
+
+    nyears = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    ny = int(sys.argv[2]) if len(sys.argv) > 2 else 25
+    nx = int(sys.argv[3]) if len(sys.argv) > 3 else 27
+
+    cubes = [make_cube(1980, nyears, ny, nx), make_cube(1980, nyears, ny, nx), make_cube(2060, nyears, ny, nx)]
+
+    t0 = time.time()
+    by_constraint = []
+    for cube in cubes:
+        for month_number in list(range(1, 13)):
+            by_constraint.append(cube.extract(iris.Constraint(time=lambda cell: cell.point.month == month_number)))
+    t_constraint = time.time() - t0
+
+    t0 = time.time()
+    by_index = []
+    for cube in cubes:
+        index = time_index.TimeIndex(cube)
+        for month_number in list(range(1, 13)):
+            by_index.append(cube[index.month(month_number)])
+    t_index = time.time() - t0
+
+    same = all(np.array_equal(a.data, b.data) and a.coord('time') == b.coord('time')
+        for a, b in zip(by_constraint, by_index))
+    print(f'3 cubes of {nyears} years on a {ny}x{nx} grid, 12 months each: '
+        f'constraints {t_constraint:6.2f} s, index {t_index:6.2f} s, speed-up {t_constraint/t_index:5.1f}, same: {same}')
+
+# The grouping alone, without subsetting the cubes
+    t0 = time.time()
+    index = time_index.TimeIndex(cubes[0])
+    groups = [index.month(m) for m in range(1, 13)] + [index.season(s) for s in time_index.SEASONS] \
+        + [index.window(d, 15) for d in range(1, 361)]
+    print(f'Index of {cubes[0].shape[0]} times, and 12 months, 4 seasons and 360 moving windows: '
+        f'{time.time()-t0:.3f} s')
+
+
+if __name__ == '__main__':
+    main()
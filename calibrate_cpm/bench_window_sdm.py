@@ -0,0 +1,96 @@
+'''
+Benchmark for the moving-window Scaled Distribution Mapping in window_sdm.py.
+
+Synthetic model baseline and scenario data with a seasonal cycle on the 360-day calendar,
+and obs on the Gregorian calendar (as HadUK-Grid), are corrected
+    - by calendar month, with sdm.py, as BC_timeslice_run_monthly.py does by default;
+    - by window_sdm.correct_by_window, with windows centred every 1, 5, 10 and 30 days (step),
+      with the obs dates mapped to the 360-day calendar as window_sdm.correct_windows does.
+The run times are printed, with the mean change from one day of the year to the next
+in the mean correction (corrected - raw scenario) at the boundaries of the months, and
+on the other days.
+
+Usage:
+    python bench_window_sdm.py [var_name] [ncells] [nyears] [half_width]
+'''
+
+import sys
+import time
+import numpy as np
+import sdm
+import window_sdm
+
+
+def make_data(var_name, ncells, nyears, seed=0):
+    '''
+    Returns synthetic (obs, mod, sce) arrays of shape (time, cell), and the month and day of the
+    360-day year of each time of obs and of mod and sce. The obs are daily from 1 December on the
+    Gregorian calendar, and the others on the 360-day calendar.
+    '''
+
+    rng = np.random.default_rng(seed)
+    ntimes = nyears * 360
+    days = np.tile(np.arange(1, 361), nyears)
+    season = np.sin(2 * np.pi * days / 360)[:, None]
+
+    dates = np.arange(np.datetime64('1980-12-01'), np.datetime64(f'{1980+nyears}-12-01'))
+    obs_months = dates.astype('datetime64[M]').astype(int) % 12 + 1
+    obs_day_of_month = (dates - dates.astype('datetime64[M]')).astype(int) + 1
+    obs_days = (obs_months - 1) * 30 + np.minimum(obs_day_of_month, 30)
+    obs_season = np.sin(2 * np.pi * ((dates - dates.astype('datetime64[Y]')).astype(int) + 1) / 365.25)[:, None]
+
+    if var_name == 'tasmax':
+        obs = 8 + 6*obs_season + rng.normal(0, 3, (len(dates), ncells))
+        mod = 9 + 9*season + rng.normal(0, 3.5, (ntimes, ncells))
+        sce = 11 + 9*season + np.linspace(0, 2, ntimes)[:, None] + rng.normal(0, 3.8, (ntimes, ncells))
+    else:
+        obs, mod, sce = [np.where(rng.random((len(s), ncells)) < p, rng.gamma(0.8, a*(1.2+s), (len(s), ncells)), 0.)
+            for s, p, a in [(obs_season, 0.45, 3), (season, 0.55, 2), (season, 0.5, 2.4)]]
+
+    return obs, mod, sce, obs_months, obs_days, (days - 1) // 30 + 1, days
+
+
+def jumps(sce, corrected, nyears):
+    '''
+    Returns the mean size of the change in the mean correction from one day of the year to the
+    next, at the boundaries of the months and on the other days.
+    '''
+
+    correction = (corrected - sce).reshape(nyears, 360, -1).mean(axis=(0, 2))
+    change = np.abs(np.diff(correction))
+    boundary = np.arange(1, 360) % 30 == 0
+
+    return f'change in correction at month boundaries {change[boundary].mean():.3f}, other days {change[~boundary].mean():.3f}'
+
+
+def main():
+
+    var_name = sys.argv[1] if len(sys.argv) > 1 else 'tasmax'
+    ncells = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    nyears = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    half_width = int(sys.argv[4]) if len(sys.argv) > 4 else 15
+
+    standard_name = 'air_temperature' if var_name == 'tasmax' else 'precipitation_amount'
+    method = sdm.select_method(standard_name)
+    obs, mod, sce, obs_months, obs_days, months, days = make_data(var_name, ncells, nyears)
+    print(f'{var_name}, {ncells} cells, {nyears} years, window of +/- {half_width} days')
+
+    t0 = time.time()
+    corrected = sce.copy()
+    for month_number in range(1, 13):
+        rows = months == month_number
+        corrected[rows] = method(obs[obs_months == month_number], mod[rows], sce[rows])
+    t_month = time.time() - t0
+    print(f'    by month:          {t_month:7.2f} s,                    {jumps(sce, corrected, nyears)}')
+
+    for step in [1, 5, 10, 30]:
+        t0 = time.time()
+        corrected = window_sdm.correct_by_window(obs, mod, sce, obs_days, days, days, standard_name,
+            half_width=half_width, step=step)
+        t_window = time.time() - t0
+        print(f'    step {step:2d} days:     {t_window:7.2f} s ({t_window/t_month:5.1f} x by month), '
+            f'{jumps(sce, corrected, nyears)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+'''
+An on-disk catalog (SQLite database) of the files in the UKCP Local and HadUK-Grid archives.
+
+Listing the archive directories on /project is slow, and was being done again in every
+batch job. The catalog is built once, by running this module, and the loaders query it
+for the files they need. Re-run it to refresh the catalog when files are added to the archives:
+
+       python catalog.py [catalog_file]
+
+The location of the catalog is taken from the environment variable CREDO_CATALOG if set.
+'''
+
+import os
+import re
+import sys
+import sqlite3
+
+CATALOG_FILE = os.environ.get('CREDO_CATALOG',
+    os.path.join(os.path.expanduser('~'), '.credo_file_catalog.sqlite'))
+
+# Top-level directories of the archives, and the patterns of the file paths below them
+DATA_ROOTS = {
+    'cpm': '/project/ukcp/land-cpm/uk/2.2km/rcp85',
+    'obs': '/project/ukcp18/ncic_observations/post_processed/badc/ukmo-hadobs/data/insitu/MOHC/' +
+        'HadOBS/HadUK-Grid/v1.0.0.0/1km',
+}
+
+PATH_PATTERNS = {
+    'cpm': re.compile(r'(?P<member>\d{2})/(?P<var>\w+)/day/(?P<version>\w+)/(?P=var)_rcp85_land-cpm_uk_'
+        r'(?P<grid>[\d.]+km)_(?P=member)_day_(?P<start>\d{8})-(?P<end>\d{8})\.nc$'),
+    'obs': re.compile(r'(?P<var>\w+)/day/(?P<version>\w+)/(?P=var)_hadukgrid_uk_'
+        r'(?P<grid>[\d.]+km)_day_(?P<start>\d{8})-(?P<end>\d{8})\.nc$'),
+}
+
+
+def connect(catalog_file=None):
+    '''
+    Opens the catalog, creating the tables if they do not exist.
+    '''
+
+    if catalog_file is None:
+        catalog_file = CATALOG_FILE
+
+    con = sqlite3.connect(catalog_file)
+    con.execute('''CREATE TABLE IF NOT EXISTS files (
+        path TEXT PRIMARY KEY, source TEXT, variable TEXT, ensemble_member INTEGER,
+        grid TEXT, version TEXT, start_date INTEGER, end_date INTEGER)''')
+    con.execute('CREATE INDEX IF NOT EXISTS files_idx ON files (source, variable, ensemble_member, start_date)')
+
+    return con
+
+
+def scan_archive(source, data_root):
+    '''
+    Walks the archive below data_root and returns a list of
+    (path, source, variable, ensemble_member, grid, version, start_date, end_date) records.
+    '''
+
+    pattern = PATH_PATTERNS[source]
+    records = []
+    for dirpath, dirnames, filenames in os.walk(data_root):
+        for f in filenames:
+            path = os.path.join(dirpath, f)
+            match = pattern.search(os.path.relpath(path, data_root))
+            if match is None:
+                continue
+            member = match.groupdict().get('member')
+            records.append((path, source, match.group('var'), None if member is None else int(member),
+                match.group('grid'), match.group('version'), int(match.group('start')), int(match.group('end'))))
+
+    return records
+
+
+def refresh_catalog(catalog_file=None, data_roots=None):
+    '''
+    Builds or refreshes the catalog. Each archive is scanned, new files are added and
+    files which no longer exist are removed.
+
+    catalog_file -- The catalog to update (default: CATALOG_FILE)
+    data_roots -- Dictionary of archive name to top-level directory (default: DATA_ROOTS)
+    '''
+
+    if data_roots is None:
+        data_roots = DATA_ROOTS
+
+    con = connect(catalog_file)
+    with con:
+        for source, data_root in data_roots.items():
+            records = scan_archive(source, data_root)
+            con.execute('DELETE FROM files WHERE source = ?', (source,))
+            con.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)', records)
+            print(f'{source}: {len(records)} files under {data_root}')
+    con.close()
+
+
+def find_files(source, var, year_range, monstart=1, monend=12, ensemble_member=None, grid=None,
+    version=None, catalog_file=None):
+    '''
+    Returns the sorted list of files from an archive whose dates overlap the given period.
+
+    source -- The archive, 'cpm' or 'obs'
+    var -- The name of the variable as used in the archive
+    year_range -- The first and last years of data required
+    monstart -- The first month of data required
+    monend -- The last month of data required
+    ensemble_member -- The UKCP18 CPM ensemble member (CPM data only)
+    grid -- The grid resolution, e.g., '2.2km', '1km' (optional)
+    version -- The version of the data, e.g., 'v20210615' (optional)
+    catalog_file -- The catalog to query (default: CATALOG_FILE)
+    '''
+
+    if catalog_file is None:
+        catalog_file = CATALOG_FILE
+    if not os.path.exists(catalog_file):
+        raise FileNotFoundError(f'File catalog {catalog_file} not found - run catalog.py to create it')
+
+    period_start = year_range[0]*10000 + monstart*100 + 1
+    period_end = year_range[1]*10000 + monend*100 + 31
+
+    query = 'SELECT path FROM files WHERE source = ? AND variable = ? AND start_date <= ? AND end_date >= ?'
+    args = [source, var, period_end, period_start]
+    if ensemble_member is not None:
+        query += ' AND ensemble_member = ?'
+        args.append(ensemble_member)
+    if grid is not None:
+        query += ' AND grid = ?'
+        args.append(grid)
+    if version is not None:
+        query += ' AND version = ?'
+        args.append(version)
+
+    con = connect(catalog_file)
+    filenames = [row[0] for row in con.execute(query + ' ORDER BY path', args)]
+    con.close()
+
+    return filenames
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        refresh_catalog(catalog_file=sys.argv[1])
+    else:
+        refresh_catalog()
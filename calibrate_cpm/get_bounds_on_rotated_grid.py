@@ -4,8 +4,12 @@ import numpy as np
 import pandas as pd
 from iris.analysis.cartography import rotate_pole
 from iris.time import PartialDateTime
+import grid_descriptor
+import region_weights
+import region_mask
 
 project_name = 'CReDo'
+region_name = 'East_Anglia'
 datadir = f'/home/h03/hadmi/Python/{project_name}/data_files/'
 
 # Read in sample data on the UKCP Local 2.2 km grid
@@ -21,7 +25,7 @@ pole_lat = cube.coord('grid_longitude').coord_system.grid_north_pole_latitude
 pole_lon = cube.coord('grid_longitude').coord_system.grid_north_pole_longitude
 
 # Read in the coordinates of the shapefile of the area around King's Lynn.
-df = pd.read_csv(os.path.join(datadir, 'East_Anglia_shape_0_coordinates.csv'),
+df = pd.read_csv(os.path.join(datadir, f'{region_name}_shape_0_coordinates.csv'),
     header=0, usecols=[2,3])
 
 # Find the maximim and minimum lons and lats on the regular (plate carree) grid
@@ -47,9 +51,29 @@ print('Lon Limits: ', 360.0+min(rot_lons), 360.0+max(rot_lons))
 print('Lat Limits: ', min(rot_lats), max(rot_lats))
 
 # Save the limits to a file
-ofilename = 'East_Anglia_rotgrid_limits.dat'
+ofilename = f'{region_name}_rotgrid_limits.dat'
 oline0 = 'min(rot_lons),max(rot_lons),min(rot_lats),max(rot_lats)'
 oline1 = '{:f},{:f},{:f},{:f}'.format(min(rot_lons), max(rot_lons), min(rot_lats), max(rot_lats))
 with open(os.path.join(datadir, ofilename), "w") as ofp:
     ofp.write(oline0+'\n')
     ofp.write(oline1)
+
+# Save a description of the CPM grid inside the limits (as selected by prep_cpm_data.py),
+# used as the target grid when regridding the observations. The limits are taken as written to the file.
+x0, x1, y0, y1 = [float(b) for b in oline1.split(',')]
+lons = cube.coord('grid_longitude').points
+lats = cube.coord('grid_latitude').points
+ix = np.where((lons >= x0+360.0) & (lons <= x1+360.0))[0]
+iy = np.where((lats >= y0) & (lats <= y1))[0]
+region_cube = cube[..., iy[0]:iy[-1]+1, ix[0]:ix[-1]+1]
+
+# The mask of the cells overlapping the polygon is stored with the grid, so only those cells can be
+# extracted, calibrated and merged
+polygon = region_weights.read_polygon(region_weights.polygon_filename(project_name, region_name))
+mask = region_mask.compute_mask(polygon, region_cube)
+print(f'{mask.sum()} of {mask.size} cells overlap the polygon')
+grid_descriptor.write_grid_descriptor(region_cube,
+    grid_descriptor.grid_descriptor_filename(project_name, region_name), mask=mask)
+
+# Save the fraction of each cell of the grid covered by the polygon of the region, used for area means
+region_weights.load_or_compute_weights(project_name, region_name, region_cube)
@@ -0,0 +1,133 @@
+'''
+A small description of the UKCP Local grid over a region: the rotated pole coordinate
+system, the grid longitudes and latitudes with their bounds, and the 2-D true longitudes
+and latitudes. It is written once, by get_bounds_on_rotated_grid.py, and used to define
+the target grid for regridding the observations, instead of loading a processed CPM file.
+
+The descriptor is stored as a .npz file in the project's data_files directory, e.g.
+East_Anglia_cpm_grid.npz. It may also hold the mask of the cells overlapping the polygon of the
+region (see region_mask.py).
+'''
+
+import os
+import tempfile
+import numpy as np
+import iris
+import iris.cube
+from iris.coords import DimCoord, AuxCoord
+from iris.coord_systems import GeogCS, RotatedGeogCS
+
+# Grids already read by this process
+_loaded_grids = {}
+
+
+def grid_descriptor_filename(project_name, region_name):
+    '''
+    Returns the name of the grid descriptor file for a region.
+    '''
+
+    datadir = f'/home/h03/hadmi/Python/{project_name}/data_files/'
+
+    return os.path.join(datadir, f'{region_name}_cpm_grid.npz')
+
+
+def write_grid_descriptor(cube, filename, mask=None):
+    '''
+    Writes the horizontal grid of a cube on the UKCP Local (rotated pole) grid to filename.
+    Only the coordinates of the cube are used.
+
+    mask -- If given, a boolean array of shape (y, x) of the cells overlapping the region, as made by
+        region_mask.compute_mask, which is stored with the grid
+    '''
+
+    x = cube.coord('grid_longitude').copy()
+    y = cube.coord('grid_latitude').copy()
+    for c in [x, y]:
+        if not c.has_bounds():
+            c.guess_bounds()
+    cs = x.coord_system
+
+# The 2-D latitudes and longitudes are on the last two dimensions of the cube
+    lat = cube.coord('latitude')
+    lon = cube.coord('longitude')
+
+    descriptor = dict(
+        grid_north_pole_latitude=cs.grid_north_pole_latitude,
+        grid_north_pole_longitude=cs.grid_north_pole_longitude,
+        north_pole_grid_longitude=cs.north_pole_grid_longitude,
+        semi_major_axis=cs.ellipsoid.semi_major_axis,
+        semi_minor_axis=cs.ellipsoid.semi_minor_axis,
+        x_points=x.points, x_bounds=x.bounds,
+        y_points=y.points, y_bounds=y.bounds,
+        latitude=lat.points, longitude=lon.points)
+    if mask is not None:
+        descriptor['region_mask'] = mask
+
+# Write to a temporary file and rename it, so other jobs never see a partly written file
+    dout = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_file = tempfile.mkstemp(suffix='.npz', dir=dout)
+    with os.fdopen(fd, 'wb') as ofp:
+        np.savez(ofp, **descriptor)
+    os.replace(tmp_file, filename)
+
+    return
+
+
+def load_grid_descriptor(filename):
+    '''
+    Returns a 2-D (y, x) cube of zeros with the grid described in filename, which can be used
+    as the target grid for regridding.
+    '''
+
+    if filename in _loaded_grids:
+        return _loaded_grids[filename].copy()
+
+    with np.load(filename) as d:
+        ellipsoid = GeogCS(float(d['semi_major_axis']), float(d['semi_minor_axis']))
+        cs = RotatedGeogCS(float(d['grid_north_pole_latitude']), float(d['grid_north_pole_longitude']),
+            north_pole_grid_longitude=float(d['north_pole_grid_longitude']), ellipsoid=ellipsoid)
+
+        x = DimCoord(d['x_points'], bounds=d['x_bounds'], standard_name='grid_longitude', units='degrees',
+            coord_system=cs)
+        y = DimCoord(d['y_points'], bounds=d['y_bounds'], standard_name='grid_latitude', units='degrees',
+            coord_system=cs)
+        lat = AuxCoord(d['latitude'], standard_name='latitude', units='degrees')
+        lon = AuxCoord(d['longitude'], standard_name='longitude', units='degrees')
+
+    cube = iris.cube.Cube(np.zeros((len(y.points), len(x.points)), dtype=np.float32),
+        dim_coords_and_dims=[(y, 0), (x, 1)], aux_coords_and_dims=[(lat, (0, 1)), (lon, (0, 1))])
+    _loaded_grids[filename] = cube
+
+    return cube.copy()
+
+
+def load_grid_mask(filename):
+    '''
+    Returns the mask of the cells overlapping the region stored in the grid descriptor file, as a
+    boolean array of shape (y, x), or None if the file or the mask does not exist.
+    '''
+
+    if not os.path.exists(filename):
+        return None
+
+    with np.load(filename) as d:
+        if 'region_mask' not in d:
+            return None
+        return d['region_mask']
+
+
+def load_region_mask(project_name, region_name):
+    '''
+    Returns the mask of the cells overlapping the polygon of a region, from its grid descriptor file,
+    or None if it has no mask.
+    '''
+
+    return load_grid_mask(grid_descriptor_filename(project_name, region_name))
+
+
+def load_region_grid(project_name, region_name):
+    '''
+    Returns the target grid cube for a region, from its grid descriptor file.
+    '''
+
+    return load_grid_descriptor(grid_descriptor_filename(project_name, region_name))
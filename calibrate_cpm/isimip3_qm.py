@@ -0,0 +1,150 @@
+'''
+Trend-preserving quantile mapping in the style of ISIMIP3BASD (Lange, 2019, GMD 12, 3055-3070),
+working on whole arrays of grid cells at once.
+
+ISIMIP3BASD's bias_adjustment.py (see test_isimip3.sh) reads and corrects one grid cell at a
+time. Here, as in sdm.py, the data for a month are arrays of shape (time, cell), and each step
+is done for all cells with a single NumPy call, so parallel_sdm.correct_months can share the
+tiles of grid cells among worker processes in the same way as for SDM.
+
+For each cell the method
+    1. builds pseudo future observations, by applying the change from the model baseline to the
+       scenario at each quantile of the scenario to the same quantile of the observations
+       (additively for temperature; multiplicatively for precipitation, or additively where the
+       change factor is not defined or larger than max_change_factor);
+    2. maps the scenario onto the pseudo future observations by parametric quantile mapping, with
+       the normal distribution for temperature, and the gamma distribution for the wet days of
+       precipitation, whose number is set by the pseudo future observations.
+For temperature the linear trends are removed first, and the trend of the scenario is added back,
+as with ISIMIP3BASD's detrend option. This is not a port of ISIMIP3BASD: the running window,
+randomisation of dry days and bounded variables are not included.
+'''
+
+import numpy as np
+import scipy.signal
+from scipy.special import ndtr, ndtri, gammainc, gammaincinv
+import sdm
+from sdm import CDF_THRESHOLD, LOWER_LIMIT
+
+MAX_CHANGE_FACTOR = 100.
+
+
+def _quantiles(sorted_data, p):
+    '''
+    Returns the empirical quantiles, at the probabilities p, of each column of sorted_data, with
+    the sorted values at the Weibull plotting positions k/(n+1), k = 1...n.
+    '''
+
+    n = sorted_data.shape[0]
+    pos = np.clip(p * (n + 1) - 1, 0, n - 1)
+    i0 = np.minimum(np.floor(pos).astype(int), max(n - 2, 0))
+    i1 = np.minimum(i0 + 1, n - 1)
+    w = (pos - i0)[:, None]
+
+    return sorted_data[i0] + w * (sorted_data[i1] - sorted_data[i0])
+
+
+def _detrend(data):
+    '''
+    Returns the data with the linear trend of each column removed, keeping the mean, and the trend
+    relative to the mean.
+    '''
+
+    detrended = scipy.signal.detrend(data, axis=0) + data.mean(axis=0)
+
+    return detrended, data - detrended
+
+
+def additive_qm(obs, mod, sce, cdf_threshold=CDF_THRESHOLD):
+    '''
+    Trend-preserving quantile mapping with additive changes and the normal distribution (e.g. temperature).
+    obs, mod and sce are arrays of shape (time, cell), and the corrected scenario data are returned.
+    '''
+
+    obs, _ = _detrend(obs)
+    mod, _ = _detrend(mod)
+    sce, sce_trend = _detrend(sce)
+
+# Pseudo future observations at the quantiles of the sorted scenario
+    p = np.arange(1, sce.shape[0]+1) / (sce.shape[0] + 1)
+    pseudo = _quantiles(np.sort(obs, axis=0), p) + np.sort(sce, axis=0) - _quantiles(np.sort(mod, axis=0), p)
+
+    cdf = ndtr((sce - sce.mean(axis=0)) / sce.std(axis=0))
+    cdf = np.maximum(np.minimum(cdf, cdf_threshold), 1 - cdf_threshold)
+
+    return pseudo.mean(axis=0) + pseudo.std(axis=0) * ndtri(cdf) + sce_trend
+
+
+def mixed_qm(obs, mod, sce, lower_limit=LOWER_LIMIT, cdf_threshold=CDF_THRESHOLD, max_change_factor=MAX_CHANGE_FACTOR):
+    '''
+    Trend-preserving quantile mapping with multiplicative changes and the gamma distribution for the
+    wet days (e.g. precipitation). obs, mod and sce are arrays of shape (time, cell), and the corrected
+    scenario data are returned. Days below lower_limit are dry, and are set to 0. Cells for which the
+    gamma distribution cannot be fitted to the wet days of the pseudo future observations are returned
+    uncorrected; where it cannot be fitted to those of the scenario, their empirical CDF is used.
+    '''
+
+    n = sce.shape[0]
+    p = np.arange(1, n+1) / (n + 1)
+
+    sce_argsort = np.argsort(sce, axis=0)
+    sce_sorted = np.take_along_axis(sce, sce_argsort, axis=0)
+    obs_q = _quantiles(np.sort(obs, axis=0), p)
+    mod_q = _quantiles(np.sort(mod, axis=0), p)
+
+# Pseudo future observations, with the change factor where the baseline quantile is wet
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = sce_sorted / mod_q
+        multiplicative = (mod_q >= lower_limit) & (factor <= max_change_factor) & (factor >= 1 / max_change_factor)
+        pseudo = np.where(multiplicative, obs_q * factor, np.maximum(obs_q + sce_sorted - mod_q, 0.))
+
+    pseudo_wet = pseudo >= lower_limit
+    sce_wet = sce_sorted >= lower_limit
+    n_pseudo = pseudo_wet.sum(axis=0)
+    n_sce = sce_wet.sum(axis=0)
+    pseudo_gamma = sdm.fit_gamma(pseudo, pseudo_wet)
+    sce_gamma = sdm.fit_gamma(sce_sorted, sce_wet)
+    ok = np.isfinite(pseudo_gamma[0]) | (n_pseudo == 0)
+
+# The wettest n_pseudo days of the scenario are wet. Their probabilities above lower_limit are
+# those of the wet days of the scenario, scaled for the change in the number of wet days, and
+# those of any dry days made wet are spread evenly below them.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sce_limit = gammainc(sce_gamma[0], lower_limit / sce_gamma[1])
+        p_sce = (gammainc(sce_gamma[0], sce_sorted / sce_gamma[1]) - sce_limit) / (1 - sce_limit)
+
+# Where the gamma distribution cannot be fitted to the wet days of the scenario (e.g. there is
+# only one), their probabilities are their ranks among the wet days instead
+        rank = np.arange(n)[:, None] - (n - n_sce)
+        p_sce = np.where(np.isfinite(sce_gamma[0]), p_sce, (rank + .5) / n_sce)
+        p_wet = 1 - (1 - p_sce) * n_sce / n_pseudo
+        j = np.arange(n)[:, None] - (n - n_pseudo)
+        p_wet = np.where(sce_wet, p_wet, (j + .5) / n_pseudo)
+
+        pseudo_limit = gammainc(pseudo_gamma[0], lower_limit / pseudo_gamma[1])
+        p_wet = pseudo_limit + np.clip(p_wet, 0, 1) * (1 - pseudo_limit)
+        p_wet = np.minimum(p_wet, cdf_threshold)
+
+    target = (j >= 0) & ok
+    sorted_correction = np.zeros(sce.shape)
+    shape = np.broadcast_to(pseudo_gamma[0], sce.shape)[target]
+    scale = np.broadcast_to(pseudo_gamma[1], sce.shape)[target]
+    sorted_correction[target] = np.maximum(gammaincinv(shape, p_wet[target]) * scale, lower_limit)
+
+    correction = np.zeros(sce.shape)
+    np.put_along_axis(correction, sce_argsort, sorted_correction, axis=0)
+
+    return np.where(ok, correction, sce)
+
+
+def select_method(standard_name):
+    '''
+    Returns the form of trend-preserving quantile mapping used for a variable.
+    '''
+
+    if standard_name == 'air_temperature':
+        return additive_qm
+    elif standard_name in ['precipitation_amount', 'surface_downwelling_shortwave_flux_in_air']:
+        return mixed_qm
+    else:
+        raise NotImplementedError(f'Trend-preserving quantile mapping is not implemented for {standard_name}')
@@ -4,11 +4,18 @@ for CLIMAR project whose focus is Bristol.
 '''
 
 import os
-import sys
+import re
 import glob
+import time
 import iris
 import numpy as np
+import dask.array as da
+from dask.array.utils import meta_from_array
 from cf_units import Unit
+import catalog
+
+# Matches the dates at the end of a file name, e.g. ..._day_19801201-19811130.nc
+FILE_DATES = re.compile(r'(\d{8})-(\d{8})\.nc$')
 
 
 def ukcp18_callback(cube, field, filename):
@@ -95,19 +102,64 @@ def ukcp18_callback(cube, field, filename):
 # Remove attributes as they can prevent the cubes from concatenating
     cube.attributes = {}
 
-# Now do the datatype conversion:
-    if cube.data.dtype != np.float32:
-# Add mask and change data type:
-#       print("---> Changing cube data type from file "+filename+"...",)# <-- no newline
-        cube.data = np.ma.asarray(cube.data, dtype=np.float32)
-#       print("---> Done.")
-        sys.stdout.flush()
-    else:
-# Just mask it:
-        #print "---> Adding mask to cube from file "+filename+"...", # <-- no newline
-        cube.data = np.ma.array(cube.data)
-        #print "---> Done."
-        sys.stdout.flush()
+# Now do the datatype conversion. This is done on the lazy (dask) data so that nothing
+# is read here, and the area and time constraints passed to iris.load decide which
+# data are read from disk. Only add operations to the dask graph if they are needed,
+# as dask cannot push the constraints' slicing back through them to the file reads.
+    data = cube.lazy_data()
+    if data.dtype != np.float32:
+# Change data type:
+        data = data.astype(np.float32)
+    if not isinstance(meta_from_array(data), np.ma.MaskedArray):
+# Add mask:
+        data = da.ma.masked_array(data)
+    cube.data = data
+
+
+def select_files_in_period(filenames, year_range, monstart=1, monend=12):
+    '''
+    Returns the files whose dates overlap the period to be loaded. The dates are taken
+    from the YYYYMMDD-YYYYMMDD range at the end of the UKCP and HadUK-Grid file names,
+    so the files themselves are not opened. Files without a date range in their name are kept.
+
+    filenames -- List of file names
+    year_range -- The first and last years of data to load
+    monstart -- The first month of data to load
+    monend -- The last month of data to load
+    '''
+
+    period_start = year_range[0]*10000 + monstart*100 + 1
+    period_end = year_range[1]*10000 + monend*100 + 31
+
+    selected = []
+    for f in filenames:
+        dates = FILE_DATES.search(os.path.basename(f))
+        if dates is None:
+            selected.append(f)
+        elif int(dates.group(1)) <= period_end and int(dates.group(2)) >= period_start:
+            selected.append(f)
+
+    return selected
+
+
+def load_and_concatenate(filenames, con, year_range, monstart=1, monend=12, index=None):
+    '''
+    Loads the files which overlap the given period, applying constraint 'con',
+    and returns a single cube. The number of files opened and the time taken are printed.
+    If 'index' is given, each cube is indexed with it before concatenation. As the data
+    are still lazy, only that part of each file is read.
+    '''
+
+    filenames = select_files_in_period(filenames, year_range, monstart=monstart, monend=monend)
+
+    t0 = time.time()
+    clist = iris.load(filenames, con, callback=ukcp18_callback)
+    if index is not None:
+        clist = iris.cube.CubeList([c[index] for c in clist])
+    cube = clist.concatenate_cube()
+    print(f'Loaded {len(filenames)} files in {time.time()-t0:.1f} s')
+
+    return cube
 
 
 def load_UKCP18_obs_1km(var, year_range, monstart=1, monend=12):
@@ -120,22 +172,16 @@ def load_UKCP18_obs_1km(var, year_range, monstart=1, monend=12):
     monend -- The last month of data to correct
     '''
 
-    ddir='/project/ukcp18/ncic_observations/post_processed/badc/ukmo-hadobs/' + \
-        'data/insitu/MOHC/HadOBS/HadUK-Grid/v1.0.0.0/1km/'+var+'/day/v20181126/'
-
     # NEW CONSTRAINT - allow for starting in december rather than january (if needed)
     dtlims = [iris.time.PartialDateTime(year=year_range[0], month=monstart), \
       iris.time.PartialDateTime(year=year_range[1], month=monend) ]
 
     ycon = iris.Constraint(time = lambda t: dtlims[0] <= t.point <= dtlims[1])
 
-    filenames_template = var + '*nc'
-    filenames = glob.glob(os.path.join(ddir, filenames_template))
-    filenames.sort()
-
-    clist = iris.load(filenames, ycon, callback=ukcp18_callback)
+    filenames = catalog.find_files('obs', var, year_range, monstart=monstart, monend=monend,
+        grid='1km', version='v20181126')
 
-    return clist.concatenate_cube()
+    return load_and_concatenate(filenames, ycon, year_range, monstart=monstart, monend=monend)
 
 
 def make_filename(user_id, project_name, area_name, var_type, var_name, year_range,
@@ -184,12 +230,20 @@ def load_UKCP18_obs_2p2km(user_id, var, year_range, monstart=1, monend=12):
     filenames = glob.glob(os.path.join(ddir, filenames_template))
     filenames.sort()
 
-    clist = iris.load(filenames, ycon, callback=ukcp18_callback)
+    return load_and_concatenate(filenames, ycon, year_range, monstart=monstart, monend=monend)
+
 
-    return clist.concatenate_cube()
+def raw_UKCP18_cpm_filenames(var, year_range, ensemble_member, monstart=1, monend=12):
+    '''
+    Returns the names of the raw UKCP18 CPM files covering the given period.
+    '''
 
+    return catalog.find_files('cpm', var, year_range, monstart=monstart, monend=monend,
+        ensemble_member=ensemble_member, grid='2.2km', version='v20210615')
 
-def load_raw_UKCP18_cpm_data(var, year_range, ensemble_member, monstart=1, monend=12, con=None):
+
+def load_raw_UKCP18_cpm_data(var, year_range, ensemble_member, monstart=1, monend=12, con=None,
+    region_index=None):
     '''
     Reads in the raw UKCP18 CPM data (i.e. UKCP Local) on the native 2.2 km rotated polar grid.
     These data are the whole CPM domain, which is the UK, NW France, and parts of the Atlantic ocean.
@@ -200,15 +254,10 @@ def load_raw_UKCP18_cpm_data(var, year_range, ensemble_member, monstart=1, monen
     monstart -- The first month of data to correct
     monend -- The last month of data to correct
     con -- Additional constraints applied whne loading the data (optional)
+    region_index -- Index of the ensemble member, rows and columns to read from each file,
+        as returned by prep_cpm_data.get_region_index (optional)
     '''
 
-    ID = '{:02d}'.format(ensemble_member)
-
-    dir_head = '/project/ukcp/land-cpm/uk/2.2km/rcp85/'
-    subdir = f'{ID}/{var}/day/v20210615/'
-
-    filenames_template = f'{var}_rcp85_land-cpm_uk_2.2km' + '*nc'
-
     # NEW CONSTRAINT - allow for starting in December rather than January (if needed)
     dtlims = [iris.time.PartialDateTime(year=year_range[0], month=monstart), \
       iris.time.PartialDateTime(year=year_range[1], month=monend) ]
@@ -217,12 +266,10 @@ def load_raw_UKCP18_cpm_data(var, year_range, ensemble_member, monstart=1, monen
     if con is not None:
         ycon = ycon & con
 
-    filenames = glob.glob(os.path.join(dir_head, subdir, filenames_template))
-    filenames.sort()
-
-    clist = iris.load(filenames, ycon, callback=ukcp18_callback)
+    filenames = raw_UKCP18_cpm_filenames(var, year_range, ensemble_member, monstart=monstart, monend=monend)
 
-    return clist.concatenate_cube()
+    return load_and_concatenate(filenames, ycon, year_range, monstart=monstart, monend=monend,
+        index=region_index)
 
 
 def load_processed_UKCP18_cpm_data(user_id, var, year_range, ensemble_member, monstart=1, monend=12, con=None):
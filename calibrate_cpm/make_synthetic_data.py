@@ -0,0 +1,212 @@
+'''
+Routines to write small synthetic copies of the UKCP Local (CPM) and HadUK-Grid archives,
+laid out and named in the same way as the files under /project.
+They are used by the benchmark scripts, so that the loading and regridding code
+can be timed away from the Met Office file systems.
+'''
+
+import os
+import datetime
+import numpy as np
+import iris
+import iris.cube
+from iris.analysis.cartography import unrotate_pole
+import cftime
+import cartopy.crs as ccrs
+from iris.coords import DimCoord, AuxCoord
+from iris.coord_systems import RotatedGeogCS, TransverseMercator, GeogCS
+from cf_units import Unit
+
+# Properties of the UKCP Local 2.2 km rotated polar grid
+CPM_NX = 484
+CPM_NY = 606
+CPM_DX = 0.0198
+CPM_X0 = 353.9
+CPM_Y0 = -4.6
+CPM_POLE_LON = 177.5
+CPM_POLE_LAT = 37.5
+
+# Properties of the HadUK-Grid 1 km grid on the OSGB
+OBS_NX = 900
+OBS_NY = 1450
+OBS_X0 = -199500.0
+OBS_Y0 = -199500.0
+
+EARTH = GeogCS(6371229.0)
+
+
+def cpm_coord_system():
+    '''
+    Returns the rotated polar coordinate system used by UKCP Local
+    '''
+
+    return RotatedGeogCS(CPM_POLE_LAT, CPM_POLE_LON, ellipsoid=EARTH)
+
+
+def osgb_coord_system():
+    '''
+    Returns the British National Grid coordinate system used by HadUK-Grid
+    '''
+
+    return TransverseMercator(49.0, -2.0, 400000.0, -100000.0, 0.9996012717,
+        ellipsoid=GeogCS(6377563.396, 6356256.909))
+
+
+def make_cpm_cube(var, year, ensemble_member, nx=CPM_NX, ny=CPM_NY, ndays=360):
+    '''
+    Creates a cube which looks like one year (December to November) of raw UKCP Local data.
+
+    var -- The name of the variable, e.g., 'tasmax', 'pr'
+    year -- The year of the December at the start of the file
+    ensemble_member -- The UKCP18 CPM ensemble member, an integer between 1 and 15
+    nx, ny -- The size of the grid
+    ndays -- The number of days in the file
+    '''
+
+    tunits = Unit('hours since 1970-01-01 00:00:00', calendar='360_day')
+    dates = [cftime.Datetime360Day(year, 12, 1, 12) + datetime.timedelta(days=d) for d in range(ndays)]
+    tpoints = tunits.date2num(dates)
+    time = DimCoord(tpoints, standard_name='time', units=tunits,
+        bounds=np.stack([tpoints-12, tpoints+12], axis=1))
+
+    cs = cpm_coord_system()
+    x = DimCoord(CPM_X0 + CPM_DX*np.arange(nx), standard_name='grid_longitude', units='degrees',
+        coord_system=cs)
+    y = DimCoord(CPM_Y0 + CPM_DX*np.arange(ny), standard_name='grid_latitude', units='degrees',
+        coord_system=cs)
+    x.guess_bounds()
+    y.guess_bounds()
+
+    lons, lats = unrotate_pole(*np.meshgrid(x.points-360, y.points),
+        CPM_POLE_LON, CPM_POLE_LAT)
+
+    rng = np.random.default_rng(ensemble_member*10000 + year)
+    if var == 'pr':
+        data = rng.gamma(0.5, 4.0, size=(1, ndays, ny, nx)).astype(np.float32)
+        units = 'mm/day'
+    else:
+        seasonal = 10.0 - 8.0*np.cos(2*np.pi*(np.arange(ndays)+20)/360.0)
+        data = (seasonal[None,:,None,None] + rng.normal(0, 3, size=(1, ndays, ny, nx))).astype(np.float32)
+        units = 'degC'
+
+    cube = iris.cube.Cube(data, var_name=var, units=units,
+        dim_coords_and_dims=[(DimCoord([ensemble_member], long_name='ensemble_member', var_name='ensemble_member',
+            units='1'), 0), (time, 1), (y, 2), (x, 3)])
+    cube.add_aux_coord(AuxCoord(np.array([f'r001i1p{ensemble_member:05d}']), long_name='ensemble_member_id',
+        var_name='ensemble_member_id'), 0)
+    cube.add_aux_coord(AuxCoord([d.month for d in dates], long_name='month_number', units='1'), 1)
+    cube.add_aux_coord(AuxCoord([d.year for d in dates], long_name='year', units='1'), 1)
+    cube.add_aux_coord(AuxCoord(np.array([d.strftime('%Y%m%d') for d in dates]), long_name='yyyymmdd'), 1)
+    cube.add_aux_coord(AuxCoord(lats.astype(np.float32), standard_name='latitude', units='degrees'), (2, 3))
+    cube.add_aux_coord(AuxCoord(lons.astype(np.float32), standard_name='longitude', units='degrees'), (2, 3))
+
+    return cube
+
+
+def write_cpm_archive(data_root, var, year_range, ensemble_member, **options):
+    '''
+    Writes one file per year of synthetic raw UKCP Local data, using the same directory
+    structure and file names as the archive under /project/ukcp/land-cpm.
+    Returns the list of files written.
+
+    data_root -- Directory which stands in for /project/ukcp/land-cpm/uk/2.2km/rcp85
+    var -- The name of the variable
+    year_range -- The first and last years of the December of each file
+    ensemble_member -- The UKCP18 CPM ensemble member, an integer between 1 and 15
+    options -- Passed on to make_cpm_cube (nx, ny, ndays)
+    '''
+
+    ID = '{:02d}'.format(ensemble_member)
+    ddir = os.path.join(data_root, ID, var, 'day', 'v20210615')
+    os.makedirs(ddir, exist_ok=True)
+
+    filenames = []
+    for year in list(range(year_range[0], year_range[1]+1)):
+        fout = f'{var}_rcp85_land-cpm_uk_2.2km_{ID}_day_{year:04d}1201-{year+1:04d}1130.nc'
+        iris.save(make_cpm_cube(var, year, ensemble_member, **options), os.path.join(ddir, fout))
+        filenames.append(os.path.join(ddir, fout))
+
+    return filenames
+
+
+def make_obs_cube(var, year, month, nx=OBS_NX, ny=OBS_NY):
+    '''
+    Creates a cube which looks like one month of HadUK-Grid data on the 1 km OSGB grid.
+
+    var -- The name of the variable as used in the HadUK-Grid files, e.g., 'tasmax', 'rainfall'
+    year -- The year
+    month -- The month
+    nx, ny -- The size of the grid
+    '''
+
+    tunits = Unit('hours since 1800-01-01 00:00:00', calendar='gregorian')
+    d0 = cftime.DatetimeGregorian(year, month, 1, 12)
+    ndays = ((cftime.DatetimeGregorian(year + month//12, month % 12 + 1, 1) - d0).days) + 1
+    tpoints = tunits.date2num([d0 + datetime.timedelta(days=d) for d in range(ndays)])
+    time = DimCoord(tpoints, standard_name='time', units=tunits,
+        bounds=np.stack([tpoints-12, tpoints+12], axis=1))
+
+    cs = osgb_coord_system()
+    x = DimCoord(OBS_X0 + 1000.0*np.arange(nx), standard_name='projection_x_coordinate', units='m',
+        coord_system=cs)
+    y = DimCoord(OBS_Y0 + 1000.0*np.arange(ny), standard_name='projection_y_coordinate', units='m',
+        coord_system=cs)
+    x.guess_bounds()
+    y.guess_bounds()
+
+    rng = np.random.default_rng(year*100 + month)
+    if var == 'rainfall':
+        data = rng.gamma(0.5, 4.0, size=(ndays, ny, nx)).astype(np.float64)
+        units = 'mm'
+        standard_name = 'lwe_thickness_of_precipitation_amount'
+    else:
+        data = (10.0 + rng.normal(0, 3, size=(ndays, ny, nx))).astype(np.float64)
+        units = 'degC'
+        standard_name = 'air_temperature'
+
+# HadUK-Grid only has data over land. Mask out a strip in the west to represent the sea.
+    data = np.ma.masked_array(data, mask=np.zeros(data.shape, dtype=bool))
+    data[:, :, :nx//10] = np.ma.masked
+
+    cube = iris.cube.Cube(data, standard_name=standard_name, var_name=var, units=units,
+        dim_coords_and_dims=[(time, 0), (y, 1), (x, 2)])
+    cube.attributes['creation_date'] = '2018-11-26T00:00:00'
+
+    xx, yy = np.meshgrid(x.points, y.points)
+    lonlat = ccrs.PlateCarree().transform_points(cs.as_cartopy_crs(), xx, yy)
+    cube.add_aux_coord(AuxCoord(lonlat[..., 1], standard_name='latitude', units='degrees'), (1, 2))
+    cube.add_aux_coord(AuxCoord(lonlat[..., 0], standard_name='longitude', units='degrees'), (1, 2))
+
+    return cube
+
+
+def write_obs_archive(data_root, var, year_range, months=None, **options):
+    '''
+    Writes one file per month of synthetic HadUK-Grid data, using the same directory
+    structure and file names as the archive under /project/ukcp18/ncic_observations.
+    Returns the list of files written.
+
+    data_root -- Directory which stands in for .../HadOBS/HadUK-Grid/v1.0.0.0/1km
+    var -- The name of the variable as used in the HadUK-Grid files
+    year_range -- The first and last years of data to write
+    months -- The months to write in each year (default: all)
+    options -- Passed on to make_obs_cube (nx, ny)
+    '''
+
+    ddir = os.path.join(data_root, var, 'day', 'v20181126')
+    os.makedirs(ddir, exist_ok=True)
+
+    if months is None:
+        months = list(range(1, 13))
+
+    filenames = []
+    for year in list(range(year_range[0], year_range[1]+1)):
+        for month in months:
+            cube = make_obs_cube(var, year, month, **options)
+            dates = cube.coord('time').units.num2date(cube.coord('time').points[[0, -1]])
+            fend = '{:%Y%m%d}-{:%Y%m%d}.nc'.format(dates[0], dates[1])
+            fout = f'{var}_hadukgrid_uk_1km_day_{fend}'
+            iris.save(cube, os.path.join(ddir, fout))
+            filenames.append(os.path.join(ddir, fout))
+
+    return filenames
@@ -2,12 +2,13 @@ import os
 import glob
 import getpass
 import iris
+import iris.cube
+import timeseries_writer
 
 
-def load_and_join_obs(datadir_in, region_name, var_name, resolution):
+def find_obs_files(datadir_in, region_name, var_name, resolution):
     '''
-    The HadUK-Grid data are stored as 1 file per month, so the data for CReDo
-    also exist as 1 file per month. Join the files together for bias correction.
+    Returns the sorted list of the monthly files of regridded HadUK-Grid data for a region.
     '''
 
     # Make the filename template
@@ -19,15 +20,18 @@ def load_and_join_obs(datadir_in, region_name, var_name, resolution):
     filenames = glob.glob(os.path.join(datadir_in, fname_template))
     filenames.sort()
 
-    obs_cubes = iris.cube.CubeList()
-    for f in filenames:
-        obs_cube = iris.load_cube(f)
-        obs_cube.attributes = {}
-        obs_cubes.append(obs_cube)
+    return filenames
+
 
-    obs_cube = obs_cubes.concatenate_cube()
+def load_obs_file(filename, var_name):
+    '''
+    Loads one monthly file, removing the attributes (which differ between files)
+    and correcting the standard name and variable name for the precipitation observations.
+    '''
+
+    obs_cube = iris.load_cube(filename)
+    obs_cube.attributes = {}
 
-# Correct the standard name and variable name for the precipitation observations
     if 'precipitation_amount' in obs_cube.standard_name:
         obs_cube.standard_name = 'precipitation_amount'
         obs_cube.var_name = var_name
@@ -35,6 +39,35 @@ def load_and_join_obs(datadir_in, region_name, var_name, resolution):
     return obs_cube
 
 
+def load_and_join_obs(datadir_in, region_name, var_name, resolution):
+    '''
+    The HadUK-Grid data are stored as 1 file per month, so the data for CReDo
+    also exist as 1 file per month. Join the files together for bias correction.
+    '''
+
+    filenames = find_obs_files(datadir_in, region_name, var_name, resolution)
+
+    obs_cubes = iris.cube.CubeList()
+    for f in filenames:
+        obs_cubes.append(load_obs_file(f, var_name))
+
+    return obs_cubes.concatenate_cube()
+
+
+def write_joined_obs(datadir_in, region_name, var_name, resolution, fout):
+    '''
+    Joins the monthly files together as load_and_join_obs does, but writes each month to
+    file fout as it is read, so only one month is held in memory.
+    '''
+
+    filenames = find_obs_files(datadir_in, region_name, var_name, resolution)
+
+    writer = timeseries_writer.TimeSeriesWriter(fout)
+    for f in filenames:
+        writer.append(load_obs_file(f, var_name))
+    writer.close()
+
+
 def main():
 
     user_id = getpass.getuser()
@@ -46,18 +79,15 @@ def main():
     datadir_in = f'/scratch/{user_id}/{project_name}/HadUK_on_{resolution}/intermediate/{var_name}'
     datadir_out = f'/scratch/{user_id}/{project_name}/HadUK_on_{resolution}/{var_name}'
 
-    obs_cube = load_and_join_obs(datadir_in, region_name, var_name, resolution)
-    print(obs_cube)
-
     # Create directory for the merged data if it does not exist
     try:
         os.makedirs(datadir_out)
     except FileExistsError:
         pass
 
-    # Save the combined data
+    # Join the monthly files and save the combined data
     fout = f'{region_name}_{var_name}_obs_hadukgrid_uk_{resolution}_day_19801201-20001130.nc'
-    iris.save(obs_cube, os.path.join(datadir_out, fout))
+    write_joined_obs(datadir_in, region_name, var_name, resolution, os.path.join(datadir_out, fout))
 
 
 if __name__ == '__main__':
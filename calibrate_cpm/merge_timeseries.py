@@ -3,12 +3,18 @@ import sys
 import glob
 import getpass
 import iris
+import iris.cube
+import numpy as np
+import dask.array as da
+import timeseries_writer
+import bc_filenames
 
 
-def make_intermediate_filenames(datadir, var_name, year_start, year_end, monstart, monend):
+def make_intermediate_filenames(datadir, var_name, year_start, year_end, monstart, monend, engine='sdm'):
     '''
     Constructs the filenames containing the bias-corrected data, which are stored in
-    one file per month.
+    one file per month. The names start with the method of the engine which made them
+    ('sdm', 'pycat', 'isimip3' or 'window', see bc_filenames.py).
     '''
 
     if monstart > monend:
@@ -20,39 +26,106 @@ def make_intermediate_filenames(datadir, var_name, year_start, year_end, monstar
 
     filenames = []
     for m in months:
-        month = '{:02d}'.format(m)
         if monstart > monend and m == 12:
-            yfirst = year_start
-            ylast = '{:04d}'.format(int(year_end)-1)
+            yfirst = int(year_start)
+            ylast = int(year_end)-1
         else:
-            yfirst = '{:04d}'.format(int(year_start)+1)
-            ylast = year_end
+            yfirst = int(year_start)+1
+            ylast = int(year_end)
 
-        filename = f'scaled_distribution_mapping_{var_name}_scenario-0_{yfirst}-{ylast}_month-{month}.nc'
-        filenames.append(os.path.join(datadir, filename))
+        filenames.append(os.path.join(datadir, bc_filenames.month_filename(var_name, yfirst, ylast, m, engine)))
 
     return filenames
 
 
-def merge_bias_corrected_files(user_id, project_name, area_name, var_name, ID,
-    year_start, year_end, monstart=12, monend=11):
+def iter_interleaved_blocks(cubes, block_length=360):
+    '''
+    Combines cubes each holding one calendar month from a range of years, e.g. the
+    12 monthly files from the bias correction, into a single time series, which is
+    returned as a sequence of cubes of block_length consecutive times.
 
-    dir_in = f'/scratch/{user_id}/{project_name}/cpm_calibrated/intermediate/{ID}'
+    The time coordinates are read and sorted once. For each block, the part of each
+    input cube falling in it is read and copied to its place in the block, so only
+    one block is held in memory at a time.
+    '''
+
+    cube0 = cubes[0]
+    tunits = cube0.coord('time').units
+    for c in cubes[1:]:
+        if c.coord('time').units != tunits:
+            c.coord('time').convert_units(tunits)
+
+# Order of the input times in the merged time series, as (input cube, index in that cube)
+    times = np.concatenate([c.coord('time').points for c in cubes])
+    order = np.argsort(times, kind='stable')
+    if np.any(np.diff(times[order]) == 0):
+        raise ValueError('Repeated times in the cubes to be merged')
+    cube_number = np.repeat(np.arange(len(cubes)), [c.shape[0] for c in cubes])
+    cube_index = np.concatenate([np.arange(c.shape[0]) for c in cubes])
+
+# Points and bounds of the coordinates along the time dimension, in input order
+    time_coords = {}
+    for coord in cube0.coords(contains_dimension=0):
+        points = np.concatenate([c.coord(coord.name()).points for c in cubes])
+        bounds = None
+        if coord.has_bounds():
+            bounds = np.concatenate([c.coord(coord.name()).bounds for c in cubes])
+        time_coords[coord.name()] = (points, bounds)
+
+    dim_coords = cube0.coords(dim_coords=True)
+    for b0 in range(0, len(order), block_length):
+        block = order[b0:b0+block_length]
+        shape = (len(block),) + cube0.shape[1:]
+        data = np.ma.masked_array(np.empty(shape, dtype=cube0.dtype), mask=np.zeros(shape, dtype=bool))
+
+# The times from each cube are consecutive in that cube, so are read as a slice.
+# The slices from all the cubes are read together.
+        positions = []
+        slices = []
+        for n, c in enumerate(cubes):
+            k = np.nonzero(cube_number[block] == n)[0]
+            if len(k) == 0:
+                continue
+            i = cube_index[block[k]]
+            positions.append((k, i - i[0]))
+            slices.append(c.core_data()[i[0]:i[-1]+1])
+        for (k, i), cdata in zip(positions, da.compute(*slices)):
+            data.data[k] = np.ma.getdata(cdata)[i]
+            data.mask[k] = np.ma.getmaskarray(cdata)[i]
+
+        cube = iris.cube.Cube(data)
+        cube.metadata = cube0.metadata
+
+# Copy the coordinates, putting those along the time dimension in time order
+        for coord in cube0.coords():
+            dims = cube0.coord_dims(coord)
+            is_dim = any(coord is c for c in dim_coords)
+            if coord.name() in time_coords:
+                points, bounds = time_coords[coord.name()]
+                coord = coord.copy(points=points[block], bounds=None if bounds is None else bounds[block])
+            else:
+                coord = coord.copy()
+            if is_dim:
+                cube.add_dim_coord(coord, dims)
+            else:
+                cube.add_aux_coord(coord, dims)
+
+        yield cube
 
-    filenames = make_intermediate_filenames(dir_in, var_name, year_start, year_end, monstart, monend)
 
-    clist = iris.load(filenames)
-    cout = iris.cube.CubeList()
+def merge_bias_corrected_files(user_id, project_name, area_name, var_name, ID,
+    year_start, year_end, monstart=12, monend=11, engine='sdm'):
+    '''
+    Merges the monthly files of the bias-corrected data made by an engine ('sdm', 'pycat',
+    'isimip3' or 'window') into one time series. Files made by methods other than SDM by month are
+    merged into files named with the engine, e.g. ..._rcp85_calib-isimip3_uk_...
+    '''
 
-    yfirst = int(year_start)
-    ylast = int(year_end)
+    dir_in = f'/scratch/{user_id}/{project_name}/cpm_calibrated/intermediate/{ID}'
 
-    for y in list(range(yfirst, ylast+1)):
-        ycon = iris.Constraint(time = lambda t: t.point.year == y)
-        cube_1y = clist.extract(ycon)
-        cout.append(cube_1y.concatenate_cube())
+    filenames = make_intermediate_filenames(dir_in, var_name, year_start, year_end, monstart, monend, engine)
 
-    cube = cout.concatenate_cube()
+    cubes = [iris.load_cube(f) for f in filenames]
 
     # Output directory
     dout = f'/scratch/{user_id}/{project_name}/cpm_calibrated/merged/{ID}/{var_name}/'
@@ -63,8 +136,14 @@ def merge_bias_corrected_files(user_id, project_name, area_name, var_name, ID,
 # directory already exists
         pass
 
-    fout = f'{area_name}_{var_name}_rcp85_calib_uk_2.2km_{ID}_{year_start}{monstart:02d}01-{year_end}{monend:02d}30.nc'
-    iris.save(cube, os.path.join(dout, fout))
+    calib = 'calib' if engine in ['sdm', 'pycat'] else f'calib-{engine}'
+    fout = f'{area_name}_{var_name}_rcp85_{calib}_uk_2.2km_{ID}_{year_start}{monstart:02d}01-{year_end}{monend:02d}30.nc'
+
+# Write the merged time series one year at a time
+    writer = timeseries_writer.TimeSeriesWriter(os.path.join(dout, fout))
+    for cube in iter_interleaved_blocks(cubes, block_length=360):
+        writer.append(cube)
+    writer.close()
 
 
 def main():
@@ -76,10 +155,12 @@ def main():
     ID = sys.argv[4]
     year_start = sys.argv[5]
     year_end = sys.argv[6]
+    engine = sys.argv[7] if len(sys.argv) > 7 else 'sdm'
 
-    print(user_id, var_name, ID, year_start, year_end)
+    print(user_id, var_name, ID, year_start, year_end, engine)
 
-    merge_bias_corrected_files(user_id, project_name, area_name, var_name, ID, year_start, year_end)
+    merge_bias_corrected_files(user_id, project_name, area_name, var_name, ID, year_start, year_end,
+        engine=engine)
 
 
 if __name__ == '__main__':
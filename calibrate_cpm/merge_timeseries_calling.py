@@ -2,7 +2,11 @@ import sys
 import subprocess
 
 
-def run_all(project_name, region_name, var_name, years_start, years_end, memberIDs):
+def run_all(project_name, region_name, var_name, years_start, years_end, memberIDs, engine='sdm'):
+    '''
+    Submits a job merging the monthly bias-corrected files of each member and period.
+    engine is the method which made the files, 'sdm', 'pycat', 'isimip3' or 'window', as in BC_timeslice_calling.py.
+    '''
 
     for member in memberIDs:
         ID = '{:02d}'.format(member)    #   memberID
@@ -11,7 +15,7 @@ def run_all(project_name, region_name, var_name, years_start, years_end, memberI
             year_max = '{:4d}'.format(years_end[y])
 
             cmd = ' '.join(['sbatch', 'merge_timeseries_batch.sh', project_name, region_name, \
-                var_name, ID, year_min, year_max])
+                var_name, ID, year_min, year_max, engine])
             print(cmd)
 
             try:
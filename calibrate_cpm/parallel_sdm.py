@@ -0,0 +1,228 @@
+'''
+Scaled Distribution Mapping of all the calendar months of a scenario, in parallel.
+
+SDM corrects each calendar month separately, and each grid cell independently, so the
+work is split into units of one month and one tile of grid cells, which are shared
+among a pool of worker processes. The obs, model and scenario data and the corrected
+data are held in shared memory, so only the (month, tile) of each unit is sent to the
+workers, rather than pickled cubes.
+
+With one worker the same units are corrected in turn in this process, so the results
+are identical whatever the number of workers.
+
+The observations may instead be given as a file decoded by shared_obs.py, which every
+worker maps into memory, so one copy is shared by all the processes and ensemble members.
+
+If the fits of the baseline have already been made (see baseline_cache.py), they are
+shared instead of the obs and model data, and only the scenario is fitted.
+
+The trend-preserving quantile mapping in isimip3_qm.py may be used instead of SDM, with
+engine='isimip3', and is shared among the workers in the same way.
+'''
+
+import os
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+import sdm
+import isimip3_qm
+import shared_obs
+import time_index
+
+# The shared arrays and settings, as seen by the process correcting a unit
+_shared = {}
+
+# The modules of the bias-correction methods, each with a select_method function
+ENGINES = {'sdm': sdm, 'isimip3': isimip3_qm}
+
+
+def available_cpus():
+    '''
+    Returns the number of CPUs this process may use, which under Slurm is the allocation of the job.
+    '''
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
+
+def month_numbers(cube):
+    '''
+    Returns the calendar month of each time of a cube.
+    '''
+
+    return time_index.TimeIndex(cube).month_number
+
+
+def baseline_obs(obs_cube, obs_memmap=None):
+    '''
+    Returns the observations as an array of shape (time, cell), and the indices of the cells
+    with valid observations. If obs_memmap, a file written by shared_obs.decode_obs, is given,
+    the data are mapped from it rather than read from obs_cube, and NaN marks invalid cells.
+    '''
+
+    if obs_memmap is None:
+        obs_data = obs_cube.data.reshape(obs_cube.shape[0], -1)
+        cells = np.nonzero(~np.ma.getmaskarray(obs_data)[0])[0]
+        obs_data = np.ma.getdata(obs_data)
+    else:
+        obs_data = shared_obs.open_obs(obs_memmap)
+        obs_data = obs_data.reshape(obs_data.shape[0], -1)
+        cells = np.nonzero(np.isfinite(obs_data[0]))[0]
+
+    return obs_data, cells
+
+
+def _attach(specs, settings):
+    '''
+    Makes the arrays in shared memory, and any memory-mapped observations, available to the
+    functions in this module. Run at the start of each worker process.
+    '''
+
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _shared[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    for name, filename in settings['mapped'].items():
+        _shared[name] = (None, baseline_obs(None, filename)[0])
+    _shared['settings'] = settings
+
+
+def _correct_unit(unit):
+    '''
+    Bias-corrects one calendar month of one tile of grid cells, writing the result to
+    the shared array of corrected data.
+    '''
+
+    month_number, b0, b1 = unit
+    settings = _shared['settings']
+    cells = settings['cells'][b0:b1]
+    sce_rows = np.nonzero(settings['months']['sce'] == month_number)[0]
+    sce = _shared['sce'][1][np.ix_(sce_rows, cells)]
+
+    if settings['fields'] is None:
+        obs_rows = np.nonzero(settings['months']['obs'] == month_number)[0]
+        mod_rows = np.nonzero(settings['months']['mod'] == month_number)[0]
+        method = ENGINES[settings['engine']].select_method(settings['standard_name'])
+        result = method(_shared['obs'][1][np.ix_(obs_rows, cells)].astype(np.float64),
+            _shared['mod'][1][np.ix_(mod_rows, cells)], sce, **settings['kwargs'])
+    else:
+# The fits of the baseline hold the valid cells in order, so the tile is b0:b1 along their last dimension
+        _, method = sdm.select_fitted_method(settings['standard_name'])
+        fits = {}
+        for source in ['obs', 'mod']:
+            fits[source] = {}
+            for field in settings['fields']:
+                values = _shared[f'{source}_{month_number:02d}_{field}'][1]
+                fits[source][field] = values if values.ndim == 0 else values[..., b0:b1]
+        result = method(fits['obs'], fits['mod'], sce, **settings['kwargs'])
+    _shared['out'][1][np.ix_(sce_rows, cells)] = result
+
+    return unit
+
+
+def correct_months(obs_cube, mod_cube, sce_cube, nworkers=None, block_size=5000, baseline=None, obs_memmap=None,
+    engine='sdm', **kwargs):
+    '''
+    Returns a copy of sce_cube with each calendar month bias-corrected by scaled distribution
+    mapping, using the same month of obs_cube and mod_cube. Cells where the observations are
+    masked are left unchanged.
+
+    obs_cube -- Observations for the baseline period, with time as the first dimension
+    mod_cube -- Model data for the baseline period, on the same grid
+    sce_cube -- Model data to be corrected, on the same grid
+    nworkers -- The number of worker processes (default: the number of CPUs available)
+    block_size -- The number of grid cells in each tile
+    baseline -- The fits of the obs and model baselines from baseline_cache.fit_baseline, used
+        instead of obs_cube and mod_cube, which may then be None
+    obs_memmap -- A file of observations written by shared_obs.decode_obs, which is mapped into
+        memory by every worker instead of copying the data of obs_cube
+    engine -- 'sdm' for scaled distribution mapping (sdm.py), or 'isimip3' for trend-preserving
+        quantile mapping (isimip3_qm.py), which cannot use baseline
+    kwargs -- Passed to the method of the engine (e.g. sdm.absolute_sdm or sdm.relative_sdm),
+        e.g. cdf_threshold, lower_limit
+    '''
+
+    if nworkers is None:
+        nworkers = available_cpus()
+    if baseline is not None and engine != 'sdm':
+        raise ValueError(f'Fitted baselines cannot be used with the {engine} engine')
+
+    arrays = {'sce': np.ma.getdata(sce_cube.data).reshape(sce_cube.shape[0], -1).astype(np.float64)}
+    arrays['out'] = arrays['sce'].copy()
+    mapped = {}
+
+    if baseline is None:
+        obs_data, cells = baseline_obs(obs_cube, obs_memmap)
+        if obs_memmap is None:
+            arrays['obs'] = obs_data.astype(np.float64)
+        else:
+            mapped['obs'] = obs_memmap
+        arrays['mod'] = np.ma.getdata(mod_cube.data).reshape(mod_cube.shape[0], -1).astype(np.float64)
+        months = {'obs': month_numbers(obs_cube), 'mod': month_numbers(mod_cube)}
+        standard_name = obs_cube.standard_name
+        fields = None
+    else:
+        cells = baseline['cells']
+        for month_number, fits in baseline['months'].items():
+            for source, fitted in fits.items():
+                for field, values in fitted.items():
+                    arrays[f'{source}_{month_number:02d}_{field}'] = values
+        months = {}
+        standard_name = baseline['standard_name']
+        fields = list(fitted)
+    months['sce'] = month_numbers(sce_cube)
+
+    settings = {
+        'cells': cells,
+        'months': months,
+        'standard_name': standard_name,
+        'fields': fields,
+        'mapped': mapped,
+        'engine': engine,
+        'kwargs': kwargs,
+    }
+
+# Every tile of every month present in the scenario
+    units = []
+    for month_number in np.unique(settings['months']['sce']):
+        for b0 in range(0, len(cells), block_size):
+            units.append((int(month_number), b0, b0+block_size))
+
+    if nworkers > 1:
+        shms = {}
+        specs = {}
+        try:
+            for name, array in arrays.items():
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+                shms[name] = shm
+                specs[name] = (shm.name, array.shape, array.dtype)
+
+            with multiprocessing.Pool(nworkers, initializer=_attach, initargs=(specs, settings)) as pool:
+                for unit in pool.imap_unordered(_correct_unit, units):
+                    pass
+
+            out = np.ndarray(arrays['out'].shape, dtype=np.float64, buffer=shms['out'].buf).copy()
+        finally:
+            for shm in shms.values():
+                shm.close()
+                shm.unlink()
+    else:
+        for name, array in arrays.items():
+            _shared[name] = (None, array)
+        if mapped:
+            _shared['obs'] = (None, obs_data)
+        _shared['settings'] = settings
+        for unit in units:
+            _correct_unit(unit)
+        out = arrays['out']
+        _shared.clear()
+
+# Put the corrected cells into a copy of the scenario cube
+    corrected = sce_cube.copy()
+    data = np.ma.asarray(corrected.data).reshape(sce_cube.shape[0], -1)
+    data[:, cells] = out[:, cells]
+    corrected.data = data.reshape(sce_cube.shape)
+
+    return corrected
@@ -4,7 +4,6 @@ and historical RCM simulations
 '''
 
 import iris
-import iris.coord_categorisation
 import iris.palette
 import iris.plot as iplt
 from iris.util import unify_time_units
@@ -17,6 +16,7 @@ import sys
 import glob
 from cf_units import Unit
 from ukcp_common_analysis.regions import reg_from_cube
+import time_index
 
 
 def colombia_callback(cube, field, filename):
@@ -115,10 +115,7 @@ def make_monthly_climatology(cube):
 
 # First, make a series of monthly means or monthly totals
     # DJB added in conditional creation of month_number and year
-    if len(cube.coords(var_name = 'month_number')) == 0:
-        iris.coord_categorisation.add_month_number(cube, 'time', name='month_number')
-    if len(cube.coords(var_name = 'year')) == 0:
-        iris.coord_categorisation.add_year(cube, 'time', name='year')
+    time_index.TimeIndex(cube).add_coords(cube)
 
     monthly_series = cube.aggregated_by(['month_number', 'year'], iris.analysis.MEAN)
 
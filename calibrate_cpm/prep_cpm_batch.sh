@@ -8,5 +8,5 @@
 #SBATCH --export=NONE
 
 module load scitools
-python prep_cpm_data.py $1 $2 $3 $4 $5 $6
+python prep_cpm_data.py $1 $2 $3 $4 $5 $6 $7
 
@@ -3,9 +3,12 @@ import subprocess
 import sys
 
 
-def run_all(project_name, region_name):
+def run_all(project_name, region_name, compress=False):
     """
     Launches batch jobs to preprocess UKCP18 cpm data  
+
+    compress -- If True, only the cells overlapping the polygon of the region are kept, in the compact
+        (time, cell) layout of region_mask.py, which pyCAT cannot read
     """
 # UKCP Local member IDs
     memberID = ['01', '04', '05', '06', '07', '08', '09', '10', '11', '12', '13', '15']
@@ -20,7 +23,8 @@ def run_all(project_name, region_name):
             for year_range in year_ranges:
                 ystr = '{:4d} {:4d}'.format(year_range[0], year_range[1])
                 print(ID, var_name, ystr)
-                cmd = ' '.join(['sbatch', 'prep_cpm_batch.sh', project_name, region_name, var_name, ID, ystr])
+                cmd = ' '.join(['sbatch', 'prep_cpm_batch.sh', project_name, region_name, var_name, ID, ystr]
+                    + (['compress'] if compress else []))
                 try:
                     retcode = subprocess.call(cmd, shell=True)
                     if retcode < 0:
@@ -32,7 +36,41 @@ def run_all(project_name, region_name):
 
     return
 
+
+def run_all_single_pass(project_name, region_names, varlist, compress=False):
+    """
+    Launches one batch job per member and period, which extracts all the regions
+    and variables while reading each raw UKCP18 cpm file only once
+
+    compress -- As for run_all
+    """
+# UKCP Local member IDs
+    memberID = ['01', '04', '05', '06', '07', '08', '09', '10', '11', '12', '13', '15']
+    year_ranges = [[1980, 2000], [2020, 2040], [2060, 2080]]
+
+    regions = ','.join(region_names)
+    variables = ','.join(varlist)
+
+    for ID in memberID:
+        for year_range in year_ranges:
+            ystr = '{:4d} {:4d}'.format(year_range[0], year_range[1])
+            print(ID, variables, ystr)
+            cmd = ' '.join(['sbatch', 'prep_cpm_batch.sh', project_name, regions, variables, ID, ystr]
+                + (['compress'] if compress else []))
+            try:
+                retcode = subprocess.call(cmd, shell=True)
+                if retcode < 0:
+                    print("Child was terminated by signal", -retcode, file=sys.stderr)
+                else:
+                    print("Child returned", retcode, file=sys.stderr)
+            except OSError as e:
+                print("Execution failed:", e, file=sys.stderr)
+
+    return
+
+
 if __name__ == '__main__':
     project_name = 'CReDo'  #  'CLIMAR'
     region_name = 'East_Anglia'
     run_all(project_name, region_name)
+#   run_all_single_pass(project_name, ['East_Anglia', 'Norwich', 'Cambridge'], ['tasmax', 'tasmin', 'pr'])
@@ -3,7 +3,11 @@ import sys
 import glob
 import getpass
 import iris
+import numpy as np
 import load_data
+import grid_descriptor
+import region_mask
+import timeseries_writer
 
 
 def make_output_filename(region_name, var, year_range, ID, monstart, monend):
@@ -24,8 +28,63 @@ def make_output_filename(region_name, var, year_range, ID, monstart, monend):
     return '_'.join([fhead, fend])
 
 
+def get_region_index(grid_filename, ensemble_member, lon_limits, lat_limits):
+    '''
+    Returns the index of the area of interest on the CPM grid, i.e. the position of the
+    ensemble member, all times, and the ranges of rows and columns inside the limits.
+    Only the coordinates are read from the file.
+
+    grid_filename -- A raw UKCP Local file on the grid to be indexed
+    ensemble_member -- The UKCP18 CPM ensemble member, an integer between 1 and 15
+    lon_limits -- The limits of the area in rotated longitude, as returned by read_boundary_edges
+    lat_limits -- The limits of the area in rotated latitude
+    '''
+
+    cube = iris.load_cube(grid_filename)
+
+    lons = cube.coord('grid_longitude').points
+    lats = cube.coord('grid_latitude').points
+
+# Add 360 to the longitude limits, to match the CPM coordinates
+    ix = np.where((lons >= lon_limits[0]+360) & (lons <= lon_limits[1]+360))[0]
+    iy = np.where((lats >= lat_limits[0]) & (lats <= lat_limits[1]))[0]
+
+    im = list(cube.coord('ensemble_member').points).index(ensemble_member)
+
+    return (im, slice(None), slice(iy[0], iy[-1]+1), slice(ix[0], ix[-1]+1))
+
+
+def group_regions(boxes, max_ratio=2.):
+    '''
+    Returns a list of groups of regions, each a list of region names, to be read in one enclosing
+    box of the grid. Starting from one group per region, the two groups whose enclosing box is
+    smallest relative to the areas of their regions are joined, as long as that box is at most
+    max_ratio times the total area of their regions, so distant regions are read in separate boxes
+    rather than in one box mostly covering cells of no region.
+
+    boxes -- Dictionary of region name to the (y, x) slices of the region on the grid
+    '''
+
+    def area(ys, xs):
+        return (ys.stop - ys.start) * (xs.stop - xs.start)
+
+    def enclosing(names):
+        return (slice(min(boxes[n][0].start for n in names), max(boxes[n][0].stop for n in names)),
+            slice(min(boxes[n][1].start for n in names), max(boxes[n][1].stop for n in names)))
+
+    groups = [[name] for name in boxes]
+    while len(groups) > 1:
+        ratio, i, j = min((area(*enclosing(a + b)) / sum(area(*boxes[n]) for n in a + b), i, j)
+            for i, a in enumerate(groups) for j, b in enumerate(groups) if i < j)
+        if ratio > max_ratio:
+            break
+        groups[i] = groups[i] + groups.pop(j)
+
+    return groups
+
+
 def prep_cpm(user_id, project_name, region_name, var, year_range,
-    ID, monstart, monend, lon_limits, lat_limits):
+    ID, monstart, monend, lon_limits, lat_limits, compress=False):
     '''
     Extracts UKCP Local data within the area of interest.
 
@@ -37,6 +96,9 @@ def prep_cpm(user_id, project_name, region_name, var, year_range,
     ID -- a 2-character string containing the ensemble member (01 to 15)
     monstart -- The first month to process
     monend -- The last month to process
+    compress -- If True, and the grid descriptor of the region holds a mask of the cells overlapping
+        its polygon, only those cells are saved, in the compact (time, cell) layout of region_mask.py.
+        Otherwise the data are saved on the (time, y, x) grid, as pyCAT (engine='pycat') needs.
 
     N.B. For UKCP18 data, monstart=12, monend=11, as the simulations run from
         December to November
@@ -53,22 +115,23 @@ def prep_cpm(user_id, project_name, region_name, var, year_range,
 
     ensemble_member = int(ID)
 
-# Add 360 to the longitude limits, to match the CPM coordinates
-    lon_edges = [l+360 for l in lon_limits]
-    lon_con = iris.Constraint(grid_longitude = lambda l: lon_edges[0] <= l.point <= lon_edges[1])
-    lat_con = iris.Constraint(grid_latitude = lambda l: lat_limits[0] <= l.point <= lat_limits[1])
-    area_con = lat_con & lon_con
+# Convert the limits of the region into an index on the CPM grid, using the first file.
+# Only those rows and columns of the ensemble member are then read from each file.
+    filenames = load_data.raw_UKCP18_cpm_filenames(var, year_range, ensemble_member, monstart=12, monend=11)
+    region_index = get_region_index(filenames[0], ensemble_member, lon_limits, lat_limits)
 
 # Read the UKCP18 2.2 km data, returned as a single cube. Data are extracted for the region defined above.
-    cube = load_data.load_raw_UKCP18_cpm_data(var, year_range, ensemble_member, monstart=12, monend=11, con=area_con)
-
-# Remove the fourth dimension 'ensemble_member' from the cube
-    cube = cube.extract(iris.Constraint(ensemble_member = ensemble_member))
+    cube = load_data.load_raw_UKCP18_cpm_data(var, year_range, ensemble_member, monstart=12, monend=11,
+        region_index=region_index)
 
 # Modify the labels to remove the degree symbol (prevents the cubes from being printed within Python).
 #   cube.attributes['label_units'] = 'degC'
 #   cube.attributes['plot_label'] = 'Maximum air temperature at 1.5m (degC)'
 
+    mask = grid_descriptor.load_region_mask(project_name, region_name) if compress else None
+    if mask is not None:
+        cube = region_mask.compress(cube, mask)
+
 # Save the cube
     fout = make_output_filename(region_name, var, year_range, ID, monstart, monend)
     iris.save(cube, os.path.join(dout, fout))
@@ -76,6 +139,88 @@ def prep_cpm(user_id, project_name, region_name, var, year_range,
     return
 
 
+def prep_cpm_regions(user_id, project_name, region_names, varlist, year_range,
+    ID, monstart, monend, block_length=360, compress=False, max_ratio=2.):
+    '''
+    Extracts UKCP Local data for several areas of interest and several variables,
+    reading each raw UKCP Local file only once for each group of nearby areas (see
+    group_regions). The part of each file covering the areas of a group is read, and the
+    subset for each area is taken from that in memory and appended to its output file, so
+    only one file's worth of the box is held at a time.
+
+    user_id -- The user's ID
+    project_name -- Name of the project, e.g., 'CLIMAR', 'CReDo'
+    region_names -- List of regions, each with a <region>_rotgrid_limits.dat file
+    varlist -- List of the variables to process
+    year_range -- A 2-element list containing the first and last years to process
+    ID -- a 2-character string containing the ensemble member (01 to 15)
+    monstart -- The first month to process
+    monend -- The last month to process
+    block_length -- The number of times read at once, by default one year (the length of a raw file)
+    compress -- If True, regions with a mask are saved in the compact (time, cell) layout, as for prep_cpm
+    max_ratio -- Regions are read in one box while it is at most max_ratio times their total area
+    '''
+
+    ensemble_member = int(ID)
+
+    limits = {}
+    for region_name in region_names:
+        limits[region_name] = read_boundary_edges(project_name, region_name)
+
+    for var in varlist:
+        dout = os.path.join('/net/spice/scratch/', user_id, project_name, 'cpm_prep', ID, var)
+        try:
+            os.makedirs(dout)
+        except FileExistsError:
+            pass
+
+# Find the index of each region on the CPM grid, and the groups of regions read together
+        filenames = load_data.raw_UKCP18_cpm_filenames(var, year_range, ensemble_member, monstart=12, monend=11)
+        region_index = {}
+        for region_name in region_names:
+            lon_limits, lat_limits = limits[region_name]
+            region_index[region_name] = get_region_index(filenames[0], ensemble_member, lon_limits, lat_limits)
+        groups = group_regions({name: ri[2:] for name, ri in region_index.items()}, max_ratio)
+
+        for group in groups:
+            im = region_index[group[0]][0]
+            y0 = min([region_index[name][2].start for name in group])
+            y1 = max([region_index[name][2].stop for name in group])
+            x0 = min([region_index[name][3].start for name in group])
+            x1 = max([region_index[name][3].stop for name in group])
+            print(f'Reading {y1-y0}x{x1-x0} cells for {", ".join(group)}')
+
+# The enclosing box is read from one file (block_length times) at a time, and the subset of
+# each region is written from it before the next is read
+            cube = load_data.load_raw_UKCP18_cpm_data(var, year_range, ensemble_member, monstart=12, monend=11,
+                region_index=(im, slice(None), slice(y0, y1), slice(x0, x1)))
+
+            masks = {}
+            writers = {}
+            for region_name in group:
+                masks[region_name] = grid_descriptor.load_region_mask(project_name, region_name) if compress else None
+                fout = make_output_filename(region_name, var, year_range, ID, monstart, monend)
+                writers[region_name] = timeseries_writer.TimeSeriesWriter(os.path.join(dout, fout))
+
+            for t0 in range(0, cube.shape[0], block_length):
+# Realise the data of the block once, so the subsets of the regions below are taken from memory
+# rather than each reading its part of the file again
+                block = cube[t0:t0+block_length]
+                block = block.copy(data=block.data)
+
+                for region_name in group:
+                    ys, xs = region_index[region_name][2:]
+                    region_cube = block[:, ys.start-y0:ys.stop-y0, xs.start-x0:xs.stop-x0]
+                    if masks[region_name] is not None:
+                        region_cube = region_mask.compress(region_cube, masks[region_name])
+                    writers[region_name].append(region_cube)
+
+            for writer in writers.values():
+                writer.close()
+
+    return
+
+
 def read_boundary_edges(project_name, region_name):
 
     datadir = f'/home/h03/hadmi/Python/{project_name}/data_files/'
@@ -104,11 +249,18 @@ if __name__ == '__main__':
     y1 = int(sys.argv[6])
     monstart = 12
     monend = 11
-    print(project_name, region_name, var, ID, y0, y1)
+# Only the cells overlapping the polygon of each region are kept if 'compress' is given
+    compress = len(sys.argv) > 7 and sys.argv[7] == 'compress'
+    print(project_name, region_name, var, ID, y0, y1, compress)
 
+# Several regions and / or variables may be given as comma-separated lists,
+# in which case each raw file is read once for all of them.
+    if ',' in region_name or ',' in var:
+        prep_cpm_regions(user_id, project_name, region_name.split(','), var.split(','), [y0, y1], ID,
+            monstart, monend, compress=compress)
+    else:
 # Read in the boundary edges of the area of interest
-    lon_limits, lat_limits = read_boundary_edges(project_name, region_name)
-
-    prep_cpm(user_id, project_name, region_name, var, [y0, y1], ID,
-        monstart, monend, lon_limits, lat_limits)
+        lon_limits, lat_limits = read_boundary_edges(project_name, region_name)
 
+        prep_cpm(user_id, project_name, region_name, var, [y0, y1], ID,
+            monstart, monend, lon_limits, lat_limits, compress=compress)
@@ -0,0 +1,131 @@
+'''
+A mask of the cells of the UKCP Local grid of a region which overlap its polygon, and a
+compact layout of the data holding only those cells.
+
+The rectangle of the grid around a region (from read_boundary_edges) includes cells outside
+the polygon, e.g. in the Wash and the North Sea. The mask is made once, of the cells which
+overlap the polygon at all (those with non-zero weights in region_weights.py, so area means
+of compact data use every cell that the means of gridded data use), and is stored with the grid
+descriptor of the region (see grid_descriptor.py).
+
+Cubes of shape (time, y, x) on the grid of the region are compressed to shape (time, cell),
+holding only the cells in the mask. The cell dimension has a coordinate 'cell', the index of
+each cell in the (y, x) grid of the region in C order, and the grid longitudes and latitudes
+(and true longitudes and latitudes) of the cells as auxiliary coordinates, so the data can be
+expanded back to the grid. The bias correction and the merging of the monthly files work on
+the compressed data unchanged, as each cell is corrected independently.
+'''
+
+import numpy as np
+import iris
+import iris.cube
+from iris.coords import DimCoord, AuxCoord
+import region_weights
+
+
+def compute_mask(polygon, grid_cube):
+    '''
+    Returns a boolean array of shape (y, x), which is True for the cells of the grid of grid_cube
+    which overlap the polygon, given in longitude and latitude, including those whose centres are
+    outside it.
+    '''
+
+    return region_weights.compute_coverage(polygon, grid_cube) > 0
+
+
+def is_compressed(cube):
+    '''
+    Returns True if the cube is in the compact (time, cell) layout.
+    '''
+
+    return len(cube.coords('cell', dim_coords=True)) > 0
+
+
+def compress(cube, mask):
+    '''
+    Returns a (time, cell) copy of the (time, y, x) cube, holding only the cells in the mask, an
+    array of shape (y, x). The data are not read if they are lazy.
+    '''
+
+    ny, nx = mask.shape
+    if cube.shape[1:] != mask.shape:
+        raise ValueError(f'The region mask is {ny}x{nx}, but the grid of the cube is {cube.shape[1:]}')
+
+    cells = np.flatnonzero(mask)
+    rows, cols = np.unravel_index(cells, mask.shape)
+    data = cube.core_data().reshape(cube.shape[0], ny*nx)[:, cells]
+
+    compressed = iris.cube.Cube(data)
+    compressed.metadata = cube.metadata
+    compressed.add_dim_coord(DimCoord(cells, long_name='cell', var_name='cell', units='1'), 1)
+
+    dim_coords = cube.coords(dim_coords=True)
+    for coord in cube.coords():
+        dims = cube.coord_dims(coord)
+        if dims == (0,) and any(coord is c for c in dim_coords):
+            compressed.add_dim_coord(coord.copy(), 0)
+        elif 1 in dims or 2 in dims:
+            points = coord.points
+            bounds = coord.bounds
+# Index the coordinate by cell along whichever of the y and x dimensions it spans
+            if dims == (1, 2):
+                index = (rows, cols)
+            else:
+                index = rows if dims == (1,) else cols
+            compressed.add_aux_coord(AuxCoord.from_coord(coord).copy(points=points[index],
+                bounds=None if bounds is None else bounds[index]), 1)
+        else:
+            compressed.add_aux_coord(coord.copy(), dims)
+
+    return compressed
+
+
+def expand(cube, grid_cube):
+    '''
+    Returns a (time, y, x) copy of the (time, cell) cube on the grid of grid_cube (e.g. from
+    grid_descriptor.load_region_grid), with the cells outside the mask masked.
+    '''
+
+    ny, nx = grid_cube.shape
+    cells = cube.coord('cell').points
+
+    data = np.ma.masked_all((cube.shape[0], ny*nx), dtype=cube.dtype)
+    data[:, cells] = cube.data
+    expanded = iris.cube.Cube(data.reshape(cube.shape[0], ny, nx))
+    expanded.metadata = cube.metadata
+
+    dim_coords = cube.coords(dim_coords=True) + grid_cube.coords(dim_coords=True)
+    for coord in cube.coords():
+        dims = cube.coord_dims(coord)
+        if dims == (0,):
+            if any(coord is c for c in dim_coords):
+                expanded.add_dim_coord(coord.copy(), 0)
+            else:
+                expanded.add_aux_coord(coord.copy(), 0)
+        elif dims == ():
+            expanded.add_aux_coord(coord.copy())
+# Only the coordinates of the grid, not any scalar coordinates of grid_cube
+    for coord in [c for c in grid_cube.coords() if grid_cube.coord_dims(c)]:
+        if any(coord is c for c in dim_coords):
+            expanded.add_dim_coord(coord.copy(), grid_cube.coord_dims(coord)[0] + 1)
+        else:
+            expanded.add_aux_coord(coord.copy(), tuple(d + 1 for d in grid_cube.coord_dims(coord)))
+
+    return expanded
+
+
+def expand_field(field, grid_cube):
+    '''
+    Returns a (y, x) copy of a (cell,) cube, e.g. a statistic over time of a (time, cell) cube,
+    on the grid of grid_cube (e.g. from grid_descriptor.load_region_grid), with the cells outside
+    the mask masked.
+    '''
+
+    ny, nx = grid_cube.shape
+
+    data = np.ma.masked_all(ny*nx, dtype=field.dtype)
+    data[field.coord('cell').points] = field.data
+    expanded = grid_cube.copy(data=data.reshape(ny, nx))
+    expanded.metadata = field.metadata
+
+    return expanded
@@ -0,0 +1,186 @@
+'''
+Area averages over the polygon of a region (e.g. the area around King's Lynn, from
+East_Anglia_shape_0_coordinates.csv), rather than over the rectangle of the grid around it.
+
+The fraction of each cell of the UKCP Local (rotated pole) grid covered by the polygon is
+computed once, by intersecting the cells with the polygon transformed to the rotated grid,
+and stored in the project's data_files directory, e.g. East_Anglia_polygon_weights.npz,
+with a fingerprint of the grid and of the polygon file, so either changing gives new weights.
+
+The weights are the covered fraction times the area of each cell, so an area mean of a cube
+is a single weighted sum over the window of cells touching the polygon, for all times at once.
+'''
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+import shapely
+import cartopy.crs as ccrs
+import iris
+import iris.cube
+from iris.coords import CellMethod
+import regrid_weights
+
+# Weights already read by this process
+_loaded_weights = {}
+
+
+def polygon_filename(project_name, region_name):
+    '''
+    Returns the name of the file of the longitudes and latitudes of the polygon of a region.
+    '''
+
+    datadir = f'/home/h03/hadmi/Python/{project_name}/data_files/'
+
+    return os.path.join(datadir, f'{region_name}_shape_0_coordinates.csv')
+
+
+def weights_filename(project_name, region_name):
+    '''
+    Returns the name of the file of the polygon weights of a region.
+    '''
+
+    datadir = f'/home/h03/hadmi/Python/{project_name}/data_files/'
+
+    return os.path.join(datadir, f'{region_name}_polygon_weights.npz')
+
+
+def read_polygon(filename):
+    '''
+    Returns the polygon in the file, as a shapely polygon in longitude and latitude.
+    '''
+
+    df = pd.read_csv(filename, header=0, usecols=[2,3])
+
+    return shapely.make_valid(shapely.Polygon(np.stack([df['longitude'], df['latitude']], axis=1)))
+
+
+def compute_coverage(polygon, grid_cube):
+    '''
+    Returns the fraction of each cell of the grid of grid_cube covered by the polygon, given in
+    longitude and latitude, as an array of shape (y, x).
+    '''
+
+    x = grid_cube.coord(axis='X', dim_coords=True).copy()
+    y = grid_cube.coord(axis='Y', dim_coords=True).copy()
+    for c in [x, y]:
+        if not c.has_bounds():
+            c.guess_bounds()
+
+# Transform the polygon to the grid's coordinate system, and its longitudes to the range of the grid's
+    shell = shapely.get_coordinates(polygon)
+    pts = x.coord_system.as_cartopy_crs().transform_points(ccrs.Geodetic(), shell[:, 0], shell[:, 1])
+    shift = 360. * np.round((x.points.mean() - pts[:, 0].mean()) / 360.)
+    polygon = shapely.transform(polygon, lambda xy: pts[:, :2] + [shift, 0.])
+    shapely.prepare(polygon)
+
+    x0, y0 = np.meshgrid(x.bounds[:, 0], y.bounds[:, 0])
+    x1, y1 = np.meshgrid(x.bounds[:, 1], y.bounds[:, 1])
+    cells = shapely.box(x0, y0, x1, y1)
+
+    coverage = np.zeros(cells.shape)
+    touching = shapely.intersects(polygon, cells)
+    coverage[touching] = shapely.area(shapely.intersection(polygon, cells[touching])) / shapely.area(cells[touching])
+
+    return coverage
+
+
+def cell_areas(grid_cube):
+    '''
+    Returns the areas of the cells of a grid in longitude and latitude (rotated or not), relative
+    to the area of a cell of 1 by 1 degrees at the equator, as an array of shape (y, x).
+    '''
+
+    x = grid_cube.coord(axis='X', dim_coords=True).copy()
+    y = grid_cube.coord(axis='Y', dim_coords=True).copy()
+    for c in [x, y]:
+        if not c.has_bounds():
+            c.guess_bounds()
+
+    dx = np.abs(np.diff(x.bounds, axis=1)).ravel()
+    dsin = np.abs(np.diff(np.sin(np.radians(y.bounds)), axis=1)).ravel() / np.radians(1.)
+
+    return np.outer(dsin, dx)
+
+
+def load_or_compute_weights(project_name, region_name, grid_cube):
+    '''
+    Returns the polygon weights of a region for the grid of grid_cube, as an array of shape (y, x)
+    which is the covered fraction times the area of each cell. They are read from the weights file
+    of the region if they were computed for the same grid and polygon, otherwise they are computed
+    and saved there. Weights are kept in memory once read.
+    '''
+
+    shape_file = polygon_filename(project_name, region_name)
+    with open(shape_file, 'rb') as ifp:
+        polygon_sha = hashlib.sha1(ifp.read()).hexdigest()[:16]
+    grid_sha = regrid_weights.grid_fingerprint(grid_cube)
+
+    weights_file = weights_filename(project_name, region_name)
+    key = (weights_file, grid_sha, polygon_sha)
+    if key in _loaded_weights:
+        return _loaded_weights[key]
+
+    if os.path.exists(weights_file):
+        with np.load(weights_file) as d:
+            if str(d['grid']) == grid_sha and str(d['polygon']) == polygon_sha:
+                _loaded_weights[key] = d['weights']
+                return _loaded_weights[key]
+
+    coverage = compute_coverage(read_polygon(shape_file), grid_cube)
+    weights = coverage * cell_areas(grid_cube)
+
+# Write to a temporary file and rename it, so other jobs never see a partly written file
+    fd, tmp_file = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(weights_file))
+    with os.fdopen(fd, 'wb') as ofp:
+        np.savez(ofp, weights=weights, coverage=coverage, grid=grid_sha, polygon=polygon_sha)
+    os.replace(tmp_file, weights_file)
+    _loaded_weights[key] = weights
+
+    return weights
+
+
+def area_mean(cube, weights):
+    '''
+    Returns the time series of the weighted mean of a (time, y, x) cube over the polygon, given its
+    weights from load_or_compute_weights. Only the window of cells with non-zero weights is read, and
+    masked cells are left out of the mean. Times at which every cell in the polygon is masked are masked.
+    Cubes in the compact (time, cell) layout of region_mask.py are averaged over their cells, which
+    must include every cell with a non-zero weight, as the masks of region_mask.compute_mask do.
+    '''
+
+    if cube.coords('cell', dim_coords=True):
+        cells = cube.coord('cell').points
+        missing = np.setdiff1d(np.flatnonzero(weights), cells)
+        if len(missing) > 0:
+            raise ValueError(f'{len(missing)} cells which overlap the polygon are not in the compact cube; '
+                'its region mask must be made with region_mask.compute_mask')
+        w = weights.ravel()[cells]
+        data = np.ma.asarray(cube.data)
+        axes = 1
+        coord_names = ['cell']
+    else:
+        rows = np.nonzero(weights.any(axis=1))[0]
+        cols = np.nonzero(weights.any(axis=0))[0]
+        ys = slice(rows[0], rows[-1]+1)
+        xs = slice(cols[0], cols[-1]+1)
+        w = weights[ys, xs]
+        data = np.ma.asarray(cube[:, ys, xs].data)
+        axes = 2
+        coord_names = [cube.coord(dimensions=d, dim_coords=True).name() for d in [1, 2]]
+
+    valid = ~np.ma.getmaskarray(data)
+    total = np.tensordot(data.filled(0), w, axes=axes)
+    weight = np.tensordot(valid, w, axes=axes)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.ma.masked_where(weight == 0, total / weight).astype(cube.dtype)
+
+    mean = iris.cube.Cube(result)
+    mean.metadata = cube.metadata
+    mean.add_dim_coord(cube.coord('time'), 0)
+    mean.add_cell_method(CellMethod('mean', coords=coord_names))
+
+    return mean
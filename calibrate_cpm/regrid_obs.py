@@ -1,23 +1,65 @@
 import os
 import sys
 import glob
+import time
 import getpass
 import iris
 from cf_units import Unit
+import load_data
+import regrid_weights
+import grid_descriptor
+import timeseries_writer
+import region_mask
 
 
-def regrid_obs(user_id, project_name, region_name, var_name, obs_filename, out_dir):
+def make_output_filename(region_name, var_name, obs_filename):
+    '''
+    Constructs the name of the file holding the regridded data from one HadUK-Grid file
+    '''
+
+    file_parts = os.path.basename(obs_filename).split('_')
+    fhead = f'{region_name}_{var_name}_obs'
+    fend = '_'.join(file_parts[-5:])
+
+    return '_'.join([fhead, fend.replace('1km', '2.2km')])
+
+
+def load_target_grid(user_id, project_name, region_name, var_name):
+    '''
+    Returns a cube defining the target grid for the subregion (e.g. Bristol). This is read from
+    the region's grid descriptor (written by get_bounds_on_rotated_grid.py) if it exists,
+    otherwise from the first processed CPM file for the region.
+    '''
+
+    descriptor_filename = grid_descriptor.grid_descriptor_filename(project_name, region_name)
+    if os.path.exists(descriptor_filename):
+        return grid_descriptor.load_grid_descriptor(descriptor_filename)
 
-    #get a target output grid. Need a grid for the subregion (e.g. Bristol), not the full UKCP Local grid.
     dlocal = os.path.join('/net/spice/scratch/', user_id, project_name, 'cpm_prep/01/', var_name)
     filename_template = '_'.join([region_name, var_name]) + '*.nc'
-    cpm = iris.load_cube(sorted(glob.glob(os.path.join(dlocal, filename_template)))[0])
- 
-# Set up and perform the regridding
+
+    return iris.load_cube(sorted(glob.glob(os.path.join(dlocal, filename_template)))[0])
+
+
+def regrid_obs_file(obs_filename, cpm, var_name, weights_dir, method='linear'):
+    '''
+    Reads one HadUK-Grid file and returns the data regridded to the grid of cube 'cpm'.
+    method -- 'linear' (bilinear interpolation) or 'conservative' (area-weighted)
+    '''
+
+# Only read the part of the 1 km grid covering the target grid, plus a small halo.
+    t0 = time.time()
     obs_1km = iris.load_cube(obs_filename)
+    full_nbytes = obs_1km.lazy_data().nbytes
+    ys, xs = regrid_weights.source_window(obs_1km, cpm, halo=3)
+    obs_1km = obs_1km[:, ys, xs]
     del obs_1km.attributes['creation_date'] # to aid later collapsing
-    regridder = iris.analysis.Linear().regridder(obs_1km[0], cpm[0])
-    obs_regridded = regridder(obs_1km)
+
+# Set up and perform the regridding. The interpolation weights are computed by the first job
+# for this pair of grids, and read from the cache by all the others.
+    weights = regrid_weights.load_or_compute_weights(obs_1km, cpm, weights_dir, method=method)
+    obs_regridded = regrid_weights.apply_weights(weights, obs_1km, cpm, method=method)
+    print(f'Read {obs_1km.data.nbytes/1e6:.1f} of {full_nbytes/1e6:.1f} MB, regridded in {time.time()-t0:.1f} s')
 
 # Add missing coordinates to the regridded observations. Modify the labels to remove the degree symbol.
     obs_regridded.add_aux_coord(cpm.coord('latitude'), data_dims=[1,2])
@@ -38,17 +80,83 @@ def regrid_obs(user_id, project_name, region_name, var_name, obs_filename, out_d
 
     obs_regridded.attributes['plot_label'] = plot_label
 
+    return obs_regridded
+
+
+def regrid_obs(user_id, project_name, region_name, var_name, obs_filename, out_dir, method='linear',
+    compress=False):
+
+    #get a target output grid. Need a grid for the subregion (e.g. Bristol), not the full UKCP Local grid.
+    cpm = load_target_grid(user_id, project_name, region_name, var_name)
+
+    weights_dir = os.path.join('/net/spice/scratch/', user_id, project_name, 'regrid_weights')
+    obs_regridded = regrid_obs_file(obs_filename, cpm, var_name, weights_dir, method=method)
+
+# Optionally keep only the cells overlapping the polygon of the region, as for the CPM data
+    mask = grid_descriptor.load_region_mask(project_name, region_name) if compress else None
+    if mask is not None:
+        obs_regridded = region_mask.compress(obs_regridded, mask)
+
 # Construct the output filename and save the regridded data
-    file_parts = os.path.basename(obs_filename).split('_')
-    fhead = f'{region_name}_{var_name}_obs'
-    fend = '_'.join(file_parts[-5:])
-    fout = '_'.join([fhead, fend.replace('1km', '2.2km')])
+    fout = make_output_filename(region_name, var_name, obs_filename)
     print('fout=',fout)
     iris.save(obs_regridded, os.path.join(out_dir, fout))
 
     return
 
 
+def regrid_obs_batch(user_id, project_name, region_name, var_name, obs_filenames, out_dir, merge=False,
+    method='linear', compress=False):
+    '''
+    Regrids a whole list of HadUK-Grid files in one process. The target grid and the
+    regridding weights are loaded once and used for every file.
+
+    obs_filenames -- The HadUK-Grid files, in time order
+    merge -- If True, write a single file containing the whole period, instead of one
+        file per input file. The separate merge step (merge_hadukgrid.py) is then not needed.
+    method -- 'linear' (bilinear interpolation) or 'conservative' (area-weighted)
+    compress -- If True, and the grid descriptor of the region holds a mask, only the cells inside
+        it are saved, in the compact (time, cell) layout of region_mask.py, as prep_cpm_data.py
+        does for the CPM data with compress=True. Otherwise the data are saved on the grid.
+    '''
+
+    cpm = load_target_grid(user_id, project_name, region_name, var_name)
+    weights_dir = os.path.join('/net/spice/scratch/', user_id, project_name, 'regrid_weights')
+    mask = grid_descriptor.load_region_mask(project_name, region_name) if compress else None
+
+# In merge mode, each file is appended to the merged file as soon as it is regridded.
+# The dates of the merged file are taken from the first and last input files.
+    if merge:
+        date0 = load_data.FILE_DATES.search(os.path.basename(obs_filenames[0])).group(1)
+        date1 = load_data.FILE_DATES.search(os.path.basename(obs_filenames[-1])).group(2)
+        fout = f'{region_name}_{var_name}_obs_hadukgrid_uk_2.2km_day_{date0}-{date1}.nc'
+        print('fout=',fout)
+        writer = timeseries_writer.TimeSeriesWriter(os.path.join(out_dir, fout))
+
+    for obs_filename in obs_filenames:
+        obs_regridded = regrid_obs_file(obs_filename, cpm, var_name, weights_dir, method=method)
+        if mask is not None:
+            obs_regridded = region_mask.compress(obs_regridded, mask)
+
+        if merge:
+            obs_regridded.attributes = {}
+# Correct the standard name and variable name for the precipitation observations (e.g.
+# lwe_thickness_of_precipitation_amount). Variables with no standard name are left as they are.
+            if 'precipitation_amount' in (obs_regridded.standard_name or ''):
+                obs_regridded.standard_name = 'precipitation_amount'
+                obs_regridded.var_name = var_name
+            writer.append(obs_regridded)
+        else:
+            fout = make_output_filename(region_name, var_name, obs_filename)
+            print('fout=',fout)
+            iris.save(obs_regridded, os.path.join(out_dir, fout))
+
+    if merge:
+        writer.close()
+
+    return
+
+
 if __name__ == '__main__':
 
     user_id = getpass.getuser()
@@ -57,5 +165,24 @@ if __name__ == '__main__':
     var_name = sys.argv[3]
     obs_filename = sys.argv[4]
     out_dir = sys.argv[5]
-    print(project_name, region_name, var_name, obs_filename)
-    regrid_obs(user_id, project_name, region_name, var_name, obs_filename, out_dir)
+# Only the cells overlapping the polygon of the region are kept if 'compress' is given
+    compress = 'compress' in sys.argv[6:]
+    print(project_name, region_name, var_name, obs_filename, compress)
+
+# Rainfall totals are aggregated from the 1 km to the 2.2 km grid conservatively,
+# other variables are interpolated.
+    if var_name == 'pr':
+        method = 'conservative'
+    else:
+        method = 'linear'
+
+# A .txt file contains a list of HadUK-Grid files, which are all regridded by this job
+    if obs_filename.endswith('.txt'):
+        with open(obs_filename, 'r') as ifp:
+            obs_filenames = [line.strip() for line in ifp if line.strip()]
+        merge = len(sys.argv) > 6 and sys.argv[6] == 'merge'
+        regrid_obs_batch(user_id, project_name, region_name, var_name, obs_filenames, out_dir, merge=merge,
+            method=method, compress=compress)
+    else:
+        regrid_obs(user_id, project_name, region_name, var_name, obs_filename, out_dir, method=method,
+            compress=compress)
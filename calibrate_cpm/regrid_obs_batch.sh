@@ -8,5 +8,5 @@
 #SBATCH --export=NONE
 
 module load scitools
-python regrid_obs.py $1 $2 $3 $4 $5
+python regrid_obs.py $1 $2 $3 $4 $5 $6
 
@@ -1,15 +1,21 @@
 import os
-import glob
 import sys
 import subprocess
 import getpass
+import catalog
 
 
-def run_all(user_id, project_name, region_name, var_name, baseline_years, monstart, monend):
+def run_all(user_id, project_name, region_name, var_name, baseline_years, monstart, monend,
+    single_job=False, merge=False, compress=False):
     """
     Launches batch jobs to preprocess gridded observations
     Interpolates the HadUK-Grid data (on a 1 km grid OSGB projection)
         to the 2.2km rotated polar grid used by UKCP Local.
+
+    single_job -- If True, launch one job which regrids all the files, rather than one job per file
+    merge -- If True (and single_job is True), that job writes a single file for the whole period
+    compress -- If True, only the cells overlapping the polygon of the region are kept, in the compact
+        (time, cell) layout of region_mask.py, which pyCAT cannot read
     """
 
     if var_name == 'pr':
@@ -17,9 +23,6 @@ def run_all(user_id, project_name, region_name, var_name, baseline_years, monsta
     else:
         obs_var_name = var_name
 
-    dobs0 = '/project/ukcp18/ncic_observations/post_processed/badc/ukmo-hadobs/data/insitu/MOHC/'
-    dobs1 = 'HadOBS/HadUK-Grid/v1.0.0.0/1km'
-
     dout = os.path.join('/net/spice/scratch/', user_id, project_name, 'HadUK_on_2.2km', var_name)
 
     try:
@@ -28,30 +31,22 @@ def run_all(user_id, project_name, region_name, var_name, baseline_years, monsta
 # directory already exists
         pass
 
-    obs_dir = os.path.join(dobs0, dobs1, obs_var_name, 'day/v20181126')
-
 # List all filenames needed for the given baseline years and start / end months
-    obs_filenames = []
-    for the_year in list(range(baseline_years[0], baseline_years[1]+1)):
-        if the_year == baseline_years[0] and monstart != 1:
-            for the_month in list(range(monstart, 13)):
-                filename_template = '{}_hadukgrid_uk_1km_day_{:4d}{:02d}*.nc'.format(obs_var_name, the_year, the_month)
-                obs_files = glob.glob(os.path.join(obs_dir, filename_template))
-                obs_filenames.extend(obs_files)
-        elif the_year == baseline_years[1] and monend != 12:
-            for the_month in list(range(1, monend+1)):
-                filename_template = '{}_hadukgrid_uk_1km_day_{:4d}{:02d}*.nc'.format(obs_var_name, the_year, the_month)
-                obs_files = glob.glob(os.path.join(obs_dir, filename_template))
-                obs_filenames.extend(obs_files)
-        else:
-            filename_template = '{}_hadukgrid_uk_1km_day_{:4d}*.nc'.format(obs_var_name, the_year)
-            obs_files = glob.glob(os.path.join(obs_dir, filename_template))
-            obs_filenames.extend(obs_files)
-
-    obs_filenames.sort()
-
-    for obs_file in obs_filenames:
-        cmd = ' '.join(['sbatch', 'regrid_obs_batch.sh', project_name, region_name, var_name, obs_file, dout])
+    obs_filenames = catalog.find_files('obs', obs_var_name, baseline_years, monstart=monstart, monend=monend,
+        grid='1km', version='v20181126')
+
+    if single_job:
+# Write the list of files, which is read by the batch job
+        list_filename = os.path.join(dout, f'{region_name}_{var_name}_obs_filenames.txt')
+        with open(list_filename, 'w') as ofp:
+            ofp.write('\n'.join(obs_filenames) + '\n')
+        cmds = [' '.join(['sbatch', 'regrid_obs_all_batch.sh', project_name, region_name, var_name,
+            list_filename, dout, 'merge' if merge else 'monthly'] + (['compress'] if compress else []))]
+    else:
+        cmds = [' '.join(['sbatch', 'regrid_obs_batch.sh', project_name, region_name, var_name, obs_file, dout]
+            + (['compress'] if compress else [])) for obs_file in obs_filenames]
+
+    for cmd in cmds:
         print(cmd)
 
         try:
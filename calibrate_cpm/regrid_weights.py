@@ -0,0 +1,235 @@
+'''
+Routines to regrid the HadUK-Grid observations to the UKCP Local grid with
+precomputed interpolation weights.
+
+Two methods are available: 'linear' (bilinear interpolation, as iris.analysis.Linear)
+and 'conservative' (area-weighted averages of the 1 km cells overlapping each 2.2 km
+cell, which is the appropriate method for aggregating rainfall totals).
+
+The weights for a given pair of source and target grids are computed once and stored
+on disk as a sparse matrix, so regridding a file is a single sparse matrix multiply
+covering all the days in it. The name of the weights file contains a fingerprint of
+both grids, so a new region or a change to either grid gives a new set of weights.
+'''
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+import scipy.sparse
+import shapely
+import iris
+import iris.cube
+
+# Weights already read by this process, so a batch job only reads them once
+_loaded_weights = {}
+
+
+def grid_fingerprint(cube):
+    '''
+    Returns a short hash of the horizontal grid of a cube: the coordinate system,
+    and the points of the x and y dimension coordinates.
+    '''
+
+    x = cube.coord(axis='X', dim_coords=True)
+    y = cube.coord(axis='Y', dim_coords=True)
+
+    h = hashlib.sha1()
+    h.update(repr(x.coord_system).encode())
+    for c in [x, y]:
+        h.update(c.name().encode())
+        h.update(np.ascontiguousarray(c.points, dtype=np.float64).tobytes())
+
+    return h.hexdigest()[:16]
+
+
+def compute_linear_weights(src_cube, tgt_cube):
+    '''
+    Computes the bilinear interpolation weights from the grid of src_cube to the grid
+    of tgt_cube, as a sparse matrix of shape (number of target points, number of source points).
+    The source points are numbered in C order over (y, x), as are the target points.
+    Target points outside the source grid are extrapolated linearly, as for iris.analysis.Linear().
+    '''
+
+    src_x = src_cube.coord(axis='X', dim_coords=True)
+    src_y = src_cube.coord(axis='Y', dim_coords=True)
+    tgt_x = tgt_cube.coord(axis='X', dim_coords=True)
+    tgt_y = tgt_cube.coord(axis='Y', dim_coords=True)
+
+# Get the positions of the target grid points in the source coordinate system
+    tx, ty = np.meshgrid(tgt_x.points, tgt_y.points)
+    src_crs = src_x.coord_system.as_cartopy_crs()
+    tgt_crs = tgt_x.coord_system.as_cartopy_crs()
+    pts = src_crs.transform_points(tgt_crs, tx.ravel(), ty.ravel())
+    px = pts[:, 0]
+    py = pts[:, 1]
+
+    xs = src_x.points
+    ys = src_y.points
+    nx = len(xs)
+
+# Find the source cell containing each target point, and the position within it
+    ix = np.clip(np.searchsorted(xs, px) - 1, 0, len(xs)-2)
+    iy = np.clip(np.searchsorted(ys, py) - 1, 0, len(ys)-2)
+    wx = (px - xs[ix]) / (xs[ix+1] - xs[ix])
+    wy = (py - ys[iy]) / (ys[iy+1] - ys[iy])
+
+    ntgt = len(px)
+    rows = np.repeat(np.arange(ntgt), 4)
+    cols = np.stack([iy*nx + ix, iy*nx + ix+1, (iy+1)*nx + ix, (iy+1)*nx + ix+1], axis=1).ravel()
+    weights = np.stack([(1-wy)*(1-wx), (1-wy)*wx, wy*(1-wx), wy*wx], axis=1).ravel()
+
+    return scipy.sparse.csr_matrix((weights, (rows, cols)), shape=(ntgt, len(xs)*len(ys)))
+
+
+def compute_area_weights(src_cube, tgt_cube):
+    '''
+    Computes the area of overlap between each cell of the target grid and each cell of
+    the source grid, as a sparse matrix of shape (number of target cells, number of source cells).
+    The target cells are converted to quadrilaterals in the source coordinate system, and
+    intersected with the (rectangular) source cells. Areas are in the source coordinate system.
+    '''
+
+    src_x = src_cube.coord(axis='X', dim_coords=True).copy()
+    src_y = src_cube.coord(axis='Y', dim_coords=True).copy()
+    tgt_x = tgt_cube.coord(axis='X', dim_coords=True).copy()
+    tgt_y = tgt_cube.coord(axis='Y', dim_coords=True).copy()
+    for c in [src_x, src_y, tgt_x, tgt_y]:
+        if not c.has_bounds():
+            c.guess_bounds()
+
+# Edges of the source cells, in increasing order
+    xe = np.append(src_x.bounds[:, 0], src_x.bounds[-1, 1])
+    ye = np.append(src_y.bounds[:, 0], src_y.bounds[-1, 1])
+    nx = len(xe) - 1
+    ny = len(ye) - 1
+
+# Corners of the target cells, in the source coordinate system
+    x0, y0 = np.meshgrid(tgt_x.bounds[:, 0], tgt_y.bounds[:, 0])
+    x1, y1 = np.meshgrid(tgt_x.bounds[:, 1], tgt_y.bounds[:, 1])
+    cx = np.stack([x0.ravel(), x1.ravel(), x1.ravel(), x0.ravel()], axis=1)
+    cy = np.stack([y0.ravel(), y0.ravel(), y1.ravel(), y1.ravel()], axis=1)
+    pts = src_x.coord_system.as_cartopy_crs().transform_points(tgt_x.coord_system.as_cartopy_crs(), cx, cy)
+    targets = shapely.polygons(pts[..., :2])
+
+# Range of source cells which each target cell may overlap
+    ix0 = np.clip(np.searchsorted(xe, pts[..., 0].min(axis=1), side='right') - 1, 0, nx-1)
+    ix1 = np.clip(np.searchsorted(xe, pts[..., 0].max(axis=1), side='left') - 1, 0, nx-1)
+    iy0 = np.clip(np.searchsorted(ye, pts[..., 1].min(axis=1), side='right') - 1, 0, ny-1)
+    iy1 = np.clip(np.searchsorted(ye, pts[..., 1].max(axis=1), side='left') - 1, 0, ny-1)
+
+# Form every (target cell, candidate source cell) pair
+    nsx = (ix1 - ix0).max() + 1
+    nsy = (iy1 - iy0).max() + 1
+    ox, oy = [o.ravel() for o in np.meshgrid(np.arange(nsx), np.arange(nsy))]
+    ix = ix0[:, None] + ox[None, :]
+    iy = iy0[:, None] + oy[None, :]
+    ok = (ix <= ix1[:, None]) & (iy <= iy1[:, None])
+    itgt = np.nonzero(ok)[0]
+    ix = ix[ok]
+    iy = iy[ok]
+
+    sources = shapely.box(xe[ix], ye[iy], xe[ix+1], ye[iy+1])
+    areas = shapely.area(shapely.intersection(targets[itgt], sources))
+
+    keep = areas > 0
+    return scipy.sparse.csr_matrix((areas[keep], (itgt[keep], (iy*nx + ix)[keep])),
+        shape=(len(targets), nx*ny))
+
+
+def source_window(src_cube, tgt_cube, halo=2):
+    '''
+    Returns the (y, x) slices of the source grid which cover the target grid, with a
+    halo of 'halo' extra source cells on each side. Only the coordinates are used, so
+    src_cube can be indexed with the slices to read just that window of the file.
+    '''
+
+    src_x = src_cube.coord(axis='X', dim_coords=True)
+    src_y = src_cube.coord(axis='Y', dim_coords=True)
+    tgt_x = tgt_cube.coord(axis='X', dim_coords=True)
+    tgt_y = tgt_cube.coord(axis='Y', dim_coords=True)
+
+# Convert the target grid points to the source coordinate system, and find their extent
+    tx, ty = np.meshgrid(tgt_x.points, tgt_y.points)
+    pts = src_x.coord_system.as_cartopy_crs().transform_points(tgt_x.coord_system.as_cartopy_crs(),
+        tx.ravel(), ty.ravel())
+
+    ix0 = max(np.searchsorted(src_x.points, pts[:, 0].min()) - 1 - halo, 0)
+    ix1 = min(np.searchsorted(src_x.points, pts[:, 0].max()) + 1 + halo, len(src_x.points))
+    iy0 = max(np.searchsorted(src_y.points, pts[:, 1].min()) - 1 - halo, 0)
+    iy1 = min(np.searchsorted(src_y.points, pts[:, 1].max()) + 1 + halo, len(src_y.points))
+
+    return slice(iy0, iy1), slice(ix0, ix1)
+
+
+def load_or_compute_weights(src_cube, tgt_cube, cache_dir, method='linear'):
+    '''
+    Returns the regridding weights from the grid of src_cube to the grid of tgt_cube,
+    for method 'linear' or 'conservative'. They are read from cache_dir if they have been
+    computed before, otherwise they are computed and saved there. Weights are kept in memory once read.
+    '''
+
+    fname = f'{method}_weights_{grid_fingerprint(src_cube)}_{grid_fingerprint(tgt_cube)}.npz'
+    weights_file = os.path.join(cache_dir, fname)
+
+    if weights_file in _loaded_weights:
+        return _loaded_weights[weights_file]
+    if os.path.exists(weights_file):
+        _loaded_weights[weights_file] = scipy.sparse.load_npz(weights_file)
+        return _loaded_weights[weights_file]
+
+    if method == 'conservative':
+        weights = compute_area_weights(src_cube, tgt_cube)
+    else:
+        weights = compute_linear_weights(src_cube, tgt_cube)
+
+# Write to a temporary file and rename it, so other jobs never see a partly written file
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(suffix='.npz', dir=cache_dir)
+    os.close(fd)
+    scipy.sparse.save_npz(tmp_file, weights)
+    os.replace(tmp_file, weights_file)
+    _loaded_weights[weights_file] = weights
+
+    return weights
+
+
+def apply_weights(weights, src_cube, tgt_cube, method='linear', mdtol=1):
+    '''
+    Regrids src_cube, with dimensions (time, y, x), to the grid of tgt_cube using the
+    sparse weights. All the times are regridded in one matrix multiply.
+
+    For method 'linear', a target point is masked if any of the source points it depends on
+    are masked. For method 'conservative', the result is the area-weighted mean of the
+    unmasked source cells, and a target cell is masked if the fraction of its area covered
+    by masked cells is greater than mdtol (as for iris.analysis.AreaWeighted).
+    '''
+
+    nt = src_cube.shape[0]
+    ny, nx = [len(tgt_cube.coord(axis=a, dim_coords=True).points) for a in ['Y', 'X']]
+
+    data = np.ma.asarray(src_cube.data).reshape(nt, -1)
+    mask = np.ma.getmaskarray(data)
+
+    if method == 'conservative':
+        valid_area = (weights @ (~mask).T.astype(np.float64)).T
+        total_area = np.asarray(weights.sum(axis=1)).ravel()
+        values = (weights @ data.filled(0).T).T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = values / valid_area
+            result_mask = (valid_area == 0) | (1 - valid_area/total_area > mdtol)
+    else:
+        values = (weights @ data.filled(0).T).T
+        masked_weight = (abs(weights) @ mask.T.astype(np.float64)).T
+        result_mask = masked_weight > 0
+
+    result = np.ma.masked_array(values, mask=result_mask).reshape(nt, ny, nx)
+    result = result.astype(src_cube.dtype)
+
+    cube = iris.cube.Cube(result)
+    cube.metadata = src_cube.metadata
+    cube.add_dim_coord(src_cube.coord('time'), 0)
+    cube.add_dim_coord(tgt_cube.coord(axis='Y', dim_coords=True), 1)
+    cube.add_dim_coord(tgt_cube.coord(axis='X', dim_coords=True), 2)
+
+    return cube
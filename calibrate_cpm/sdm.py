@@ -0,0 +1,425 @@
+'''
+Scaled Distribution Mapping (Switanek et al., 2017, HESS 21, 2649-2666), working on
+whole arrays of grid cells at once.
+
+This follows the implementation in pyCAT (pycat.esd.methods.absolute_sdm and
+relative_sdm), which corrects one grid cell at a time. Here the data for a month
+are arrays of shape (time, cell), and each step (detrending, sorting, fitting the
+distributions, computing the CDFs, scaling and mapping back) is done for all cells
+with a single NumPy call. The results agree with pyCAT to rounding error.
+
+Temperature is corrected with absolute_sdm (normal distribution), precipitation
+with relative_sdm (gamma distribution fitted to the wet days).
+
+The fits of the baseline data (fit_normal, fit_wet_gamma) are separate from the
+correction of the scenario (absolute_sdm_fitted, relative_sdm_fitted), so that the
+baseline can be fitted once and reused for several scenario periods (see baseline_cache.py).
+'''
+
+import numpy as np
+import scipy.signal
+import scipy.special
+from scipy.special import ndtr, ndtri, gammainc, gammaincinv
+
+CDF_THRESHOLD = .99999999
+LOWER_LIMIT = 0.1
+
+# Increased whenever a change to the fits changes their results, so fits cached by baseline_cache.py
+# from an earlier version are made again
+VERSION = 2
+
+
+def _stretch(values, start, n_in, n_out, nrows):
+    '''
+    Linear interpolation of n_in values in each column onto n_out equally spaced points,
+    as np.interp(np.linspace(1, n_in, n_out), np.linspace(1, n_in, n_in), column).
+
+    values -- Array of shape (time, cell)
+    start -- The row of the first value to use in each column (integer or array over cells)
+    n_in -- The number of values to use in each column (integer or array over cells)
+    n_out -- The number of points required in each column (integer or array over cells)
+    nrows -- The number of rows in the result. Rows at or beyond n_out in a column are undefined.
+    '''
+
+    ncells = values.shape[1]
+    start = np.broadcast_to(start, (ncells,))
+    n_in = np.broadcast_to(n_in, (ncells,))
+    n_out = np.broadcast_to(n_out, (ncells,))
+
+    step = np.where(n_out > 1, (n_in - 1) / np.maximum(n_out - 1, 1), 0.)
+    pos = np.arange(nrows)[:, None] * step
+    i0 = np.clip(np.floor(pos).astype(int), 0, np.maximum(n_in - 2, 0))
+    i1 = np.minimum(i0 + 1, np.maximum(n_in - 1, 0))
+    w = pos - i0
+
+    rows0 = np.clip(start + i0, 0, values.shape[0] - 1)
+    rows1 = np.clip(start + i1, 0, values.shape[0] - 1)
+    cols = np.arange(ncells)
+    a = values[rows0, cols]
+    b = values[rows1, cols]
+
+    return a + w * (b - a)
+
+
+def fit_gamma(data, wet):
+    '''
+    Maximum likelihood fit of the gamma distribution, with location 0, to the values
+    in each column of data where wet is True (as scipy.stats.gamma.fit(x, floc=0)).
+    Returns the shape and scale for each column, which are NaN where the fit is not possible.
+    '''
+
+    n = wet.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(wet, data, 0.).sum(axis=0) / n
+        mean_log = np.where(wet, np.log(np.where(wet, data, 1.)), 0.).sum(axis=0) / n
+
+    return fit_gamma_moments(mean, mean_log)
+
+
+def fit_gamma_moments(mean, mean_log):
+    '''
+    As fit_gamma, given the mean and the mean of the logarithm of the wet values in each column.
+    '''
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.log(mean) - mean_log
+        s = np.where(s > 0, s, np.nan)
+
+# Solve log(a) - digamma(a) = s by Newton's method, from the same first estimate as scipy.
+# Each cell stops once it has converged, so its fit does not depend on the other cells in the array.
+        a = np.array((3 - s + np.sqrt((s - 3)**2 + 24*s)) / (12*s), dtype=np.float64)
+        active = np.array(np.isfinite(a))
+        for it in range(20):
+            if not active.any():
+                break
+            a0 = a[active]
+            f = np.log(a0) - scipy.special.digamma(a0) - s[active]
+            a_new = a0 - f / (1/a0 - scipy.special.polygamma(1, a0))
+            a_new = np.where(a_new > 0, a_new, a0/2)
+            a[active] = a_new
+            active[active] = np.abs(a_new - a0) / a0 >= 1e-15
+
+    return a, mean / a
+
+
+def _wet_gamma_cdf(data, params, lower_limit, cdf_threshold):
+    '''
+    Returns the gamma CDF, with the (shape, scale) for each column in params, of the values
+    of data which are at least lower_limit, limited to cdf_threshold. The CDF is 0 elsewhere.
+    '''
+
+    wet = data >= lower_limit
+    shape = np.broadcast_to(params[0], data.shape)[wet]
+    scale = np.broadcast_to(params[1], data.shape)[wet]
+
+    cdf = np.zeros(data.shape)
+    with np.errstate(invalid='ignore'):
+        cdf[wet] = np.minimum(gammainc(shape, data[wet] / scale), cdf_threshold)
+
+    return cdf
+
+
+def fit_normal(data, cdf_threshold=CDF_THRESHOLD):
+    '''
+    Fits the normal distribution to the detrended data in each column of data, an array
+    of shape (time, cell). Returns a dictionary of the length and mean of the data, the
+    parameters of the distribution, and the CDF of the sorted detrended data.
+    '''
+
+    detrended = scipy.signal.detrend(data, axis=0)
+
+    return normal_fit_sorted(np.sort(detrended, axis=0), data.mean(axis=0), detrended.mean(axis=0),
+        detrended.std(axis=0), cdf_threshold)
+
+
+def normal_fit_sorted(sorted_detrended, mean, loc, scale, cdf_threshold=CDF_THRESHOLD):
+    '''
+    Returns the fit of the normal distribution, as fit_normal, given the sorted detrended data,
+    the mean of the data, and the mean and standard deviation of the detrended data.
+    '''
+
+    cdf = ndtr((sorted_detrended - loc) / scale)
+    cdf = np.maximum(np.minimum(cdf, cdf_threshold), 1 - cdf_threshold)
+
+    return {'len': np.array(sorted_detrended.shape[0]), 'mean': mean, 'loc': loc, 'scale': scale, 'cdf': cdf}
+
+
+def fit_wet_gamma(data, lower_limit=LOWER_LIMIT, cdf_threshold=CDF_THRESHOLD):
+    '''
+    Fits the gamma distribution to the wet days in each column of data, an array of shape
+    (time, cell). Returns a dictionary of the length of the data, the number of wet days,
+    the parameters of the distribution, and the CDF of the sorted data (0 for dry days).
+    '''
+
+    wet = data >= lower_limit
+    shape, scale = fit_gamma(data, wet)
+
+    return wet_gamma_fit_sorted(np.sort(data, axis=0), wet.sum(axis=0), shape, scale, lower_limit, cdf_threshold)
+
+
+def wet_gamma_fit_sorted(sorted_data, n_wet, shape, scale, lower_limit=LOWER_LIMIT, cdf_threshold=CDF_THRESHOLD):
+    '''
+    Returns the fit of the gamma distribution, as fit_wet_gamma, given the sorted data, the number
+    of wet days and the parameters of the distribution.
+    '''
+
+    cdf = _wet_gamma_cdf(sorted_data, (shape, scale), lower_limit, cdf_threshold)
+
+    return {'len': np.array(sorted_data.shape[0]), 'n_wet': n_wet, 'shape': shape, 'scale': scale, 'cdf': cdf}
+
+
+def absolute_sdm(obs, mod, sce, cdf_threshold=CDF_THRESHOLD):
+    '''
+    Absolute scaled distribution mapping, assuming normally distributed data (e.g. temperature).
+    obs, mod and sce are arrays of shape (time, cell), and the corrected scenario data are returned.
+    '''
+
+    return absolute_sdm_fitted(fit_normal(obs, cdf_threshold), fit_normal(mod, cdf_threshold), sce,
+        cdf_threshold=cdf_threshold)
+
+
+def absolute_sdm_fitted(obs_fit, mod_fit, sce, cdf_threshold=CDF_THRESHOLD):
+    '''
+    As absolute_sdm, with the obs and mod baselines given by their fits from fit_normal.
+    '''
+
+# Detrend the scenario data, and fit the normal distribution
+    sce_detrended = scipy.signal.detrend(sce, axis=0)
+    sce_diff = sce - sce_detrended
+    sce_argsort = np.argsort(sce_detrended, axis=0)
+    sce_mean = sce.mean(axis=0)
+    sce_fit = normal_fit_sorted(np.take_along_axis(sce_detrended, sce_argsort, axis=0), sce_mean,
+        sce_detrended.mean(axis=0), sce_detrended.std(axis=0), cdf_threshold)
+
+    xvals = absolute_sdm_sorted(obs_fit, mod_fit, sce_fit, cdf_threshold)
+
+# Put the values back in time order, and restore the trend of the scenario
+    correction = np.zeros(sce.shape)
+    np.put_along_axis(correction, sce_argsort, xvals, axis=0)
+    correction += sce_diff - sce_mean
+
+    return correction
+
+
+def absolute_sdm_sorted(obs_fit, mod_fit, sce_fit, cdf_threshold=CDF_THRESHOLD):
+    '''
+    The core of absolute_sdm. Given the fits of the obs and mod baselines and of the detrended
+    scenario, from normal_fit_sorted, returns the corrected values of the scenario in the order
+    of the sorted detrended scenario, without its trend.
+    '''
+
+    obs_len = int(obs_fit['len'])
+    mod_len = int(mod_fit['len'])
+    sce_len = int(sce_fit['len'])
+
+    obs_norm = (obs_fit['loc'], obs_fit['scale'])
+    mod_norm = (mod_fit['loc'], mod_fit['scale'])
+    sce_norm = (sce_fit['loc'], sce_fit['scale'])
+    sce_cdf = sce_fit['cdf']
+
+# Interpolate the obs and mod CDFs to the length of the scenario
+    obs_cdf_intpol = _stretch(obs_fit['cdf'], 0, obs_len, sce_len, sce_len)
+    mod_cdf_intpol = _stretch(mod_fit['cdf'], 0, mod_len, sce_len, sce_len)
+
+# Adapt the observed CDF, treating the two tails separately
+    obs_cdf_shift = obs_cdf_intpol - .5
+    mod_cdf_shift = mod_cdf_intpol - .5
+    sce_cdf_shift = sce_cdf - .5
+    obs_inverse = 1. / (.5 - np.abs(obs_cdf_shift))
+    mod_inverse = 1. / (.5 - np.abs(mod_cdf_shift))
+    sce_inverse = 1. / (.5 - np.abs(sce_cdf_shift))
+    adapted_cdf = np.sign(obs_cdf_shift) * (1. - 1. / (obs_inverse * sce_inverse / mod_inverse))
+    adapted_cdf[adapted_cdf < 0] += 1.
+    adapted_cdf = np.maximum(np.minimum(adapted_cdf, cdf_threshold), 1 - cdf_threshold)
+
+    sce_quantile = ndtri(sce_cdf)
+    xvals = obs_norm[0] + obs_norm[1] * ndtri(np.sort(adapted_cdf, axis=0)) \
+        + obs_norm[1] / mod_norm[1] * ((sce_norm[0] + sce_norm[1] * sce_quantile)
+        - (mod_norm[0] + mod_norm[1] * sce_quantile))
+    xvals -= xvals.mean(axis=0)
+    xvals += obs_fit['mean'] + (sce_fit['mean'] - mod_fit['mean'])
+
+    return xvals
+
+
+def relative_sdm(obs, mod, sce, lower_limit=LOWER_LIMIT, cdf_threshold=CDF_THRESHOLD):
+    '''
+    Relative scaled distribution mapping, assuming gamma distributed data (e.g. precipitation).
+    obs, mod and sce are arrays of shape (time, cell), and the corrected scenario data are returned.
+    Days below lower_limit are dry. Cells with fewer than two distinct wet values in any of
+    the datasets, for which the gamma distribution cannot be fitted, are returned uncorrected,
+    and reported by report_unfitted.
+    '''
+
+    return relative_sdm_fitted(fit_wet_gamma(obs, lower_limit, cdf_threshold),
+        fit_wet_gamma(mod, lower_limit, cdf_threshold), sce, lower_limit=lower_limit, cdf_threshold=cdf_threshold)
+
+
+def relative_sdm_fitted(obs_fit, mod_fit, sce, lower_limit=LOWER_LIMIT, cdf_threshold=CDF_THRESHOLD):
+    '''
+    As relative_sdm, with the obs and mod baselines given by their fits from fit_wet_gamma.
+    '''
+
+    sce_wet = sce >= lower_limit
+    sce_argsort = np.argsort(sce, axis=0)
+    sce_sorted = np.take_along_axis(sce, sce_argsort, axis=0)
+    sce_fit = wet_gamma_fit_sorted(sce_sorted, sce_wet.sum(axis=0), *fit_gamma(sce, sce_wet), lower_limit,
+        cdf_threshold)
+    sce_fit['sorted'] = sce_sorted
+
+    sorted_correction, ok = relative_sdm_sorted(obs_fit, mod_fit, sce_fit, lower_limit, cdf_threshold)
+
+    correction = np.zeros(sce.shape)
+    np.put_along_axis(correction, sce_argsort, sorted_correction, axis=0)
+
+    return np.where(ok, correction, sce)
+
+
+def relative_sdm_sorted(obs_fit, mod_fit, sce_fit, lower_limit=LOWER_LIMIT, cdf_threshold=CDF_THRESHOLD):
+    '''
+    The core of relative_sdm. Given the fits of the obs and mod baselines and of the scenario,
+    from wet_gamma_fit_sorted, with the sorted scenario data in sce_fit['sorted'], returns the
+    corrected values of the scenario in the order of the sorted scenario, and whether each cell
+    could be corrected.
+    '''
+
+    obs_len = int(obs_fit['len'])
+    mod_len = int(mod_fit['len'])
+    sce_len = int(sce_fit['len'])
+    sce_sorted = sce_fit['sorted']
+    ncells = sce_sorted.shape[1]
+    cols = np.arange(ncells)
+
+    n_obs = obs_fit['n_wet']
+    n_mod = mod_fit['n_wet']
+    n_sce = sce_fit['n_wet']
+
+    obs_frequency = 1. * n_obs / obs_len
+    mod_frequency = 1. * n_mod / mod_len
+    sce_frequency = 1. * n_sce / sce_len
+
+    obs_gamma = (obs_fit['shape'], obs_fit['scale'])
+    mod_gamma = (mod_fit['shape'], mod_fit['scale'])
+    sce_gamma = (sce_fit['shape'], sce_fit['scale'])
+    ok = np.isfinite(obs_gamma[0]) & np.isfinite(mod_gamma[0]) & np.isfinite(sce_gamma[0])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = np.round(sce_len * obs_frequency * sce_frequency / mod_frequency)
+    expected_sce_raindays = np.where(ok, np.minimum(expected, sce_len), 0).astype(int)
+
+# The wet days of the sorted scenario data are the last n values in each column
+    sce_cdf = sce_fit['cdf']
+
+# Arrange the wet days of the scenario in the first n_sce rows, and interpolate the
+# obs and mod CDFs of the wet days to the same number of values
+    nrows = max(n_sce.max(), 1)
+    k = np.arange(nrows)[:, None]
+    valid = k < n_sce
+    sce_rows = np.clip(sce_len - n_sce + k, 0, sce_len - 1)
+    sce_cdf = sce_cdf[sce_rows, cols]
+    obs_cdf_intpol = _stretch(obs_fit['cdf'], obs_len - n_obs, n_obs, n_sce, nrows)
+    mod_cdf_intpol = _stretch(mod_fit['cdf'], mod_len - n_mod, n_mod, n_sce, nrows)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        obs_inverse = 1. / (1 - obs_cdf_intpol)
+        mod_inverse = 1. / (1 - mod_cdf_intpol)
+        sce_inverse = 1. / (1 - sce_cdf)
+        adapted_cdf = 1 - 1. / (obs_inverse * sce_inverse / mod_inverse)
+        adapted_cdf[adapted_cdf < 0.] = 0.
+        adapted_cdf[~valid] = np.nan
+
+# The scenario quantiles at sce_cdf are the sorted wet days themselves, except where the
+# CDF was limited by cdf_threshold, so the inverse CDF is only evaluated there
+        sce_quantile = sce_sorted[sce_rows, cols]
+        limited = sce_cdf >= cdf_threshold
+        shape = np.broadcast_to(sce_gamma[0], sce_cdf.shape)[limited]
+        scale = np.broadcast_to(sce_gamma[1], sce_cdf.shape)[limited]
+        sce_quantile[limited] = gammaincinv(shape, sce_cdf[limited]) * scale
+
+        xvals = gammaincinv(obs_gamma[0], np.sort(adapted_cdf, axis=0)) * obs_gamma[1] \
+            * sce_quantile / (gammaincinv(mod_gamma[0], sce_cdf) * mod_gamma[1])
+
+# Where fewer wet days are expected than the scenario has, interpolate to the expected number,
+# which are given to the wettest days of the scenario. Otherwise pyCAT pads the values with zeros
+# for the extra days, so only the wet days of the scenario are wet after the correction.
+    n_out = np.minimum(expected_sce_raindays, n_sce)
+    nexp = max(n_out.max(), 1)
+    xvals = _stretch(xvals, 0, n_sce, n_out, nexp)
+
+    j = np.arange(nexp)[:, None]
+    wet_days = np.broadcast_to(j < n_out, xvals.shape)
+    rows = np.broadcast_to(sce_len - n_out + j, xvals.shape)
+    sorted_correction = np.zeros(sce_sorted.shape)
+    sorted_correction[rows[wet_days], np.broadcast_to(cols, xvals.shape)[wet_days]] = xvals[wet_days]
+
+    report_unfitted(ok)
+
+    return sorted_correction, ok
+
+
+def report_unfitted(ok):
+    '''
+    Prints the number of cells, and the first few of them, where the gamma distribution could not
+    be fitted (i.e. ok is False), which are left uncorrected.
+    '''
+
+    failed = np.flatnonzero(~ok)
+    if len(failed) > 0:
+        print(f'The gamma distribution could not be fitted in {len(failed)} of {len(ok)} cells, '
+            f'which are left uncorrected: cells {failed[:10].tolist()}' + (' ...' if len(failed) > 10 else ''))
+
+
+def select_method(standard_name):
+    '''
+    Returns the form of scaled distribution mapping used for a variable.
+    '''
+
+    if standard_name == 'air_temperature':
+        return absolute_sdm
+    elif standard_name in ['precipitation_amount', 'surface_downwelling_shortwave_flux_in_air']:
+        return relative_sdm
+    else:
+        raise NotImplementedError(f'Scaled distribution mapping is not implemented for {standard_name}')
+
+
+def select_fitted_method(standard_name):
+    '''
+    Returns the functions which fit the baseline data of a variable and correct the scenario
+    from those fits, e.g. (fit_normal, absolute_sdm_fitted).
+    '''
+
+    method = select_method(standard_name)
+    if method is absolute_sdm:
+        return fit_normal, absolute_sdm_fitted
+    else:
+        return fit_wet_gamma, relative_sdm_fitted
+
+
+def scaled_distribution_mapping(obs_cube, mod_cube, sce_cubes, block_size=5000, **kwargs):
+    '''
+    Applies scaled distribution mapping to each of the scenario cubes, replacing their data,
+    as pycat.esd.methods.scaled_distribution_mapping. Cells where the observations are
+    masked are left unchanged.
+
+    obs_cube -- Observations for the baseline period, with time as the first dimension
+    mod_cube -- Model data for the baseline period, on the same grid
+    sce_cubes -- List of cubes of model data to be corrected, on the same grid
+    block_size -- The number of grid cells corrected at once, which limits the memory used
+    kwargs -- Passed to absolute_sdm or relative_sdm, e.g. cdf_threshold, lower_limit
+    '''
+
+    method = select_method(obs_cube.standard_name)
+
+# Only correct cells with valid observations
+    obs_data = obs_cube.data.reshape(obs_cube.shape[0], -1)
+    mod_data = mod_cube.data.reshape(mod_cube.shape[0], -1)
+    cells = np.nonzero(~np.ma.getmaskarray(obs_data)[0])[0]
+
+    for sce_cube in sce_cubes:
+        sce_data = np.ma.asarray(sce_cube.data).reshape(sce_cube.shape[0], -1)
+        for b0 in range(0, len(cells), block_size):
+            block = cells[b0:b0+block_size]
+            sce_data[:, block] = method(np.ma.getdata(obs_data[:, block]).astype(np.float64),
+                np.ma.getdata(mod_data[:, block]).astype(np.float64),
+                np.ma.getdata(sce_data[:, block]).astype(np.float64), **kwargs)
+        sce_cube.data = sce_data.reshape(sce_cube.shape)
@@ -0,0 +1,71 @@
+'''
+The observations for the baseline period, decoded once into a memory-mapped array.
+
+Every ensemble member is corrected against the same HadUK-Grid baseline. Rather than
+each member (and each worker process) reading and decoding the NetCDF file, the data
+are written once to a float32 .npy file, with NaN where the observations are masked.
+The file is then opened with numpy.load(..., mmap_mode='r'), so all the processes
+share the same pages of the operating system's cache and nothing is copied.
+
+The .npy file is kept next to the other intermediate files and reused while it is
+newer than the NetCDF file it was decoded from.
+'''
+
+import os
+import tempfile
+import numpy as np
+import iris
+
+
+def memmap_filename(memmap_dir, obs_filename):
+    '''
+    Returns the name of the .npy file holding the data of obs_filename.
+    '''
+
+    return os.path.join(memmap_dir, os.path.splitext(os.path.basename(obs_filename))[0] + '.npy')
+
+
+def decode_obs(obs_filename, memmap_dir, block_length=360):
+    '''
+    Writes the data of the observations in obs_filename to a float32 .npy file in memmap_dir,
+    unless an up to date one exists, and returns the name of the file. The data are read
+    block_length times at a time, so the whole file is never held in memory.
+    '''
+
+    try:
+        os.makedirs(memmap_dir)
+    except FileExistsError:
+        pass
+
+    filename = memmap_filename(memmap_dir, obs_filename)
+    if os.path.isfile(filename) and os.path.getmtime(filename) >= os.path.getmtime(obs_filename):
+        print(f'Using the decoded observations in {filename}')
+        return filename
+
+    print(f'Decoding the observations to {filename}')
+    cube = iris.load_cube(obs_filename)
+
+# Write under a temporary name and rename when complete, so other jobs never map a partial file
+    fd, tmp_name = tempfile.mkstemp(dir=memmap_dir, suffix='.npy')
+    os.close(fd)
+    try:
+        values = np.lib.format.open_memmap(tmp_name, mode='w+', dtype=np.float32, shape=cube.shape)
+        for i0 in range(0, cube.shape[0], block_length):
+            block = np.ma.asarray(cube[i0:i0+block_length].data)
+            values[i0:i0+block_length] = np.ma.filled(block.astype(np.float32), np.nan)
+        values.flush()
+        del values
+        os.replace(tmp_name, filename)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+
+    return filename
+
+
+def open_obs(filename):
+    '''
+    Returns the decoded observations in filename as a read-only memory-mapped array.
+    '''
+
+    return np.load(filename, mmap_mode='r')
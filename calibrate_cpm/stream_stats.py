@@ -0,0 +1,210 @@
+'''
+Statistics of each grid cell and calendar month, accumulated from a time series read one
+block of times at a time, so the memory used does not depend on the length of the series.
+
+For each month and cell a StreamingStats keeps the number of valid values, their mean and
+the sum of squared differences from the mean (combined from block to block as in Chan et
+al., 1979), the minimum and maximum, and a histogram over fixed bins, from which quantiles
+are estimated. The statistics of several months (e.g. a season) are combined from those of
+the single months, so a season can be chosen after the data have been read.
+'''
+
+import numpy as np
+from cf_units import Unit
+import time_index
+
+
+def default_edges(units):
+    '''
+    Returns histogram bin edges, in the given units, for temperature (0.5 K wide, from 220 K
+    to 330 K) or precipitation (200 bins logarithmic from 0.01 to 1000 mm/day, with 0 as the
+    first edge). The histograms take 12 x 4 x 220 bytes per cell.
+    '''
+
+    units = Unit(units)
+    if units.is_convertible('K'):
+        return Unit('K').convert(np.arange(220., 330.01, .5), units)
+    elif units.is_convertible('kg m-2 s-1'):
+        return Unit('kg m-2 day-1').convert(np.concatenate([[0.], np.geomspace(.01, 1000., 200)]), units)
+    else:
+        raise ValueError(f'No default histogram bins for units of {units}; give the bin edges')
+
+
+class StreamingStats:
+
+    def __init__(self, cell_shape, edges, nmonths=12):
+        '''
+        cell_shape -- The shape of the data at one time, e.g. (y, x), or (cell,) for compressed data
+        edges -- The increasing edges of the histogram bins. Values below the first edge or above
+            the last are counted in the first or last bin.
+        nmonths -- The number of groups of times, numbered from 1
+        '''
+
+        self.cell_shape = tuple(cell_shape)
+        self.edges = np.asarray(edges, dtype=np.float64)
+        ncells = int(np.prod(self.cell_shape))
+        nbins = len(self.edges) - 1
+# Bins of equal width are found by division rather than by searching the edges
+        widths = np.diff(self.edges)
+        self.width = widths[0] if np.allclose(widths, widths[0]) else None
+
+        self.count = np.zeros((nmonths, ncells), dtype=np.int64)
+        self.mean_values = np.zeros((nmonths, ncells))
+        self.m2 = np.zeros((nmonths, ncells))
+        self.min_values = np.full((nmonths, ncells), np.inf)
+        self.max_values = np.full((nmonths, ncells), -np.inf)
+        self.histogram = np.zeros((nmonths, nbins, ncells), dtype=np.int32)
+
+    def add(self, data, months):
+        '''
+        Adds a block of data, an array of shape (time,) + cell_shape which may be masked, with
+        the month (group) of each time.
+        '''
+
+        ntimes = data.shape[0]
+        ncells = self.count.shape[1]
+        nbins = self.histogram.shape[1]
+        values = np.ma.getdata(data).reshape(ntimes, ncells).astype(np.float64)
+        valid = ~np.ma.getmaskarray(data).reshape(ntimes, ncells) & np.isfinite(values)
+        if self.width is None:
+            bins = np.searchsorted(self.edges, values, side='right') - 1
+        else:
+            with np.errstate(invalid='ignore'):
+                bins = np.floor((values - self.edges[0]) / self.width).astype(np.int64)
+        bins = np.clip(bins, 0, nbins-1)
+        cols = np.broadcast_to(np.arange(ncells), values.shape)
+
+        for month_number in np.unique(months):
+            m = month_number - 1
+            rows = months == month_number
+            v = values[rows]
+            ok = valid[rows]
+
+# The statistics of the block, combined with those so far
+            n_b = ok.sum(axis=0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean_b = np.where(ok, v, 0.).sum(axis=0) / n_b
+            mean_b[n_b == 0] = 0.
+            m2_b = (np.where(ok, v - mean_b, 0.)**2).sum(axis=0)
+
+            n_a = self.count[m]
+            n = n_a + n_b
+            delta = mean_b - self.mean_values[m]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.mean_values[m] = np.where(n > 0, self.mean_values[m] + delta * n_b / n, 0.)
+                self.m2[m] = np.where(n > 0, self.m2[m] + m2_b + delta**2 * n_a * n_b / n, 0.)
+            self.count[m] = n
+
+            self.min_values[m] = np.minimum(self.min_values[m], np.where(ok, v, np.inf).min(axis=0))
+            self.max_values[m] = np.maximum(self.max_values[m], np.where(ok, v, -np.inf).max(axis=0))
+            self.histogram[m] += np.bincount((bins[rows] * ncells + cols[rows])[ok],
+                minlength=nbins*ncells).reshape(nbins, ncells).astype(np.int32)
+
+    def _select(self, months):
+        '''
+        Returns the indices of the given months (default: all), e.g. time_index.SEASONS['jja'].
+        '''
+
+        if months is None:
+            return np.arange(self.count.shape[0])
+
+        return np.asarray(months) - 1
+
+    def _result(self, values, count):
+        '''
+        Returns values over the cells, with the shape of the data at one time, masked where there are no data.
+        '''
+
+        return np.ma.masked_where(count == 0, values).reshape(self.cell_shape)
+
+    def _combined(self, months):
+        '''
+        Returns the number of values, mean and sum of squared differences from the mean of the given months together.
+        '''
+
+        m = self._select(months)
+        count = self.count[m].sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = (self.count[m] * self.mean_values[m]).sum(axis=0) / count
+        m2 = (self.m2[m] + self.count[m] * (self.mean_values[m] - mean)**2).sum(axis=0)
+
+        return count, mean, m2
+
+    def mean(self, months=None):
+        '''
+        Returns the mean of each cell over the given months (default: all).
+        '''
+
+        count, mean, m2 = self._combined(months)
+
+        return self._result(mean, count)
+
+    def variance(self, months=None, ddof=0):
+        '''
+        Returns the variance of each cell over the given months (default: all).
+        '''
+
+        count, mean, m2 = self._combined(months)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._result(m2 / (count - ddof), count)
+
+    def minimum(self, months=None):
+        '''
+        Returns the minimum of each cell over the given months (default: all).
+        '''
+
+        m = self._select(months)
+        return self._result(self.min_values[m].min(axis=0), self.count[m].sum(axis=0))
+
+    def maximum(self, months=None):
+        '''
+        Returns the maximum of each cell over the given months (default: all).
+        '''
+
+        m = self._select(months)
+        return self._result(self.max_values[m].max(axis=0), self.count[m].sum(axis=0))
+
+    def quantile(self, q, months=None):
+        '''
+        Returns the q quantile (0 <= q <= 1) of each cell over the given months (default: all),
+        interpolated linearly within the histogram bin holding it, and limited to the minimum
+        and maximum. Its error is at most the width of that bin.
+        '''
+
+        m = self._select(months)
+        count = self.count[m].sum(axis=0)
+        cumulative = np.cumsum(self.histogram[m].sum(axis=0), axis=0)
+        target = q * count
+
+# The first bin in which the cumulative count reaches the target, and the position within it
+        nbins = cumulative.shape[0]
+        i = np.minimum((cumulative < target).sum(axis=0), nbins-1)
+        cols = np.arange(cumulative.shape[1])
+        below = np.where(i > 0, cumulative[i-1, cols], 0)
+        in_bin = cumulative[i, cols] - below
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.clip(np.where(in_bin > 0, (target - below) / in_bin, 0.), 0, 1)
+        values = self.edges[i] + fraction * (self.edges[i+1] - self.edges[i])
+
+        values = np.clip(values, self.min_values[m].min(axis=0), self.max_values[m].max(axis=0))
+
+        return self._result(values, count)
+
+
+def accumulate(cube, edges=None, block_length=360):
+    '''
+    Returns the StreamingStats by calendar month of a cube with time as its first dimension,
+    reading block_length times at a time. If the cube's data are lazy, only one block is in memory.
+
+    edges -- The edges of the histogram bins (default: from default_edges for the units of the cube)
+    '''
+
+    if edges is None:
+        edges = default_edges(cube.units)
+
+    months = time_index.TimeIndex(cube).month_number
+    stats = StreamingStats(cube.shape[1:], edges)
+    for t0 in range(0, cube.shape[0], block_length):
+        stats.add(cube[t0:t0+block_length].data, months[t0:t0+block_length])
+
+    return stats
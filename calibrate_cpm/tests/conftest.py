@@ -0,0 +1,9 @@
+'''
+The modules of calibrate_cpm import each other by name, as when run from this directory, so the
+directory is put on the path for the tests.
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,35 @@
+import numpy as np
+import cftime
+import iris.cube
+from iris.coords import DimCoord
+from cf_units import Unit
+import bc_filenames
+import merge_timeseries
+
+
+def month_cube(month_number, year_start, year_end):
+    '''
+    A cube of one day in each year of one calendar month of the scenario period from December
+    year_start to November year_end, in the 360-day calendar of the CPM.
+    '''
+
+    units = Unit('days since 1970-01-01', calendar='360_day')
+    first = year_start if month_number == 12 else year_start + 1
+    last = year_end - 1 if month_number == 12 else year_end
+    days = units.date2num([cftime.Datetime360Day(year, month_number, 15) for year in range(first, last + 1)])
+
+    return iris.cube.Cube(np.zeros(len(days)), dim_coords_and_dims=[(DimCoord(days, standard_name='time', units=units), 0)])
+
+
+def test_written_files_are_merged():
+    '''
+    The names of the monthly files written for each engine are those merge_timeseries.py looks for.
+    '''
+
+    for engine in bc_filenames.METHOD_NAMES:
+        written = [bc_filenames.monthly_filename('tasmax', month_cube(m, 2020, 2040), m, engine)
+            for m in [12] + list(range(1, 12))]
+        expected = merge_timeseries.make_intermediate_filenames('', 'tasmax', '2020', '2040', 12, 11, engine)
+
+        assert written == expected
+    assert written[0] == 'window_scaled_distribution_mapping_tasmax_scenario-0_2020-2039_month-12.nc'
@@ -0,0 +1,49 @@
+import numpy as np
+import dask.array as da
+import scipy.signal
+from area_average_cpm import box_means
+
+
+def reference_means(data, size):
+    '''
+    The means of the valid values of each time of data over boxes of size x size, from convolve2d.
+    '''
+
+    kernel = np.ones((size, size))
+    means = []
+    for field in data:
+        valid = ~np.ma.getmaskarray(field)
+        total = scipy.signal.convolve2d(np.where(valid, field.data, 0.), kernel, mode='same', boundary='symm')
+        count = scipy.signal.convolve2d(valid.astype(float), kernel, mode='same', boundary='symm')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means.append(np.ma.masked_where(~valid, total / count))
+
+    return np.ma.stack(means)
+
+
+def masked_data():
+    rng = np.random.default_rng(0)
+    data = np.ma.masked_array(rng.normal(280., 5., (7, 12, 15)))
+# A coastline masked at every time, and one box masked at one time only
+    data[:, :4, :3] = np.ma.masked
+    data[:, 9:, 11:] = np.ma.masked
+    data[3, 6, 7] = np.ma.masked
+
+    return data
+
+
+def test_box_means_against_convolve2d():
+    data = masked_data()
+    means = box_means(data, [1, 3, 5, 8], block_length=3)
+
+    for size in [1, 3, 5, 8]:
+        expected = reference_means(data, size)
+        assert (np.ma.getmaskarray(means[size]) == np.ma.getmaskarray(expected)).all()
+        assert np.allclose(means[size].compressed(), expected.compressed(), rtol=1e-10)
+
+
+def test_box_means_lazy():
+    data = masked_data()
+    means = box_means(da.from_array(data, chunks=(2, 12, 15)), [3], block_length=2)
+
+    assert np.allclose(means[3].compressed(), reference_means(data, 3).compressed(), rtol=1e-10)
@@ -0,0 +1,66 @@
+import os
+import pytest
+import catalog
+
+
+def make_archive(root):
+    '''
+    Creates empty files laid out as in the CPM and HadUK-Grid archives, and returns the data roots.
+    '''
+
+    cpm_root = os.path.join(root, 'cpm')
+    obs_root = os.path.join(root, 'obs')
+    paths = []
+    for member in ['01', '04']:
+        for version in ['v20190731', 'v20210615']:
+            for year in range(1980, 1984):
+                paths.append(os.path.join(cpm_root, member, 'tasmax', 'day', version,
+                    f'tasmax_rcp85_land-cpm_uk_2.2km_{member}_day_{year}1201-{year+1}1130.nc'))
+    for year in [1981, 1982]:
+        for month in range(1, 13):
+            paths.append(os.path.join(obs_root, 'tasmax', 'day', 'v20200731',
+                f'tasmax_hadukgrid_uk_1km_day_{year}{month:02d}01-{year}{month:02d}30.nc'))
+    paths.append(os.path.join(cpm_root, '01', 'tasmax', 'day', 'v20210615', 'README.txt'))
+
+    for path in paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'w').close()
+
+    return {'cpm': cpm_root, 'obs': obs_root}
+
+
+@pytest.fixture
+def catalog_file(tmp_path):
+    filename = str(tmp_path / 'catalog.sqlite')
+    catalog.refresh_catalog(catalog_file=filename, data_roots=make_archive(str(tmp_path / 'archive')))
+
+    return filename
+
+
+def test_find_files_period_and_version(catalog_file):
+    files = catalog.find_files('cpm', 'tasmax', [1981, 1983], monstart=12, monend=11, ensemble_member=4,
+        version='v20210615', catalog_file=catalog_file)
+
+    assert [os.path.basename(f) for f in files] == [
+        'tasmax_rcp85_land-cpm_uk_2.2km_04_day_19811201-19821130.nc',
+        'tasmax_rcp85_land-cpm_uk_2.2km_04_day_19821201-19831130.nc']
+    assert all('/04/tasmax/day/v20210615/' in f for f in files)
+
+
+def test_find_files_all_versions(catalog_file):
+    files = catalog.find_files('cpm', 'tasmax', [1981, 1981], monstart=12, monend=12, ensemble_member=1,
+        catalog_file=catalog_file)
+
+    assert [f.split(os.sep)[-2] for f in files] == ['v20190731', 'v20210615']
+
+
+def test_find_files_obs_months(catalog_file):
+    files = catalog.find_files('obs', 'tasmax', [1981, 1982], monstart=11, monend=2, catalog_file=catalog_file)
+
+# November 1981 to February 1982
+    assert [f.split('_')[-1][:6] for f in files] == ['198111', '198112', '198201', '198202']
+
+
+def test_find_files_without_catalog(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        catalog.find_files('obs', 'tasmax', [1981, 1981], catalog_file=str(tmp_path / 'missing.sqlite'))
@@ -0,0 +1,44 @@
+import numpy as np
+import isimip3_qm
+
+
+def wet_days(rng, shape, frequency, scale):
+    return np.where(rng.random(shape) < frequency, rng.gamma(0.8, scale, shape), 0.)
+
+
+def test_mixed_qm_one_wet_scenario_day():
+    '''
+    A cell whose scenario has only one wet day, to which the gamma distribution cannot be fitted,
+    is corrected from its empirical CDF rather than returned as NaN.
+    '''
+
+    rng = np.random.default_rng(0)
+    obs = wet_days(rng, (600, 3), 0.5, 3.)
+    mod = wet_days(rng, (600, 3), 0.5, 2.)
+    sce = wet_days(rng, (600, 3), 0.5, 2.5)
+    sce[:, 0] = 0.
+    sce[0, 0] = 2.
+
+    corrected = isimip3_qm.mixed_qm(obs, mod, sce)
+
+    assert np.isfinite(corrected).all()
+    assert (corrected >= 0).all()
+# The wet day of the scenario is still the wettest day of the cell
+    assert corrected[0, 0] == corrected[:, 0].max() > isimip3_qm.LOWER_LIMIT
+
+
+def test_mixed_qm_dry_scenario():
+    '''
+    A cell whose scenario has no wet days is finite, and only wet where the pseudo future
+    observations have wet days.
+    '''
+
+    rng = np.random.default_rng(1)
+    obs = wet_days(rng, (600, 2), 0.5, 3.)
+    mod = wet_days(rng, (600, 2), 0.5, 2.)
+    sce = wet_days(rng, (600, 2), 0.5, 2.5)
+    sce[:, 1] = 0.
+
+    corrected = isimip3_qm.mixed_qm(obs, mod, sce)
+
+    assert np.isfinite(corrected).all()
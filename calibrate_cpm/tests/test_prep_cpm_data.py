@@ -0,0 +1,14 @@
+from prep_cpm_data import group_regions
+
+
+def test_group_regions():
+    '''
+    Nearby regions are read in one box, and distant ones in separate boxes.
+    '''
+
+    boxes = {'Norwich': (slice(0, 10), slice(0, 10)), 'Great_Yarmouth': (slice(5, 15), slice(8, 18)),
+        'Bristol': (slice(300, 310), slice(400, 410)), 'Bath': (slice(305, 312), slice(402, 415))}
+
+    assert sorted(map(sorted, group_regions(boxes))) == [['Bath', 'Bristol'], ['Great_Yarmouth', 'Norwich']]
+    assert len(group_regions(boxes, max_ratio=1e6)) == 1
+    assert group_regions({'Bristol': boxes['Bristol']}) == [['Bristol']]
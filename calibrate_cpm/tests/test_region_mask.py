@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+import dask.array as da
+import shapely
+import iris
+import iris.cube
+import iris.analysis
+from iris.coords import DimCoord, AuxCoord
+from iris.coord_systems import RotatedGeogCS
+import region_mask
+import region_weights
+
+
+def grid_cube():
+    '''
+    A (y, x) cube on a small part of the UKCP Local rotated grid, with true longitudes and latitudes.
+    '''
+
+    cs = RotatedGeogCS(37.5, 177.5)
+    x = DimCoord(np.linspace(359.5, 360.5, 12), standard_name='grid_longitude', units='degrees', coord_system=cs)
+    y = DimCoord(np.linspace(-0.5, 0.5, 9), standard_name='grid_latitude', units='degrees', coord_system=cs)
+    cube = iris.cube.Cube(np.zeros((9, 12)), dim_coords_and_dims=[(y, 0), (x, 1)])
+    lon, lat = np.meshgrid(x.points - 360, y.points)
+    cube.add_aux_coord(AuxCoord(lon, standard_name='longitude', units='degrees'), (0, 1))
+    cube.add_aux_coord(AuxCoord(lat, standard_name='latitude', units='degrees'), (0, 1))
+
+    return cube
+
+
+def time_cube(grid, mask):
+    '''
+    A (time, y, x) cube on the grid, masked outside the mask, with an auxiliary coordinate along time
+    and a scalar coordinate.
+    '''
+
+    time = DimCoord(np.arange(5.), standard_name='time', units='days since 1980-12-01')
+    data = np.ma.masked_array(np.arange(5*9*12, dtype=np.float32).reshape(5, 9, 12))
+    data[:, ~mask] = np.ma.masked
+    cube = iris.cube.Cube(data, standard_name='air_temperature', units='K',
+        dim_coords_and_dims=[(time, 0)] + [(c.copy(), d + 1) for d, c in enumerate(grid.coords(dim_coords=True))])
+    for coord in grid.aux_coords:
+        cube.add_aux_coord(coord.copy(), (1, 2))
+    cube.add_aux_coord(AuxCoord(np.arange(5) % 12 + 1, long_name='month_number'), 0)
+    cube.add_aux_coord(AuxCoord(1, long_name='ensemble_member'))
+
+    return cube
+
+
+def test_compute_mask_is_overlap():
+    grid = grid_cube()
+    polygon = shapely.Polygon([(-2.9, 52.2), (-2.1, 52.25), (-2.0, 52.7), (-2.7, 52.8)])
+    mask = region_mask.compute_mask(polygon, grid)
+
+    assert mask.any() and not mask.all()
+    assert (mask == (region_weights.compute_coverage(polygon, grid) > 0)).all()
+
+
+def test_compress_expand_identity():
+    grid = grid_cube()
+    mask = np.zeros((9, 12), dtype=bool)
+    mask[2:7, 3:10] = True
+    mask[4, 3] = False
+    cube = time_cube(grid, mask)
+
+    compressed = region_mask.compress(cube, mask)
+    assert region_mask.is_compressed(compressed)
+    assert not region_mask.is_compressed(cube)
+    assert compressed.shape == (5, mask.sum())
+    assert np.array_equal(compressed.coord('cell').points, np.flatnonzero(mask))
+    assert np.array_equal(compressed.coord('latitude').points, grid.coord('latitude').points[mask])
+
+    expanded = region_mask.expand(compressed, grid)
+    assert expanded.shape == cube.shape
+    assert (np.ma.getmaskarray(expanded.data) == np.ma.getmaskarray(cube.data)).all()
+    assert np.array_equal(expanded.data.compressed(), cube.data.compressed())
+    assert expanded.metadata == cube.metadata
+    for coord in cube.coords():
+        assert expanded.coord(coord.name()) == coord
+        assert expanded.coord_dims(coord.name()) == cube.coord_dims(coord)
+
+
+def test_compress_lazy():
+    grid = grid_cube()
+    mask = np.ones((9, 12), dtype=bool)
+    cube = time_cube(grid, mask)
+    cube.data = da.from_array(cube.data, chunks=(2, 9, 12))
+
+    compressed = region_mask.compress(cube, mask)
+    assert compressed.has_lazy_data()
+    assert np.array_equal(compressed.data, cube.data.reshape(5, -1))
+
+
+def test_expand_field():
+    grid = grid_cube()
+    mask = np.zeros((9, 12), dtype=bool)
+    mask[1:4, 2:5] = True
+    compressed = region_mask.compress(time_cube(grid, mask), mask)
+
+    field = region_mask.expand_field(compressed.collapsed('time', iris.analysis.MEAN), grid)
+    assert field.shape == (9, 12)
+    assert (np.ma.getmaskarray(field.data) == ~mask).all()
+    assert np.allclose(field.data[mask], np.arange(9*12).reshape(9, 12)[mask] + 2*9*12)
+
+
+def test_compress_wrong_mask():
+    grid = grid_cube()
+    with pytest.raises(ValueError):
+        region_mask.compress(time_cube(grid, np.ones((9, 12), dtype=bool)), np.ones((9, 11), dtype=bool))
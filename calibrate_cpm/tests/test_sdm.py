@@ -0,0 +1,122 @@
+import numpy as np
+import scipy.signal
+import scipy.stats
+import sdm
+
+# Deterministic data for two cells over 24 days, so the reference values do not depend on a random generator
+t = np.arange(24.)[:, None]
+
+
+def temperature(offset, amplitude, trend):
+    return offset + amplitude * np.sin(t * np.array([1.3, 2.9])) + trend * t
+
+
+def rain(wet_every, scale):
+    data = scale * (1.5 + np.sin(t * np.array([0.7, 1.9])))**2
+    data[np.arange(24) % wet_every != 0] = 0.
+    return data
+
+
+def test_fit_gamma_matches_scipy():
+    data = rain(1, 2.)
+    shape, scale = sdm.fit_gamma(data, data >= sdm.LOWER_LIMIT)
+
+    for cell in range(2):
+        a, _, b = scipy.stats.gamma.fit(data[:, cell], floc=0)
+        assert np.isclose(shape[cell], a, rtol=1e-10)
+        assert np.isclose(scale[cell], b, rtol=1e-10)
+
+
+def test_fit_gamma_moments_independent_of_other_cells():
+    '''
+    The fit of a cell is the same, to the last bit, whether it is fitted alone or with other cells
+    which take more iterations to converge, so the results do not depend on the tiling of the grid.
+    '''
+
+    s = np.array([0.73049168, 1e-3])
+    mean = np.full(2, 3.)
+    shape, scale = sdm.fit_gamma_moments(mean, np.log(mean) - s)
+    shape1, scale1 = sdm.fit_gamma_moments(mean[:1], np.log(mean[:1]) - s[:1])
+
+    assert shape[0] == shape1[0]
+    assert scale[0] == scale1[0]
+
+
+def test_fit_normal_matches_scipy():
+    data = temperature(280., 3., 0.05)
+    fit = sdm.fit_normal(data)
+    loc, scale = scipy.stats.norm.fit(scipy.signal.detrend(data[:, 0]))
+
+    assert int(fit['len']) == 24
+    assert np.isclose(fit['loc'][0], loc, atol=1e-12)
+    assert np.isclose(fit['scale'][0], scale, rtol=1e-12)
+
+
+def test_absolute_sdm_reference():
+    corrected = sdm.absolute_sdm(temperature(280., 3., 0.), temperature(282., 4., 0.02),
+        temperature(284., 4.5, 0.05))
+
+    reference = np.array([
+        [281.932654154524, 281.81567304379], [285.220574625383, 282.669065565577],
+        [283.744294474574, 280.339492759648], [279.719178152506, 284.190972302386],
+        [279.094641071772, 279.222330678529], [282.8382420897, 285.200574034634],
+        [285.518207515619, 278.74100384884], [283.260992292984, 285.487741913314],
+        [279.426032581967, 279.026747865526], [279.68416391448, 285.007756242488],
+        [283.709833854573, 280.035169041468], [285.658037079785, 283.891545544074],
+        [282.727261871945, 281.556408828972], [279.263711347532, 282.415709036975],
+        [280.394105709965, 283.263193235598], [284.515025140965, 280.939186212689],
+        [285.641923590748, 284.785765793653], [282.176502761257, 279.821073702563],
+        [279.248222857232, 285.796547358265], [281.199631369218, 279.338406166146],
+        [285.22452082641, 286.085138944868], [285.479029315626, 279.622726167893],
+        [281.642911874833, 285.606494883985], [279.388700112778, 280.629966064519]])
+    assert np.allclose(corrected, reference, rtol=0, atol=1e-9)
+
+
+def test_relative_sdm_zero_padding_reference():
+    '''
+    The observations are wetter than the model, so more wet days are expected than the scenario
+    has. As in pyCAT, the extra days are padded with zeros: only the wet days of the scenario are wet.
+    '''
+
+    sce = rain(3, 2.5)
+    corrected = sdm.relative_sdm(rain(2, 2.), rain(3, 1.5), sce)
+
+    assert ((corrected >= sdm.LOWER_LIMIT) == (sce >= sdm.LOWER_LIMIT)).all()
+    reference = np.array([
+        [4.7055213003, 20.677083334138, 2.016336236621, 7.741848554455,
+            19.321200767812, 0.90418612604, 10.946331972472, 14.758890951829],
+        [11.311385757834, 5.85475534686, 1.487578727491, 1.123931203689,
+            2.097487918568, 9.520292735353, 15.453591892688, 20.744175159453]])
+    assert np.allclose(corrected[::3].T, reference, rtol=1e-10, atol=0)
+
+
+def test_relative_sdm_fewer_wet_days_reference():
+    '''
+    The observations are drier than the model, so the corrected scenario has fewer wet days,
+    given to its wettest days.
+    '''
+
+    sce = rain(2, 2.5)
+    corrected = sdm.relative_sdm(rain(3, 2.), rain(2, 1.5), sce)
+
+    assert ((corrected >= sdm.LOWER_LIMIT).sum(axis=0) == 8).all()
+    assert (corrected[sce < sdm.LOWER_LIMIT] == 0).all()
+    reference = np.array([
+        [1.282591167324, 18.479706800146, 7.6691008468, 0., 0., 8.803248875009, 17.345027336532,
+            0., 0., 2.23418102354, 18.615861702057, 6.955931163912],
+        [1.222963637446, 0.887296396605, 11.306388523554, 0., 7.552608917456, 2.014473674401, 0.,
+            17.755804106781, 0., 5.308784235703, 3.144866596858, 0.]])
+    assert np.allclose(corrected[::2].T, reference, rtol=1e-10, atol=0)
+
+
+def test_relative_sdm_independent_of_block():
+    '''
+    Correcting the cells together or one at a time gives the same results.
+    '''
+
+    obs, mod, sce = rain(2, 2.), rain(3, 1.5), rain(2, 2.5)
+    corrected = sdm.relative_sdm(obs, mod, sce)
+
+    for cell in range(2):
+        alone = sdm.relative_sdm(obs[:, [cell]], mod[:, [cell]], sce[:, [cell]])
+        assert np.allclose(corrected[:, [cell]], alone, rtol=1e-12, atol=0)
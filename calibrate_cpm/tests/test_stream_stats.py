@@ -0,0 +1,87 @@
+import numpy as np
+from stream_stats import StreamingStats, default_edges
+
+
+def sample():
+    '''
+    Two years of daily temperatures on a 3 x 4 grid, with one cell always masked and a few masked values.
+    '''
+
+    rng = np.random.default_rng(0)
+    months = np.repeat(np.tile(np.arange(1, 13), 2), 30)
+    data = np.ma.masked_array(rng.normal(285., 4., (len(months), 3, 4)) + months[:, None, None])
+    data[:, 2, 3] = np.ma.masked
+    data[rng.random(data.shape) < .05] = np.ma.masked
+
+    return data, months
+
+
+def accumulated(data, months, edges, block_length):
+    stats = StreamingStats(data.shape[1:], edges)
+    for t0 in range(0, data.shape[0], block_length):
+        stats.add(data[t0:t0+block_length], months[t0:t0+block_length])
+
+    return stats
+
+
+def check_quantile(stats, data, q, months=None, selected=None):
+    '''
+    Checks that the q quantile of each valid cell from the histogram is within the width of the widest
+    bin of the sorted values next to it, as the quantiles are estimated with the position q*n rather
+    than q*(n-1) used by numpy.
+    '''
+
+    if selected is not None:
+        data = data[np.isin(months, selected)]
+    result = stats.quantile(q, selected)
+    width = np.diff(stats.edges).max()
+
+    for index in np.ndindex(data.shape[1:]):
+        values = np.sort(data[(slice(None),) + index].compressed())
+        if len(values) == 0:
+            assert result.mask[index]
+            continue
+        k = q * len(values)
+        lower = values[max(int(np.floor(k)) - 1, 0)]
+        upper = values[min(int(np.ceil(k)), len(values) - 1)]
+        assert lower - width <= result[index] <= upper + width
+
+
+def test_against_numpy():
+    data, months = sample()
+    stats = accumulated(data, months, default_edges('K'), 37)
+
+    for selected in [None, [6, 7, 8], [1]]:
+        subset = data if selected is None else data[np.isin(months, selected)]
+
+        assert np.ma.allclose(stats.mean(selected), subset.mean(axis=0), rtol=1e-12)
+        assert np.ma.allclose(stats.variance(selected), subset.var(axis=0), rtol=1e-10)
+        assert np.ma.allclose(stats.variance(selected, ddof=1), subset.var(axis=0, ddof=1), rtol=1e-10)
+        assert np.ma.allclose(stats.minimum(selected), subset.min(axis=0))
+        assert np.ma.allclose(stats.maximum(selected), subset.max(axis=0))
+        for q in [0., .1, .5, .99, 1.]:
+            check_quantile(stats, data, q, months, selected)
+
+# Only the cell which is always masked is masked
+        for statistic in [stats.mean(selected), stats.quantile(.5, selected)]:
+            assert np.ma.getmaskarray(statistic)[2, 3]
+            assert np.ma.getmaskarray(statistic).sum() == 1
+
+
+def test_independent_of_blocks():
+    data, months = sample()
+    edges = default_edges('K')
+    one_block = accumulated(data, months, edges, data.shape[0])
+    small_blocks = accumulated(data, months, edges, 7)
+
+    assert np.ma.allclose(one_block.mean(), small_blocks.mean(), rtol=1e-12)
+    assert np.ma.allclose(one_block.variance(), small_blocks.variance(), rtol=1e-10)
+    assert (one_block.histogram == small_blocks.histogram).all()
+
+
+def test_uneven_bins():
+    data, months = sample()
+    stats = accumulated(data, months, np.concatenate([[220.], np.geomspace(250., 330., 150)]), 100)
+
+    for q in [.05, .5, .95]:
+        check_quantile(stats, data, q)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import iris
+import iris.cube
+from iris.coords import DimCoord, AuxCoord
+from timeseries_writer import TimeSeriesWriter
+
+
+def block(first_day, ndays, units='days since 1980-12-01'):
+    '''
+    A cube of ndays daily values from first_day (in days since 1980-12-01), with time bounds,
+    an auxiliary coordinate along time, and some masked values.
+    '''
+
+    days = np.arange(first_day, first_day + ndays, dtype=np.float64)
+    time = DimCoord(days + .5, standard_name='time', units='days since 1980-12-01',
+        bounds=np.stack([days, days + 1], axis=1))
+    time.convert_units(units)
+    y = DimCoord(np.arange(4.), long_name='y')
+    x = DimCoord(np.arange(3.), long_name='x')
+
+    data = np.ma.masked_array(100 * days[:, None, None] + np.arange(12.).reshape(4, 3), dtype=np.float32)
+    data[:, 0, 0] = np.ma.masked
+    cube = iris.cube.Cube(data, standard_name='air_temperature', units='K', var_name='tasmax',
+        dim_coords_and_dims=[(time, 0), (y, 1), (x, 2)])
+    cube.add_aux_coord(AuxCoord(days.astype(np.int32) % 7, long_name='weekday'), 0)
+
+    return cube
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / 'series.nc')
+    blocks = [block(0, 45), block(45, 30, units='hours since 1981-01-01'), block(75, 10)]
+
+    writer = TimeSeriesWriter(filename, chunk_length=7)
+    for cube in blocks:
+        writer.append(cube)
+    writer.close()
+
+    result = iris.load_cube(filename)
+    expected = np.ma.concatenate([cube.data for cube in blocks])
+    assert result.shape == (85, 4, 3)
+    assert (np.ma.getmaskarray(result.data) == np.ma.getmaskarray(expected)).all()
+    assert np.array_equal(result.data.compressed(), expected.compressed())
+
+    time = result.coord('time')
+    assert time.units == blocks[0].coord('time').units
+    assert np.allclose(time.points, np.arange(85) + .5)
+    assert np.allclose(time.bounds[:, 0], np.arange(85))
+    assert np.array_equal(result.coord('weekday').points, np.arange(85) % 7)
+
+
+def test_blocks_out_of_order(tmp_path):
+    writer = TimeSeriesWriter(str(tmp_path / 'series.nc'))
+    writer.append(block(30, 30))
+    with pytest.raises(ValueError):
+        writer.append(block(0, 30))
+    writer.close()
@@ -0,0 +1,120 @@
+'''
+Bias correction of large regions in tiles of grid columns, so that the memory needed is
+set by the size of a tile rather than by the size of the region.
+
+The monthly output files are created first, at their full size, with the metadata of the
+scenario. The grid is then split into blocks of columns (along the last, x, dimension)
+small enough for the obs, model baseline and scenario data of a block to fit in a memory
+budget. For each tile only its columns are read from the input files, corrected by
+parallel_sdm.correct_months, and written into the same columns of the output files.
+
+Each grid cell is corrected independently, so the results are the same as correcting the
+whole grid at once.
+'''
+
+import os
+import datetime
+import numpy as np
+import dask.array as da
+import iris
+import netCDF4
+import parallel_sdm
+import time_index
+import window_sdm
+import bc_filenames
+
+
+def columns_per_tile(obs, mod, sce, memory_mb, nworkers=1):
+    '''
+    Returns the number of grid columns in each tile, so that the data of a tile fit in memory_mb MB.
+
+    Each of obs, mod and sce is counted as read, in its own type, and as the float64 copy made by
+    parallel_sdm.correct_months, which also holds the corrected data as float64. With more than
+    one worker these four float64 arrays are copied again into shared memory, and the corrected
+    data copied back out of it. The copy of the scenario cube holding the result is counted too,
+    as are the working arrays of the method, about eight float64 arrays the size of one month of
+    the data, for each worker correcting a month at the same time.
+    '''
+
+    copies = 2 if nworkers > 1 else 1
+    working = 8 * 8 * nworkers / 12
+    obs_bytes = obs.dtype.itemsize + 8 * copies + working
+    mod_bytes = mod.dtype.itemsize + 8 * copies + working
+    sce_bytes = 2 * sce.dtype.itemsize + 16 * copies + (8 if nworkers > 1 else 0) + working
+
+    nbytes = obs.shape[0] * obs_bytes + mod.shape[0] * mod_bytes + sce.shape[0] * sce_bytes
+    bytes_per_column = int(nbytes * np.prod(sce.shape[1:-1]))
+
+    return int(max(1, min(sce.shape[-1], memory_mb * 2**20 // bytes_per_column)))
+
+
+def create_monthly_files(sce, var_name, dout, ncols, engine='sdm'):
+    '''
+    Creates the monthly output files, filled with zeros, with the coordinates of the scenario.
+    The data are chunked by tile, so each tile is written to whole chunks. Returns, for each
+    month, the open file, the name of its data variable and the times of the scenario in it.
+    '''
+
+    index = time_index.TimeIndex(sce)
+    outputs = []
+    for month_number, rows in index.by_month().items():
+        sce_mth = sce[rows]
+        if sce_mth.var_name is None:
+            sce_mth.var_name = sce_mth.name()
+
+# The zeros are lazy, so iris writes them one chunk at a time
+        sce_mth.data = da.zeros(sce_mth.shape, dtype=sce_mth.dtype, chunks=(30,) + sce_mth.shape[1:])
+        filename = os.path.join(dout, bc_filenames.monthly_filename(var_name, sce_mth, month_number, engine))
+        iris.save(sce_mth, filename, chunksizes=(min(30, len(rows)),) + sce_mth.shape[1:-1] + (ncols,))
+        outputs.append((netCDF4.Dataset(filename, 'a'), sce_mth.var_name, rows))
+
+    return outputs
+
+
+def correct_in_tiles(obs_filename, mod_filename, sce_filename, var_name, dout, memory_mb=1500,
+    nworkers=None, engine='sdm', **kwargs):
+    '''
+    Bias-corrects the scenario data one tile of grid columns at a time, and writes one file per
+    calendar month to directory dout, as BC_timeslice_run.correct_by_month does.
+
+    obs_filename -- The observations for the baseline period
+    mod_filename -- The model data for the baseline period, on the same grid
+    sce_filename -- The model data to be corrected, on the same grid
+    var_name -- The name of the variable, used in the names of the output files
+    dout -- The directory for the output files
+    memory_mb -- The memory budget for the data of a tile, in MB
+    nworkers -- The number of processes correcting each tile, passed to parallel_sdm.correct_months
+    engine -- 'sdm' or 'isimip3', passed to parallel_sdm.correct_months, or 'window' for SDM in moving
+        windows of days with window_sdm.correct_windows, which also names the files
+    kwargs -- Passed to parallel_sdm.correct_months, e.g. block_size, cdf_threshold, lower_limit
+    '''
+
+# The cubes are lazy, so only the columns of each tile are read
+    obs = iris.load_cube(obs_filename)
+    mod = iris.load_cube(mod_filename)
+    sce = iris.load_cube(sce_filename)
+
+    if nworkers is None:
+        nworkers = parallel_sdm.available_cpus()
+
+    nx = sce.shape[-1]
+    ncols = columns_per_tile(obs, mod, sce, memory_mb, nworkers)
+    print(f'Correcting {nx} columns in tiles of {ncols}')
+
+    outputs = create_monthly_files(sce, var_name, dout, ncols, engine)
+    try:
+        for x0 in range(0, nx, ncols):
+            x1 = min(x0 + ncols, nx)
+            print(f'calibrating columns {x0}-{x1-1}: '+datetime.datetime.now().strftime("%H:%M:%S"))
+            if engine == 'window':
+                corrected = window_sdm.correct_windows(obs[..., x0:x1], mod[..., x0:x1], sce[..., x0:x1],
+                    nworkers=nworkers, **kwargs)
+            else:
+                corrected = parallel_sdm.correct_months(obs[..., x0:x1], mod[..., x0:x1], sce[..., x0:x1],
+                    nworkers=nworkers, engine=engine, **kwargs)
+            data = corrected.data
+            for ds, data_name, rows in outputs:
+                ds.variables[data_name][..., x0:x1] = data[rows]
+    finally:
+        for ds, data_name, rows in outputs:
+            ds.close()
@@ -0,0 +1,122 @@
+'''
+An index of the times of a cube by year, month and day of the year, for selecting the
+times of a calendar month, a season or a window of days around a day of the year.
+
+The time coordinate is decoded once into integer arrays. On the 360-day calendar of
+the UKCP18 projections this is done arithmetically, as every month has 30 days, so no
+datetime objects are made. The groups are arrays of indices, which can be used to index
+the time dimension of a cube or an array directly, e.g.
+
+    index = TimeIndex(cube)
+    january = cube[index.month(1)]
+    for month_number, rows in index.by_month().items():
+        ...
+
+rather than extracting each group with an iris.Constraint on the time points, which
+converts every point to a datetime in Python each time.
+'''
+
+import numpy as np
+import cf_units
+from iris.coords import AuxCoord
+
+SEASONS = {'djf': [12, 1, 2], 'mam': [3, 4, 5], 'jja': [6, 7, 8], 'son': [9, 10, 11]}
+
+
+class TimeIndex:
+
+    def __init__(self, cube):
+        '''
+        cube -- A cube with a time coordinate. Only the points of the coordinate are read.
+        '''
+
+        time = cube.coord('time')
+        self.calendar = time.units.calendar
+        if self.calendar == '360_day':
+            self.year, self.month_number, self.day = self._decode_360_day(time)
+            self.day_of_year = (self.month_number - 1) * 30 + self.day
+            self.days_in_year = 360
+        else:
+            dates = time.units.num2date(time.points)
+            self.year = np.array([d.year for d in dates])
+            self.month_number = np.array([d.month for d in dates])
+            self.day = np.array([d.day for d in dates])
+            self.day_of_year = np.array([d.timetuple().tm_yday for d in dates])
+            self.days_in_year = 366
+
+    @staticmethod
+    def _decode_360_day(time):
+        '''
+        Returns the year, month and day of each point of a time coordinate on the 360-day calendar.
+        '''
+
+# Count the days from year 0 to the epoch of the units, and add the time since the epoch
+        epoch = time.units.num2date(0)
+        epoch_day = epoch.year * 360 + (epoch.month - 1) * 30 + (epoch.day - 1) \
+            + (epoch.hour * 3600 + epoch.minute * 60 + epoch.second) / 86400.
+        step = cf_units.Unit(time.units.origin.split(' since ')[0])
+        days = np.floor(epoch_day + step.convert(time.points, 'days') + 1e-6).astype(np.int64)
+
+        return days // 360, (days % 360) // 30 + 1, days % 30 + 1
+
+    def day_of_360_day_year(self):
+        '''
+        Returns the day of the year of each time on the 360-day calendar (1 to 360), so that the
+        dates of other calendars (e.g. of the HadUK-Grid observations) line up with the days of the
+        UKCP18 projections: day d of month m is day (m-1)*30 + d, with days 31 counted as day 30.
+        '''
+
+        return (self.month_number - 1) * 30 + np.minimum(self.day, 30)
+
+    def month(self, month_number):
+        '''
+        Returns the indices of the times in the given calendar month (1 to 12).
+        '''
+
+        return np.nonzero(self.month_number == month_number)[0]
+
+    def season(self, season):
+        '''
+        Returns the indices of the times in a season, given by the initials of its months
+        ('djf', 'mam', 'jja' or 'son').
+        '''
+
+        return np.nonzero(np.isin(self.month_number, SEASONS[season.lower()]))[0]
+
+    def window(self, day_of_year, half_width):
+        '''
+        Returns the indices of the times within half_width days of a day of the year, in any
+        year. The window wraps around the end of the year.
+        '''
+
+        distance = np.abs(self.day_of_year - day_of_year)
+        distance = np.minimum(distance, self.days_in_year - distance)
+
+        return np.nonzero(distance <= half_width)[0]
+
+    def by_month(self):
+        '''
+        Returns a dictionary of the indices of the times in each calendar month present.
+        '''
+
+        return {int(m): self.month(m) for m in np.unique(self.month_number)}
+
+    def by_season(self):
+        '''
+        Returns a dictionary of the indices of the times in each season present.
+        '''
+
+        groups = {season: self.season(season) for season in SEASONS}
+
+        return {season: rows for season, rows in groups.items() if len(rows) > 0}
+
+    def add_coords(self, cube):
+        '''
+        Adds month_number and year coordinates along the time dimension of cube, as
+        iris.coord_categorisation.add_month_number and add_year do, if not already present.
+        '''
+
+        tdim = cube.coord_dims('time')
+        for name, values in [('month_number', self.month_number), ('year', self.year)]:
+            if len(cube.coords(var_name=name)) == 0:
+                cube.add_aux_coord(AuxCoord(values, long_name=name, var_name=name, units='1'), tdim)
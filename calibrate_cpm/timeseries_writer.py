@@ -0,0 +1,115 @@
+'''
+Writes a long time series to a NetCDF file one block of times at a time, so that the
+memory needed depends on the size of a block, not on the length of the series.
+
+The file is created by iris from the first block, with an unlimited time dimension
+and the final chunking and compression. The data and the coordinates along the time
+dimension of each later block are then appended with netCDF4. The blocks must be
+on the same grid as the first one, and be given in time order.
+
+Example:
+    writer = TimeSeriesWriter(filename)
+    for cube in blocks:
+        writer.append(cube)
+    writer.close()
+'''
+
+import numpy as np
+import iris
+import netCDF4
+
+
+class TimeSeriesWriter:
+
+    def __init__(self, filename, chunk_length=30, zlib=True, complevel=4):
+        '''
+        filename -- The NetCDF file to write
+        chunk_length -- The number of times in each chunk of the data variable in the file
+        zlib -- If True, compress the data
+        complevel -- The level of compression, 1 to 9
+        '''
+
+        self.filename = filename
+        self.chunk_length = chunk_length
+        self.zlib = zlib
+        self.complevel = complevel
+
+        self.ds = None
+        self.time_units = None
+        self.variables = {}
+        self.last_time = None
+        self.ntimes = 0
+
+    def _create(self, cube):
+        '''
+        Creates the file from the first block, and finds the variables in it which
+        have to be extended along the time dimension.
+        '''
+
+        cube = cube.copy()
+        tdim = cube.coord_dims('time')[0]
+        if tdim != 0:
+            raise ValueError('Time must be the first dimension of the cubes to be written')
+
+# Give the cube and its time-varying coordinates explicit names, so the same variables
+# can be found in the file
+        if cube.var_name is None:
+            cube.var_name = cube.name()
+        time_coords = cube.coords(contains_dimension=0)
+        for coord in time_coords:
+            if coord.var_name is None:
+                coord.var_name = coord.name()
+
+        chunksizes = (self.chunk_length,) + cube.shape[1:]
+        iris.save(cube, self.filename, unlimited_dimensions=['time'], zlib=self.zlib, complevel=self.complevel,
+            chunksizes=chunksizes)
+
+        self.ds = netCDF4.Dataset(self.filename, 'a')
+        self.time_units = cube.coord('time').units
+        self.variables[cube.var_name] = None
+        for coord in time_coords:
+            self.variables[coord.var_name] = (coord.name(), False)
+            bounds_name = getattr(self.ds.variables[coord.var_name], 'bounds', None)
+            if bounds_name is not None:
+                self.variables[bounds_name] = (coord.name(), True)
+        self.ntimes = cube.shape[0]
+
+    def append(self, cube):
+        '''
+        Writes a block of times to the end of the file. The block must start after the last
+        time already written.
+        '''
+
+        time = cube.coord('time')
+        if self.ds is None:
+            self._create(cube)
+        else:
+            if time.units != self.time_units:
+                time = time.copy()
+                time.convert_units(self.time_units)
+            if time.points[0] <= self.last_time:
+                raise ValueError('Blocks must be appended in time order')
+
+            i0 = self.ntimes
+            i1 = i0 + cube.shape[0]
+            for name, source in self.variables.items():
+                if source is None:
+                    values = cube.data
+                else:
+                    coord_name, is_bounds = source
+                    coord = time if coord_name == 'time' else cube.coord(coord_name)
+                    values = coord.bounds if is_bounds else coord.points
+                self.ds.variables[name][i0:i1] = values
+            self.ntimes = i1
+
+        self.last_time = time.points[-1]
+        self.ds.sync()
+
+    def close(self):
+        '''
+        Closes the file.
+        '''
+
+        if self.ds is not None:
+            self.ds.close()
+            self.ds = None
@@ -5,6 +5,10 @@ import getpass
 import matplotlib.pyplot as plt
 import iris.plot as iplt
 import load_data
+import time_index
+import stream_stats
+import region_mask
+import grid_descriptor
 from matplotlib.colors import Normalize
 import matplotlib.cm as cm
 
@@ -68,7 +72,33 @@ def load_raw_cpm(user_id, ensemble_member, var_name, year_range):
     return clist.concatenate_cube()
 
 
-def check_bias_correction(user_id, var_name, ensemble_member, year_range):
+def field_cube(cube, values):
+    '''
+    Returns a cube of a statistic over time of a cube with time as its first dimension, e.g. a mean
+    from stream_stats, with the coordinates of the cube other than time.
+    '''
+
+    field = cube[0].copy(data=values)
+    for coord in cube.coords():
+        if cube.coord_dims(coord) == (0,):
+            field.remove_coord(coord.name())
+
+    return field
+
+
+def check_bias_correction(user_id, var_name, ensemble_member, year_range, season=None,
+    project_name='CReDo', region_name='East_Anglia'):
+    '''
+    Plots the long-term means of the observations and the raw and calibrated CPM data, and the
+    bias and changes. The data are read in blocks of times, accumulating the statistics of each
+    cell and month (see stream_stats.py), so the memory used does not depend on the length of
+    the period. Returns the figure, which is not shown so it can be saved or shown by the caller,
+    and the StreamingStats of the observations, raw baseline, raw scenario and calibrated scenario.
+
+    season -- Optionally compare one season only, e.g. 'jja'
+    project_name, region_name -- The project and region, whose grid the maps of data in the
+        compact (time, cell) layout of region_mask.py are drawn on
+    '''
 
     fdir = '/home/h03/hadmi/Python/CLIMAR/figures/'
 
@@ -92,11 +122,33 @@ def check_bias_correction(user_id, var_name, ensemble_member, year_range):
     print('Loading calibrated model scenario ...')
     cpm_scen_cal = load_data.load_corrected_UKCP18_cpm_data(user_id, var_name, year_range, ensemble_member, monstart=monstart, monend=monend)
 
+# Accumulate the statistics of each cell and month, reading each dataset one block of times at a time
+    print('Accumulating statistics ...')
+    cubes = [obs_base, cpm_base_raw, cpm_scen_raw, cpm_scen_cal]
+    stats = [stream_stats.accumulate(cube) for cube in cubes]
+
+# Optionally compare one season only, e.g. 'jja'
+    months = None if season is None else time_index.SEASONS[season]
+
 # Plot the long-term averages of the observed and modelled data
-    obs_lta = obs_base.collapsed('time', iris.analysis.MEAN)
-    cpm_base_raw_lta = cpm_base_raw.collapsed('time', iris.analysis.MEAN)
-    cpm_scen_raw_lta = cpm_scen_raw.collapsed('time', iris.analysis.MEAN)
-    cpm_scen_cal_lta = cpm_scen_cal.collapsed('time', iris.analysis.MEAN)
+    ltas = [field_cube(cube, s.mean(months)) for cube, s in zip(cubes, stats)]
+
+# Fields of data in the compact layout are put on the grid of the region to be mapped
+    if any(region_mask.is_compressed(lta) for lta in ltas):
+        grid = grid_descriptor.load_region_grid(project_name, region_name)
+        ltas = [region_mask.expand_field(lta, grid) if region_mask.is_compressed(lta) else lta for lta in ltas]
+    obs_lta, cpm_base_raw_lta, cpm_scen_raw_lta, cpm_scen_cal_lta = ltas
+
+    fig = plot_bias_correction(obs_lta, cpm_base_raw_lta, cpm_scen_raw_lta, cpm_scen_cal_lta)
+
+    return fig, stats
+
+
+def plot_bias_correction(obs_lta, cpm_base_raw_lta, cpm_scen_raw_lta, cpm_scen_cal_lta):
+    '''
+    Plots maps of the long-term averages of the observations and the raw CPM baseline and scenario
+    in the left column, and the bias, calibrated change and raw change in the right. Returns the figure.
+    '''
 
     mx = max([obs_lta.data.max(), cpm_base_raw_lta.data.max(), cpm_scen_cal_lta.data.max()])
     mn = min([obs_lta.data.min(), cpm_base_raw_lta.data.min(), cpm_scen_cal_lta.data.min()])
@@ -163,7 +215,7 @@ def check_bias_correction(user_id, var_name, ensemble_member, year_range):
     cbar_ax = fig.add_axes(cbar_pos)
     fig.colorbar(im, cax=cbar_ax, orientation='horizontal', norm=normalizer)
 
-    plt.show()
+    return fig
 
 
 if __name__ == '__main__':
@@ -174,4 +226,5 @@ if __name__ == '__main__':
     year_range = [1980, 2000]
 #   year_range = [2060, 2080]
 
-    check_bias_correction(user_id, var_name, ensemble_member, year_range)
+    fig, stats = check_bias_correction(user_id, var_name, ensemble_member, year_range)
+    plt.show()